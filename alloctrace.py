@@ -0,0 +1,167 @@
+# Mariana
+# Code - Matt Madden
+# alloctrace.py -- Counts the memory allocations made each frame using tracemalloc
+
+import os
+import time
+import tracemalloc
+
+
+class AllocationTracker():
+    """
+    Measures how much each frame allocates, for finding garbage made by the main loop
+    At the end of every frame a tracemalloc snapshot is compared with the one from the start of the frame,
+    which gives the blocks still alive that were allocated during the frame, grouped by the line that made them
+    Things that are allocated and freed again within the frame (a temporary rect for example) are gone by the
+    time the snapshot is taken, so for those we record tracemalloc's peak for each phase of the frame instead,
+    which is the most extra memory that was alive at once
+    This is slow, only turn it on when you're looking for allocations
+    """
+
+    def __init__(self, directory="data/profiles", warmup_frames=60, top=15):
+        """
+        The first warmup_frames frames aren't counted since that's when caches are still filling up
+        """
+        self.directory = directory
+        self.warmup_frames = warmup_frames
+        self.top = top
+
+        self.frame_number = 0
+        self.snapshot = None
+        self.phase_name = None
+        self.phase_start = 0
+
+        # Per counted frame, the number of blocks and bytes still alive at the end of the frame
+        self.frame_blocks = []
+        self.frame_bytes = []
+
+        # Peak bytes allocated on top of what was alive when the phase started, summed over the counted frames
+        self.phase_peak_bytes = {}
+        self.phase_peak_max = {}
+
+        # Line -> blocks allocated from that line that were still alive at the end of a frame, summed over the counted frames
+        self.site_blocks = {}
+        self.site_bytes = {}
+
+        self.filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        # Filtering compiles and caches some patterns the first time, get that out of the way before counting
+        tracemalloc.take_snapshot().filter_traces(self.filters)
+
+    def stop(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.snapshot = None
+
+    def is_counting(self):
+        return self.frame_number >= self.warmup_frames
+
+    def begin_frame(self, phase_name="frame"):
+        """
+        Call at the start of every frame of the main loop, phase_name is the name of the first phase of the frame
+        """
+        if self.is_counting():
+            self.snapshot = tracemalloc.take_snapshot().filter_traces(self.filters)
+        self.phase_name = None
+        self.phase(phase_name)
+
+    def phase(self, name):
+        """
+        Marks the start of a part of the frame like "input" or "render", the peak of the part before it is recorded
+        """
+        if self.phase_name is not None and self.is_counting():
+            current, peak = tracemalloc.get_traced_memory()
+            extra = peak - self.phase_start
+            self.phase_peak_bytes[self.phase_name] = self.phase_peak_bytes.get(self.phase_name, 0) + extra
+            self.phase_peak_max[self.phase_name] = max(self.phase_peak_max.get(self.phase_name, 0), extra)
+        self.phase_name = name
+        tracemalloc.reset_peak()
+        self.phase_start = tracemalloc.get_traced_memory()[0]
+
+    def end_frame(self):
+        """
+        Call at the end of every frame of the main loop
+        """
+        self.phase(None)
+        if self.snapshot is not None:
+            after = tracemalloc.take_snapshot().filter_traces(self.filters)
+            blocks = 0
+            size = 0
+            for stat in after.compare_to(self.snapshot, "lineno"):
+                if stat.count_diff <= 0:
+                    continue
+                site = str(stat.traceback[0])
+                blocks += stat.count_diff
+                size += stat.size_diff
+                self.site_blocks[site] = self.site_blocks.get(site, 0) + stat.count_diff
+                self.site_bytes[site] = self.site_bytes.get(site, 0) + stat.size_diff
+            self.frame_blocks.append(blocks)
+            self.frame_bytes.append(size)
+            self.snapshot = None
+        self.frame_number += 1
+
+    def report(self):
+        """
+        Returns a dict summarizing the counted frames
+        """
+        frames = len(self.frame_blocks)
+        results = {"frames": frames}
+        if frames == 0:
+            return results
+        results["blocks_per_frame"] = sum(self.frame_blocks) / frames
+        results["bytes_per_frame"] = sum(self.frame_bytes) / frames
+        results["max_blocks_in_a_frame"] = max(self.frame_blocks)
+        phases = {}
+        for name in self.phase_peak_bytes:
+            phases[name] = {"mean_peak_bytes": self.phase_peak_bytes[name] / frames, "max_peak_bytes": self.phase_peak_max[name]}
+        results["phases"] = phases
+        sites = []
+        for site in sorted(self.site_blocks, key=lambda site: self.site_blocks[site], reverse=True)[:self.top]:
+            sites.append({"site": site, "blocks_per_frame": self.site_blocks[site] / frames, "bytes_per_frame": self.site_bytes[site] / frames})
+        results["sites"] = sites
+        return results
+
+    def assert_budget(self, blocks_per_frame, peak_bytes_per_frame=None):
+        """
+        Raises an AssertionError if the counted frames allocated more than the budget on average
+        blocks_per_frame is for allocations still alive at the end of the frame, peak_bytes_per_frame is
+        for the largest phase peak of any single frame
+        """
+        results = self.report()
+        if results["frames"] == 0:
+            raise AssertionError("No frames were counted, run more than " + str(self.warmup_frames) + " frames")
+        problems = []
+        if results["blocks_per_frame"] > blocks_per_frame:
+            problems.append("{0:.1f} blocks per frame, budget is {1}".format(results["blocks_per_frame"], blocks_per_frame))
+            for site in results["sites"][:5]:
+                problems.append("    {0:.1f} blocks per frame from {1}".format(site["blocks_per_frame"], site["site"]))
+        if peak_bytes_per_frame is not None:
+            for name in results["phases"]:
+                if results["phases"][name]["max_peak_bytes"] > peak_bytes_per_frame:
+                    problems.append("{0} phase peaked at {1} bytes, budget is {2}".format(name, results["phases"][name]["max_peak_bytes"], peak_bytes_per_frame))
+        if len(problems) != 0:
+            raise AssertionError("Allocation budget exceeded:\n" + "\n".join(problems))
+
+    def write_report(self):
+        """
+        Writes the report to allocs-<time>.txt in the profile directory and returns the path
+        """
+        results = self.report()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "allocs-" + time.strftime("%Y%m%d-%H%M%S") + ".txt")
+        report_file = open(path, "w")
+        report_file.write("Allocations over " + str(results["frames"]) + " frames\n")
+        if results["frames"] != 0:
+            report_file.write("{0:.1f} blocks / {1:.0f} bytes still alive at the end of each frame\n".format(results["blocks_per_frame"], results["bytes_per_frame"]))
+            report_file.write("\nPeak bytes allocated within each phase (mean / max)\n")
+            for name in results["phases"]:
+                phase = results["phases"][name]
+                report_file.write("    {0}: {1:.0f} / {2}\n".format(name, phase["mean_peak_bytes"], phase["max_peak_bytes"]))
+            report_file.write("\nTop allocation sites (blocks per frame, bytes per frame)\n")
+            for site in results["sites"]:
+                report_file.write("    {0:.2f}, {1:.0f}: {2}\n".format(site["blocks_per_frame"], site["bytes_per_frame"], site["site"]))
+        report_file.close()
+        return path
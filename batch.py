@@ -0,0 +1,147 @@
+# Mariana
+# Code - Matt Madden
+# batch.py -- Runs many headless simulations across a process pool, for tuning movement constants and soak tests
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import time
+import entities
+import inputqueue
+import simulation
+
+
+def random_inputs(seed, ticks, hold_time=30):
+    """
+    Makes a random input script for soak tests
+    Returns a list of (tick, events) entries where events is a list of (event type, action id, value)
+    Every hold_time ticks on average the stick and buttons change
+    """
+    rng = random.Random(seed)
+    held = [False, False]
+    script = []
+    tick = 0
+    while tick < ticks:
+        events = []
+        for action in [inputqueue.ACTION_PLAYER_HORIZ, inputqueue.ACTION_PLAYER_VERT]:
+            if rng.random() < 0.5:
+                events.append((inputqueue.EVENT_AXIS_MOVED, action, rng.choice([-1, 0, 1, rng.uniform(-1, 1)])))
+        for action in [inputqueue.ACTION_FISH_DASH, inputqueue.ACTION_FISH_SPRINT]:
+            if rng.random() < 0.3:
+                index = action - inputqueue.ACTION_FISH_DASH
+                held[index] = not held[index]
+                if held[index]:
+                    events.append((inputqueue.EVENT_BUTTON_DOWN, action, 1))
+                else:
+                    events.append((inputqueue.EVENT_BUTTON_UP, action, 0))
+        script.append((tick, events))
+        tick += rng.randint(1, hold_time * 2)
+    return script
+
+
+def run_simulation(config):
+    """
+    Runs one headless simulation and returns a dict of results
+    config is a dict with these keys (only map is required)
+        map        the map file to load
+        gfx_path   folder holding the map's tileset metadata
+        ticks      how many updates to run
+        delta      the delta passed to each update, 1 is one frame at 60 fps
+        constants  dict of player constant overrides such as {"MAX_VEL": 6}
+        inputs     list of (tick, events) entries, events are fed to the level at the start of that tick
+        seed       if inputs isn't given, random inputs are made from this seed
+    """
+    ticks = config.get("ticks", 3600)
+    delta = config.get("delta", 1)
+    inputs = config.get("inputs")
+    if inputs is None:
+        inputs = random_inputs(config.get("seed", 0), ticks)
+
+    sim = simulation.Simulation(config["map"], config.get("gfx_path", "res/gfx/"))
+
+    # Constants live on the class, so overrides are done with a subclass
+    constants = config.get("constants", {})
+    if len(constants) != 0:
+        tuned_class = type("TunedPlayer", (entities.Player,), dict(constants, __slots__=()))
+        tuned = tuned_class()
+        for name in entities.Player.__slots__ + entities.Entity.__slots__:
+            setattr(tuned, name, getattr(sim.player, name))
+        sim.player = tuned
+
+    queue = inputqueue.InputQueue()
+    next_input = 0
+    collisions = 0
+    distance = 0
+    start = time.perf_counter()
+    for tick in range(0, ticks):
+        queue.begin_frame(0)
+        while next_input < len(inputs) and inputs[next_input][0] <= tick:
+            for event in inputs[next_input][1]:
+                queue.push(event[0], event[1], event[2], 0)
+            next_input += 1
+        before_x = sim.player.x
+        before_y = sim.player.y
+        sim.update(delta, queue)
+        distance += abs(sim.player.x - before_x) + abs(sim.player.y - before_y)
+        if sim.player.on_wall:
+            collisions += 1
+    elapsed = time.perf_counter() - start
+
+    return {
+        "map": config["map"],
+        "constants": constants,
+        "seed": config.get("seed", 0),
+        "ticks": ticks,
+        "seconds": elapsed,
+        "ticks_per_second": ticks / elapsed if elapsed > 0 else 0,
+        "final_x": sim.player.x,
+        "final_y": sim.player.y,
+        "distance": distance,
+        "ticks_on_wall": collisions
+    }
+
+
+def run_batch(configs, processes=None):
+    """
+    Runs every config in configs across a process pool and returns the results in the same order
+    """
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(run_simulation, configs)
+
+
+def parse_constant(text):
+    """
+    Turns "NAME=1,2,3" into ("NAME", [1.0, 2.0, 3.0])
+    """
+    name = text[:text.index("=")]
+    values = [float(value) for value in text[(text.index("=") + 1):].split(",")]
+    return (name, values)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run headless mariana simulations in parallel")
+    parser.add_argument("map", help="map file to simulate")
+    parser.add_argument("--gfx-path", default="res/gfx/", help="folder holding the tileset metadata")
+    parser.add_argument("--ticks", type=int, default=3600, help="updates per simulation")
+    parser.add_argument("--runs", type=int, default=1, help="random input seeds to run for each set of constants")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, defaults to the cpu count")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=V1,V2", help="player constant values to try, every combination is run")
+    args = parser.parse_args()
+
+    # Make a config for every combination of constants and every seed
+    constants = [parse_constant(text) for text in args.set]
+    names = [constant[0] for constant in constants]
+    configs = []
+    for values in itertools.product(*[constant[1] for constant in constants]):
+        for seed in range(0, args.runs):
+            configs.append({"map": args.map, "gfx_path": args.gfx_path, "ticks": args.ticks, "seed": seed, "constants": dict(zip(names, values))})
+
+    json.dump(run_batch(configs, args.processes), sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,564 @@
+# Mariana
+# Code - Matt Madden
+# benchmark.py -- Benchmarks for the hot parts of the game on synthetic maps of increasing size, results are written as JSON
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks render to a hidden window
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+import alloctrace
+import entities
+import game
+import inputqueue
+import map
+import particles
+import scheduler
+import simulation
+
+TILESET_NAME = "bench"
+
+
+class LegacyEntity():
+    """
+    Copy of the way Entity used to be laid out, with every constant in the instance dict
+    and a new rect made on every as_rect() call. Only here so we have something to compare against
+    """
+
+    def __init__(self):
+        self.x = 0
+        self.y = 0
+        self.w = 8
+        self.h = 8
+        self.dx = 0
+        self.dy = 0
+        self.MAX_VEL = 2
+        self.ax = 0
+        self.ay = 0
+        self.MAX_ACC = 0.05
+        self.DEC_SPEED = 0.02
+        self.lifetime = 90
+
+    def as_rect(self):
+        return pygame.Rect(self.x, self.y, self.w, self.h)
+
+
+"""
+SYNTHETIC DATA
+"""
+
+
+def write_tileset(directory):
+    """
+    Writes a small tileset and its metadata to <directory>/res/gfx, plus the fish image the game draws
+    Tile 1 is floor, tile 2 is an opaque wall, tile 3 is a see-through wall
+    Special tile 4 is a collider and special tile 5 is the player spawn
+    """
+    gfx_path = os.path.join(directory, "res", "gfx")
+    os.makedirs(gfx_path, exist_ok=True)
+
+    tileset = pygame.Surface((64 * 4, 64), pygame.SRCALPHA)
+    tileset.fill((20, 40, 90, 255), (0, 0, 64, 64))
+    tileset.fill((70, 60, 50, 255), (64, 0, 64, 64))
+    tileset.fill((70, 60, 50, 128), (128, 0, 64, 64))
+    tileset.fill((255, 0, 255, 255), (192, 0, 64, 64))
+    pygame.image.save(tileset, os.path.join(gfx_path, TILESET_NAME + ".png"))
+
+    meta_file = open(os.path.join(gfx_path, TILESET_NAME + ".txt"), "w")
+    meta_file.write("alphas=2,3\nplayer=5\ncolliders=4\n")
+    meta_file.close()
+
+    fish = pygame.Surface((20, 36))
+    fish.fill((255, 200, 0))
+    pygame.image.save(fish, os.path.join(gfx_path, "fish_0.png"))
+
+
+def write_map(filename, size, density, seed=0):
+    """
+    Writes a size by size map where roughly density of the tiles are walls with colliders
+    The border is always walled off and the player spawns in the middle
+    """
+    rng = random.Random(seed)
+    walls = []
+    for y in range(0, size):
+        row = []
+        for x in range(0, size):
+            row.append(x == 0 or y == 0 or x == size - 1 or y == size - 1 or rng.random() < density)
+        walls.append(row)
+    middle = size // 2
+    walls[middle][middle] = False
+
+    lines = ["tileset=" + TILESET_NAME, "width=" + str(size), "height=" + str(size), "layer=floor"]
+    floor_row = ",".join(["1"] * size)
+    for y in range(0, size):
+        lines.append(floor_row)
+    lines.append("layer=wall")
+    for y in range(0, size):
+        # Mix opaque and see-through walls so both render paths get used
+        lines.append(",".join([("2" if (x + y) % 4 != 0 else "3") if walls[y][x] else "0" for x in range(0, size)]))
+    lines.append("layer=special")
+    for y in range(0, size):
+        row = []
+        for x in range(0, size):
+            if walls[y][x]:
+                row.append("4")
+            elif x == middle and y == middle:
+                row.append("5")
+            else:
+                row.append("-1")
+        lines.append(",".join(row))
+
+    map_file = open(filename, "w")
+    map_file.write("\n".join(lines))
+    map_file.close()
+
+
+"""
+TIMING HELPERS
+"""
+
+
+def time_repeated(function, budget=1.0, max_runs=1000):
+    """
+    Calls function until budget seconds have passed (at least once) and returns timing stats in milliseconds
+    """
+    times = []
+    total_start = time.perf_counter()
+    while len(times) < max_runs and (len(times) == 0 or time.perf_counter() - total_start < budget):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return {
+        "runs": len(times),
+        "mean_ms": sum(times) / len(times),
+        "min_ms": times[0],
+        "median_ms": times[len(times) // 2],
+        "max_ms": times[-1]
+    }
+
+
+def make_game(mapfile):
+    """
+    Makes a Game that has finished loading mapfile, without starting its main loop
+    """
+    bench_game = game.Game(args=["game.py", "--debug", "--map", mapfile])
+    bench_game.level_manager.wait(mapfile)
+    while bench_game.gamestate == 1 and bench_game.running:
+        bench_game.check_level_loaded()
+    return bench_game
+
+
+"""
+BENCHMARKS
+"""
+
+
+def bench_map_load(mapfile, size, density):
+    """
+    Times Map.load_mapfile
+    """
+    def load():
+        game_map = map.Map()
+        game_map.load_mapfile(mapfile)
+    result = time_repeated(load, max_runs=20)
+    result.update({"size": size, "density": density})
+    return result
+
+
+def bench_render_map(bench_game, size, density):
+    """
+    Times Game.render_map with the camera in the middle of the map
+    """
+    bench_game.level.camera_x = max(0, (bench_game.level.map.get_width() - bench_game.SCREEN_WIDTH) / 2)
+    bench_game.level.camera_y = max(0, (bench_game.level.map.get_height() - bench_game.SCREEN_HEIGHT) / 2)
+    bench_game.render_map(bench_game.level)  # The first call slices the tileset, that's not what we're timing
+    result = time_repeated(lambda: bench_game.render_map(bench_game.level), max_runs=200)
+    result.update({"size": size, "density": density, "skipped_blits_total": bench_game.skipped_blits_total})
+    return result
+
+
+def bench_check_collisions(mapfile, size, density, moves=1000, seed=0):
+    """
+    Times Level.check_collisions for moves random player steps, including dash sized steps
+    """
+    sim = simulation.Simulation(mapfile)
+    rng = random.Random(seed)
+    steps = []
+    for i in range(0, moves):
+        x = rng.uniform(64, sim.map.get_width() - 128)
+        y = rng.uniform(64, sim.map.get_height() - 128)
+        steps.append((x, y, rng.uniform(-12, 12), rng.uniform(-12, 12)))
+
+    def check():
+        for x, y, step_x, step_y in steps:
+            sim.player_start_x = x
+            sim.player_start_y = y
+            sim.player.x = x + step_x
+            sim.player.y = y + step_y
+            sim.check_collisions(1)
+    result = time_repeated(check, max_runs=50)
+    result.update({"size": size, "density": density, "moves": moves, "mean_us_per_move": result["mean_ms"] * 1000 / moves})
+    return result
+
+
+def bench_raycasts(mapfile, size, density, rays=2000, fan_rays=64, seed=0):
+    """
+    Times Map.raycast() for random rays up to a sight range, Map.raycast_fan() for a sonar ping, and Map.has_line_of_sight()
+    """
+    game_map = map.Map()
+    game_map.load_mapfile(mapfile)
+    rng = random.Random(seed)
+    rays_to_cast = []
+    for i in range(0, rays):
+        angle = rng.uniform(0, 2 * math.pi)
+        rays_to_cast.append((rng.uniform(0, game_map.get_width()), rng.uniform(0, game_map.get_height()), math.cos(angle), math.sin(angle)))
+    sight_range = 1000
+
+    def cast():
+        for x, y, dir_x, dir_y in rays_to_cast:
+            game_map.raycast(x, y, dir_x, dir_y, sight_range)
+    result = time_repeated(cast, max_runs=50)
+    fan = time_repeated(lambda: game_map.raycast_fan(game_map.get_width() / 2, game_map.get_height() / 2, fan_rays, max_distance=sight_range), max_runs=500)
+
+    def look():
+        for x, y, dir_x, dir_y in rays_to_cast:
+            game_map.has_line_of_sight(x, y, x + (dir_x * 400), y + (dir_y * 400))
+    sight = time_repeated(look, max_runs=50)
+
+    result.update({
+        "size": size,
+        "density": density,
+        "rays": rays,
+        "rays_per_second": rays * 1000 / result["mean_ms"],
+        "fan_rays": fan_rays,
+        "fan_mean_ms": fan["mean_ms"],
+        "line_of_sight_per_second": rays * 1000 / sight["mean_ms"]
+    })
+    return result
+
+
+def bench_save_states(mapfile, count=10000):
+    """
+    Times Simulation.snapshot() into a reused buffer and Simulation.restore()
+    """
+    sim = simulation.Simulation(mapfile)
+    buffer = sim.snapshot()
+    start = time.perf_counter()
+    for i in range(0, count):
+        sim.snapshot(buffer)
+    snapshot_us = (time.perf_counter() - start) * 1000000 / count
+    start = time.perf_counter()
+    for i in range(0, count):
+        sim.restore(buffer)
+    restore_us = (time.perf_counter() - start) * 1000000 / count
+    return {"bytes": len(buffer), "snapshot_us": snapshot_us, "restore_us": restore_us}
+
+
+def bench_entity_update(count=1000, seed=0):
+    """
+    Times Entity.update and Player.update over count entities
+    """
+    rng = random.Random(seed)
+    results = {}
+    for name, entity_class in [("bubble", entities.Bubble), ("player", entities.Player)]:
+        objects = []
+        for i in range(0, count):
+            entity = entity_class()
+            entity.ax = rng.uniform(-1, 1)
+            entity.ay = rng.uniform(-1, 1)
+            objects.append(entity)
+
+        def update():
+            for entity in objects:
+                entity.update(1)
+        result = time_repeated(update, max_runs=200)
+        result.update({"count": count, "mean_us_per_entity": result["mean_ms"] * 1000 / count})
+        results[name] = result
+    return results
+
+
+def bench_scheduler(count=10000, world_size=16000, seed=0):
+    """
+    Times updating count entities spread over a world_size pixel square with UpdateScheduler against updating all of them
+    """
+    rng = random.Random(seed)
+    objects = []
+    for i in range(0, count):
+        entity = entities.Entity()
+        entity.x = rng.uniform(0, world_size)
+        entity.y = rng.uniform(0, world_size)
+        entity.ax = rng.uniform(-0.1, 0.1)
+        entity.ay = rng.uniform(-0.1, 0.1)
+        objects.append(entity)
+
+    def update_all():
+        for entity in objects:
+            entity.update(1)
+    everything = time_repeated(update_all, max_runs=100)
+
+    entity_scheduler = scheduler.UpdateScheduler()
+    for entity in objects:
+        entity_scheduler.add(entity)
+    views = [((world_size - 1280) / 2, (world_size - 720) / 2, 1280, 720)]
+    result = time_repeated(lambda: entity_scheduler.update(1, views), max_runs=100)
+    result.update({
+        "count": count,
+        "update_all_mean_ms": everything["mean_ms"],
+        "active": entity_scheduler.active_count,
+        "reduced": entity_scheduler.reduced_count,
+        "asleep": entity_scheduler.asleep_count
+    })
+    return result
+
+
+def bench_render_caches(bench_game, count=200):
+    """
+    Times render_text and render_image on a cold cache (every call is a miss) and a warm one (every call is a hit)
+    """
+    results = {}
+
+    bench_game.text_cache = {}
+    start = time.perf_counter()
+    for i in range(0, count):
+        bench_game.render_text("Benchmark text " + str(i), (0, 0), 14)
+    results["text_cold_us"] = (time.perf_counter() - start) * 1000000 / count
+    start = time.perf_counter()
+    for i in range(0, count):
+        bench_game.render_text("Benchmark text " + str(i), (0, 0), 14)
+    results["text_warm_us"] = (time.perf_counter() - start) * 1000000 / count
+    results["text_cache_entries"] = len(bench_game.text_cache)
+
+    bench_game.image_cache = {}
+    bench_game.tileset_opacity = {}
+    start = time.perf_counter()
+    bench_game.render_image("fish_0", (0, 0))
+    bench_game.render_image(TILESET_NAME + ":0", (0, 0))
+    results["image_cold_us"] = (time.perf_counter() - start) * 1000000 / 2
+    start = time.perf_counter()
+    for i in range(0, count):
+        bench_game.render_image("fish_0", (0, 0))
+        bench_game.render_image(TILESET_NAME + ":0", (0, 0))
+    results["image_warm_us"] = (time.perf_counter() - start) * 1000000 / (count * 2)
+    results["image_cache_entries"] = len(bench_game.image_cache)
+    return results
+
+
+def bench_frame_allocations(bench_game, frames=120, warmup_frames=30, budget=None):
+    """
+    Runs frames frames of the game loop (without the frame limiter) under an AllocationTracker
+    If budget is given, raises an AssertionError if the frames allocate more than budget blocks each on average
+    """
+    tracker = alloctrace.AllocationTracker(warmup_frames=warmup_frames)
+    tracker.start()
+    for i in range(0, warmup_frames + frames):
+        tracker.begin_frame("input")
+        bench_game.input()
+        tracker.phase("update")
+        bench_game.update(1)
+        tracker.phase("render")
+        bench_game.render()
+        tracker.end_frame()
+    tracker.stop()
+    if budget is not None:
+        tracker.assert_budget(budget)
+    return tracker.report()
+
+
+def check_input_placement(bench_game):
+    """
+    Presses the dash key halfway between two calls to Game.input() and checks where the event lands in the frame
+    With SDL event timestamps it should be about halfway through, without them it has to be at the very start
+    and the queue has to know, so the latency numbers get labelled as an upper bound
+    Raises an AssertionError if neither is what happened
+    """
+    frame_seconds = simulation.NS_PER_FRAME / 1000000000
+    dash_key = None
+    for key, binding in bench_game.key_dispatch.items():
+        if binding[0] == inputqueue.ACTION_FISH_DASH:
+            dash_key = key
+    assert dash_key is not None, "No key is bound to dash"
+
+    input_queue = bench_game.input_queue
+    bench_game.input()
+    input_queue.clear()
+    time.sleep(frame_seconds / 2)
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=dash_key, mod=0, unicode="", scancode=0))
+    time.sleep(frame_seconds / 2)
+    bench_game.input()
+    assert len(input_queue) == 1, "Pressing dash pushed " + str(len(input_queue)) + " events"
+    i = input_queue.pop()
+    at_frame_start = input_queue.times[i] == input_queue.frame_start
+    fraction = input_queue.get_fraction(i, input_queue.last_poll - input_queue.frame_start)
+    results = {"timestamps": not input_queue.timestamps_missing, "fraction": fraction}
+
+    # Let go of the key so the rest of the benchmarks start from nothing held
+    pygame.event.post(pygame.event.Event(pygame.KEYUP, key=dash_key, mod=0, unicode="", scancode=0))
+    bench_game.input()
+    input_queue.clear()
+
+    if input_queue.timestamps_missing:
+        assert at_frame_start, "An event without a timestamp wasn't put at the start of the frame"
+    else:
+        # SDL timestamps are in milliseconds and sleep() oversleeps a little, so this is loose
+        assert abs(fraction - 0.5) < 0.2, "A key pressed halfway between polls was placed at " + str(fraction)
+    return results
+
+
+def measure_memory(make, count):
+    """
+    Returns the number of bytes it takes to hold count objects created by make()
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [make() for i in range(0, count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return after - before
+
+
+def bench_entity_memory(count=10000):
+    """
+    Compares the memory used by count of the old dict based entities against count slotted bubbles
+    """
+    legacy = measure_memory(LegacyEntity, count)
+    slotted = measure_memory(entities.Bubble, count)
+    return {
+        "count": count,
+        "legacy_bytes": legacy,
+        "slotted_bytes": slotted,
+        "legacy_bytes_per_entity": legacy / count,
+        "slotted_bytes_per_entity": slotted / count
+    }
+
+
+def bench_entity_churn(count=2000, rounds=100):
+    """
+    Simulates short lived entities by creating count entities, getting their rects, and throwing them away
+    rounds times. Compares the old entities against the current slotted ones
+    Returns the time taken and peak memory of each. tracemalloc slows every allocation down a lot, so the
+    times are measured on a run without it and the peaks on a second run with it
+    """
+    def churn_legacy():
+        for i in range(0, rounds):
+            live = []
+            for j in range(0, count):
+                entity = LegacyEntity()
+                entity.as_rect()
+                live.append(entity)
+
+    def churn_plain():
+        for i in range(0, rounds):
+            live = []
+            for j in range(0, count):
+                entity = entities.Bubble()
+                entity.as_rect()
+                live.append(entity)
+
+    results = {"count": count, "rounds": rounds}
+    for name, churn in [("legacy", churn_legacy), ("plain", churn_plain)]:
+        # Best of three, since a single run is at the mercy of the garbage collector
+        best = None
+        for run in range(0, 3):
+            start = time.perf_counter()
+            churn()
+            seconds = time.perf_counter() - start
+            if best is None or seconds < best:
+                best = seconds
+        results[name + "_seconds"] = best
+        tracemalloc.start()
+        churn()
+        results[name + "_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return results
+
+
+def run_suite(sizes, density, directory, alloc_budget=None):
+    """
+    Runs every benchmark and returns the results as a dict ready to be written as JSON
+    The game expects res/gfx and data/map relative to the working directory, so the suite runs from directory
+    """
+    os.chdir(directory)
+    write_tileset(directory)
+    os.makedirs("data/map", exist_ok=True)
+
+    results = {
+        "meta": {
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "platform": platform.platform(),
+            "sizes": sizes,
+            "density": density
+        },
+        "map_load": [],
+        "render_map": [],
+        "check_collisions": [],
+        "raycasts": []
+    }
+
+    bench_game = None
+    mapfile = None
+    for size in sizes:
+        mapfile = os.path.join("data", "map", "bench-" + str(size) + ".map")
+        write_map(mapfile, size, density)
+        results["map_load"].append(bench_map_load(mapfile, size, density))
+        results["check_collisions"].append(bench_check_collisions(mapfile, size, density))
+        results["raycasts"].append(bench_raycasts(mapfile, size, density))
+        bench_game = make_game(mapfile)
+        results["render_map"].append(bench_render_map(bench_game, size, density))
+        print("Finished size " + str(size), file=sys.stderr)
+
+    results["entity_update"] = bench_entity_update()
+    results["scheduler"] = bench_scheduler()
+    if mapfile is not None:
+        results["save_states"] = bench_save_states(mapfile)
+    if bench_game is not None:
+        results["frame_allocations"] = bench_frame_allocations(bench_game, budget=alloc_budget)
+        results["render_caches"] = bench_render_caches(bench_game)
+        results["input_placement"] = check_input_placement(bench_game)
+    results["entity_memory"] = bench_entity_memory()
+    results["entity_churn"] = bench_entity_churn()
+    results["particles"] = particles.benchmark()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mariana's hot paths on synthetic maps")
+    parser.add_argument("--sizes", default="50,100,250,500,1000,2000", help="comma separated map sizes in tiles")
+    parser.add_argument("--density", type=float, default=0.2, help="fraction of tiles that are walls with colliders")
+    parser.add_argument("--alloc-budget", type=float, default=None, help="fail if a steady state frame allocates more than this many blocks")
+    parser.add_argument("--output", default=None, help="file to write the JSON results to, defaults to stdout")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    output = None
+    if args.output is not None:
+        output = os.path.abspath(args.output)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_suite(sizes, args.density, directory, args.alloc_budget)
+
+    if output is None:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+    else:
+        output_file = open(output, "w")
+        json.dump(results, output_file, indent=4)
+        output_file.close()
+
+
+if __name__ == "__main__":
+    main()
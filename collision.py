@@ -0,0 +1,239 @@
+# Mariana
+# Code - Matt Madden
+# collision.py -- Collision math that doesn't depend on any particular game object
+
+import random
+import sys
+
+
+def sweep_aabb(x, y, w, h, step_x, step_y, box_x, box_y, box_w, box_h):
+    """
+    Moves the box (x, y, w, h) along (step_x, step_y) and checks it against a static box
+    Returns (time, normal_x, normal_y) where time is the fraction of the step at which the boxes
+    first touch and the normal is the side of the static box that was hit, or None if they don't collide
+    Boxes that are just touching aren't colliding, same as pygame.Rect.colliderect()
+    """
+
+    # Find the times at which the box enters and leaves the static box on each axis
+    if step_x > 0:
+        entry_x = (box_x - (x + w)) / step_x
+        exit_x = (box_x + box_w - x) / step_x
+    elif step_x < 0:
+        entry_x = (box_x + box_w - x) / step_x
+        exit_x = (box_x - (x + w)) / step_x
+    else:
+        # Not moving on this axis, so the boxes have to already overlap on it
+        if x + w <= box_x or x >= box_x + box_w:
+            return None
+        entry_x = float("-inf")
+        exit_x = float("inf")
+
+    if step_y > 0:
+        entry_y = (box_y - (y + h)) / step_y
+        exit_y = (box_y + box_h - y) / step_y
+    elif step_y < 0:
+        entry_y = (box_y + box_h - y) / step_y
+        exit_y = (box_y - (y + h)) / step_y
+    else:
+        if y + h <= box_y or y >= box_y + box_h:
+            return None
+        entry_y = float("-inf")
+        exit_y = float("inf")
+
+    # The boxes overlap once they overlap on both axes, and stop once they stop on either
+    entry = max(entry_x, entry_y)
+    exit = min(exit_x, exit_y)
+
+    # A negative entry means the boxes already overlapped before moving, we ignore that so
+    # that something stuck inside a box is still able to move out of it
+    # An entry of 1 means the boxes only touch at the very end of the step
+    if entry >= exit or entry < 0 or entry >= 1:
+        return None
+
+    if entry_x > entry_y:
+        if step_x > 0:
+            return (entry, -1, 0)
+        return (entry, 1, 0)
+    if step_y > 0:
+        return (entry, 0, -1)
+    return (entry, 0, 1)
+
+
+class Endpoint():
+    """
+    One end of an entity's interval along the x axis
+    """
+    __slots__ = ("value", "is_min", "entity")
+
+    def __init__(self, value, is_min, entity):
+        self.value = value
+        self.is_min = is_min
+        self.entity = entity
+
+    def comes_after(self, other):
+        """
+        Returns true if this endpoint belongs after other in the sorted list
+        When the values are equal the max endpoints go first, that way boxes that are only
+        touching don't get reported as overlapping
+        A zero width entity has both endpoints at the same value, those go between the max and min endpoints
+        with its min first so it's still active when its max comes up
+        """
+        if self.value != other.value:
+            return self.value > other.value
+        rank = self.get_tie_rank()
+        other_rank = other.get_tie_rank()
+        if rank != other_rank:
+            return rank > other_rank
+        if rank == 1:
+            # Keeps each zero width entity's two endpoints next to each other
+            if self.entity is not other.entity:
+                return id(self.entity) > id(other.entity)
+            return not self.is_min
+        return False
+
+    def get_tie_rank(self):
+        """
+        Where this endpoint goes among endpoints with the same value, max endpoints are 0,
+        both endpoints of a zero width entity are 1 and min endpoints are 2
+        """
+        if self.entity.x + self.entity.w == self.entity.x:
+            return 1
+        if self.is_min:
+            return 2
+        return 0
+
+
+class SweepAndPrune():
+    """
+    Broadphase for collisions between entities. Each entity's x interval is kept in a sorted list of endpoints
+    Entities only move a little each frame so the list is almost sorted already, which makes an insertion sort
+    close to linear. A single sweep over the list then gives the pairs that overlap on both axes
+    Works with anything that has x, y, w and h like the classes in entities.py
+    """
+
+    def __init__(self):
+        self.endpoints = []
+        self.entity_endpoints = {}
+
+        # Profiling counters, swaps is reset by update() and the pair counts by get_pairs()
+        self.swaps = 0
+        self.pairs_tested = 0
+        self.pairs_reported = 0
+
+    def add(self, entity):
+        """
+        Starts tracking an entity
+        """
+        if entity in self.entity_endpoints:
+            return
+        min_endpoint = Endpoint(entity.x, True, entity)
+        max_endpoint = Endpoint(entity.x + entity.w, False, entity)
+        self.entity_endpoints[entity] = (min_endpoint, max_endpoint)
+        self.endpoints.append(min_endpoint)
+        self.endpoints.append(max_endpoint)
+        # The new endpoints are at the end of the list, the next sort will move them into place
+
+    def remove(self, entity):
+        """
+        Stops tracking an entity
+        """
+        if entity not in self.entity_endpoints:
+            return
+        min_endpoint, max_endpoint = self.entity_endpoints.pop(entity)
+        self.endpoints.remove(min_endpoint)
+        self.endpoints.remove(max_endpoint)
+
+    def update(self):
+        """
+        Reads the current position of every entity and brings the endpoint list back into sorted order
+        Call once per frame after the entities have moved
+        """
+        for min_endpoint, max_endpoint in self.entity_endpoints.values():
+            entity = min_endpoint.entity
+            min_endpoint.value = entity.x
+            max_endpoint.value = entity.x + entity.w
+
+        # Insertion sort, only endpoints that passed each other this frame get moved
+        self.swaps = 0
+        endpoints = self.endpoints
+        for i in range(1, len(endpoints)):
+            endpoint = endpoints[i]
+            j = i - 1
+            while j >= 0 and endpoints[j].comes_after(endpoint):
+                endpoints[j + 1] = endpoints[j]
+                j -= 1
+                self.swaps += 1
+            endpoints[j + 1] = endpoint
+
+    def get_pairs(self):
+        """
+        Returns a list of (entity, entity) tuples for every pair of entities whose boxes overlap
+        Call update() first so the endpoints are sorted
+        """
+        self.pairs_tested = 0
+        pairs = []
+        active = []
+        for endpoint in self.endpoints:
+            entity = endpoint.entity
+            if endpoint.is_min:
+                # Everything still active overlaps this entity on the x axis, so just check the y axis
+                for other in active:
+                    self.pairs_tested += 1
+                    if other.y < entity.y + entity.h and entity.y < other.y + other.h:
+                        pairs.append((other, entity))
+                active.append(entity)
+            elif entity in active:
+                active.remove(entity)
+        self.pairs_reported = len(pairs)
+        return pairs
+
+
+class CheckBox():
+    """
+    Stand in for an entity in check_sweep_and_prune()
+    """
+
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+
+def check_sweep_and_prune(count=60, frames=200):
+    """
+    Moves boxes around on a small grid, so lots of them share edges and some have no width,
+    and checks that SweepAndPrune finds the same pairs as testing every pair
+    Returns True if it always does
+    """
+    rng = random.Random(1)
+    boxes = [CheckBox(rng.randint(0, 20), rng.randint(0, 20), rng.choice([0, 0, 1, 2, 5]), rng.randint(0, 5)) for i in range(0, count)]
+    broadphase = SweepAndPrune()
+    for box in boxes:
+        broadphase.add(box)
+    for frame in range(0, frames):
+        for box in boxes:
+            box.x = min(20, max(0, box.x + rng.randint(-1, 1)))
+            box.y = min(20, max(0, box.y + rng.randint(-1, 1)))
+            if rng.random() < 0.05:
+                box.w = rng.choice([0, 1, 2, 5])
+        broadphase.update()
+        found = set(frozenset(pair) for pair in broadphase.get_pairs())
+        expected = set()
+        for i in range(0, len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a = boxes[i]
+                b = boxes[j]
+                if a.x < b.x + b.w and b.x < a.x + a.w and a.y < b.y + b.h and b.y < a.y + a.h:
+                    expected.add(frozenset((a, b)))
+        if found != expected:
+            print("Frame {0}: sweep and prune found {1} pairs but there are {2}".format(frame, len(found), len(expected)))
+            return False
+    print("Sweep and prune matched every pair of {0} boxes over {1} frames".format(count, frames))
+    return True
+
+
+if __name__ == "__main__":
+    if not check_sweep_and_prune():
+        print("Error! Sweep and prune doesn't find the same pairs as testing every pair")
+        sys.exit(1)
@@ -3,25 +3,36 @@
 # entities.py -- Module for game entities
 
 import math
-import pygame
 
 
 class Entity():
     """
     Holds a template for all moving objects in game
+    Movement constants are per kind of entity, so they live on the class rather than on each instance
     """
+    __slots__ = ("x", "y", "w", "h", "dx", "dy", "ax", "ay", "rect")
+
+    MAX_VEL = 0
+    MAX_ACC = 0
+    DEC_SPEED = 0
+
     def __init__(self):
+        # The rect is made the first time as_rect() is called and reused after that
+        self.rect = None
+        self.reset()
+
+    def reset(self):
+        """
+        Puts the entity back into its starting state
+        """
         self.x = 0
         self.y = 0
         self.w = 0
         self.h = 0
         self.dx = 0
         self.dy = 0
-        self.MAX_VEL = 0
         self.ax = 0
         self.ay = 0
-        self.MAX_ACC = 0
-        self.DEC_SPEED = 0
 
     def update(self, delta):
         """
@@ -103,33 +114,53 @@ class Entity():
         return math.sqrt(self.dx ** 2 + self.dy ** 2)
 
     def as_rect(self):
-        return pygame.Rect(self.x, self.y, self.w, self.h)
+        """
+        Returns a rect of the entity. The same rect object is updated and returned on every call,
+        so copy it if you need to hold on to it
+        """
+        if self.rect is None:
+            # pygame is only imported here so the simulation can run without it
+            import pygame
+            self.rect = pygame.Rect(self.x, self.y, self.w, self.h)
+        else:
+            self.rect.x = self.x
+            self.rect.y = self.y
+            self.rect.w = self.w
+            self.rect.h = self.h
+        return self.rect
 
 
 class Player(Entity):
-    def __init__(self):
-        super().__init__()
+    __slots__ = ("can_dash", "is_dashing", "dash_timer", "is_sprinting", "on_wall")
+
+    # Set properties from base class
+    MAX_ACC = 1
+    DEC_SPEED = 0.2
+    MAX_VEL = 5
+
+    # Dash constants
+    DASH_SPEED = 9
+    DASH_TIME = 20
+    DASH_DEC_MOD = 3
+
+    # Sprinting constants
+    SPRINT_SPEED = 7
+    SPRINT_ACC_MOD = 2
+
+    def reset(self):
+        super().reset()
 
-        # Set properties from base class
-        self.MAX_ACC = 1
-        self.DEC_SPEED = 0.2
-        self.MAX_VEL = 5
         self.x = 700
         self.y = 350
         self.w = 20
         self.h = 36
 
         # Dash variables
-        self.DASH_SPEED = 9
-        self.DASH_TIME = 20
-        self.DASH_DEC_MOD = 3
         self.can_dash = True
         self.is_dashing = False
         self.dash_timer = 0
 
         # Sprinting variables
-        self.SPRINT_SPEED = 7
-        self.SPRINT_ACC_MOD = 2
         self.is_sprinting = False
 
         self.on_wall = False
@@ -222,3 +253,27 @@ class Player(Entity):
         self.dy = self.ay * (self.DASH_SPEED / hyp)
         self.is_dashing = True
         self.dash_timer = self.DASH_TIME
+
+
+class Bubble(Entity):
+    """
+    A short lived bubble that floats upward until its lifetime runs out
+    """
+    __slots__ = ("lifetime",)
+
+    MAX_ACC = 0.05
+    DEC_SPEED = 0.02
+    MAX_VEL = 2
+    LIFETIME = 90
+
+    def reset(self):
+        super().reset()
+        self.w = 8
+        self.h = 8
+        self.ay = -self.MAX_ACC
+        self.lifetime = self.LIFETIME
+
+    def update(self, delta):
+        self.lifetime -= delta
+        super().update(delta)
+
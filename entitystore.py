@@ -0,0 +1,231 @@
+# Mariana
+# Code - Matt Madden
+# entitystore.py -- Structure of arrays storage for large numbers of simple entities
+
+import sys
+import numpy
+
+
+class EntityStore():
+    """
+    Holds the movement state of many entities in numpy arrays so that they can all be
+    updated at once. This runs the same movement model as Entity.update(), it's meant
+    for things like schools of fish and bubbles where we have hundreds of the same kind
+    of entity on screen
+    """
+
+    def __init__(self, capacity=256):
+        """
+        Capacity is the starting size of the arrays, they grow if more entities are added
+        """
+        self.count = 0
+        self.capacity = 0
+
+        # Per kind constants, each entity has a kind which indexes these arrays
+        self.kind_max_acc = numpy.zeros(0)
+        self.kind_dec_speed = numpy.zeros(0)
+        self.kind_max_vel = numpy.zeros(0)
+
+        self.x = numpy.zeros(0)
+        self.y = numpy.zeros(0)
+        self.w = numpy.zeros(0)
+        self.h = numpy.zeros(0)
+        self.dx = numpy.zeros(0)
+        self.dy = numpy.zeros(0)
+        self.ax = numpy.zeros(0)
+        self.ay = numpy.zeros(0)
+        self.kind = numpy.zeros(0, dtype=numpy.intp)
+
+        self.resize(capacity)
+
+    def resize(self, capacity):
+        """
+        Grows the entity arrays to hold capacity entities, keeping the existing values
+        """
+        for name in ["x", "y", "w", "h", "dx", "dy", "ax", "ay", "kind"]:
+            old = getattr(self, name)
+            new = numpy.zeros(capacity, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+        self.capacity = capacity
+
+    def add_kind(self, max_acc, dec_speed, max_vel):
+        """
+        Registers a kind of entity and returns its kind id
+        """
+        self.kind_max_acc = numpy.append(self.kind_max_acc, float(max_acc))
+        self.kind_dec_speed = numpy.append(self.kind_dec_speed, float(dec_speed))
+        self.kind_max_vel = numpy.append(self.kind_max_vel, float(max_vel))
+        return len(self.kind_max_acc) - 1
+
+    def add_kind_from(self, entity):
+        """
+        Registers a kind using the movement constants of an existing entity
+        """
+        return self.add_kind(entity.MAX_ACC, entity.DEC_SPEED, entity.MAX_VEL)
+
+    def add(self, kind, x=0, y=0, w=0, h=0, dx=0, dy=0, ax=0, ay=0):
+        """
+        Adds an entity to the store and returns its index
+        """
+        if self.count == self.capacity:
+            self.resize(max(1, self.capacity * 2))
+        i = self.count
+        self.kind[i] = kind
+        self.x[i] = x
+        self.y[i] = y
+        self.w[i] = w
+        self.h[i] = h
+        self.dx[i] = dx
+        self.dy[i] = dy
+        self.ax[i] = ax
+        self.ay[i] = ay
+        self.count += 1
+        return i
+
+    def add_entity(self, kind, entity):
+        """
+        Copies the state of an Entity object into the store and returns its index
+        """
+        return self.add(kind, entity.x, entity.y, entity.w, entity.h, entity.dx, entity.dy, entity.ax, entity.ay)
+
+    def copy_to_entity(self, index, entity):
+        """
+        Writes the state of the entity at index back onto an Entity object
+        """
+        entity.x = float(self.x[index])
+        entity.y = float(self.y[index])
+        entity.dx = float(self.dx[index])
+        entity.dy = float(self.dy[index])
+        entity.ax = float(self.ax[index])
+        entity.ay = float(self.ay[index])
+
+    def remove(self, index):
+        """
+        Removes the entity at index by moving the last entity into its slot
+        Returns the old index of the entity that was moved, so callers can fix up their references
+        """
+        last = self.count - 1
+        if index != last:
+            for name in ["x", "y", "w", "h", "dx", "dy", "ax", "ay", "kind"]:
+                array = getattr(self, name)
+                array[index] = array[last]
+        self.count -= 1
+        return last
+
+    def update(self, delta):
+        """
+        Does the same thing as Entity.update() but for every entity in the store at once
+        The order of operations matches entities.py exactly so that results are identical
+        """
+        n = self.count
+        if n == 0:
+            return
+
+        x = self.x[:n]
+        y = self.y[:n]
+        dx = self.dx[:n]
+        dy = self.dy[:n]
+        ax = self.ax[:n]
+        ay = self.ay[:n]
+        kind = self.kind[:n]
+        max_acc = self.kind_max_acc[kind]
+        dec_speed = self.kind_dec_speed[kind]
+        max_vel = self.kind_max_vel[kind]
+
+        # Entity.check_acceleration()
+        numpy.clip(ax, -max_acc, max_acc, out=ax)
+        numpy.clip(ay, -max_acc, max_acc, out=ay)
+
+        # Entity.update_velocity()
+        dx += ax * delta
+        dy += ay * delta
+
+        # Entity.handle_decceleration()
+        # Note that in the per object version the speed used for the y step is taken after
+        # dx has already been decelerated, so we take the speed twice here too
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            decelerating = dec_speed != 0
+
+            moving = decelerating & (dx != 0)
+            speed = numpy.sqrt(dx * dx + dy * dy)
+            new_dx = dx - (dec_speed / speed) * dx * delta
+            # Stop the entity once decceleration would flip its direction, unless it's accelerating
+            new_dx[(ax == 0) & (new_dx * dx < 0)] = 0
+            numpy.copyto(dx, new_dx, where=moving)
+
+            moving = decelerating & (dy != 0)
+            speed = numpy.sqrt(dx * dx + dy * dy)
+            new_dy = dy - (dec_speed / speed) * dy * delta
+            new_dy[(ay == 0) & (new_dy * dy < 0)] = 0
+            numpy.copyto(dy, new_dy, where=moving)
+
+        # Entity.check_velocity()
+        speed = numpy.sqrt(dx * dx + dy * dy)
+        too_fast = speed > max_vel
+        with numpy.errstate(divide="ignore", invalid="ignore"):
+            scale = max_vel / speed
+        numpy.multiply(dx, scale, out=dx, where=too_fast)
+        numpy.multiply(dy, scale, out=dy, where=too_fast)
+
+        # Entity.update_position()
+        x += dx * delta
+        y += dy * delta
+
+
+def compare_with_entities(count=500, frames=240, seed=0):
+    """
+    Runs the same random entities through both Entity.update() and EntityStore.update()
+    and returns the largest difference in position or velocity that was found
+    """
+    import random
+    import entities
+
+    rng = random.Random(seed)
+    kinds = [(1, 0.2, 5), (0.5, 0, 3), (2, 0.5, 9)]
+
+    store = EntityStore(count)
+    kind_ids = [store.add_kind(*kind) for kind in kinds]
+    # Movement constants live on the class, so make a class for each kind
+    kind_classes = []
+    for kind in kinds:
+        kind_classes.append(type("Kind", (entities.Entity,), {"__slots__": (), "MAX_ACC": kind[0], "DEC_SPEED": kind[1], "MAX_VEL": kind[2]}))
+    objects = []
+    for i in range(0, count):
+        kind = rng.randrange(0, len(kinds))
+        entity = kind_classes[kind]()
+        entity.x = rng.uniform(0, 1000)
+        entity.y = rng.uniform(0, 1000)
+        entity.dx = rng.uniform(-6, 6)
+        entity.dy = rng.uniform(-6, 6)
+        objects.append(entity)
+        store.add_entity(kind_ids[kind], entity)
+
+    worst = 0
+    for frame in range(0, frames):
+        delta = rng.uniform(0.5, 2)
+        for i in range(0, count):
+            # Change acceleration every so often, including letting go of the stick entirely
+            if rng.random() < 0.1:
+                ax = rng.choice([0, rng.uniform(-3, 3)])
+                ay = rng.choice([0, rng.uniform(-3, 3)])
+                objects[i].ax = ax
+                objects[i].ay = ay
+                store.ax[i] = ax
+                store.ay[i] = ay
+            objects[i].update(delta)
+        store.update(delta)
+        for i in range(0, count):
+            entity = objects[i]
+            worst = max(worst, abs(entity.x - store.x[i]), abs(entity.y - store.y[i]), abs(entity.dx - store.dx[i]), abs(entity.dy - store.dy[i]))
+    return worst
+
+
+if __name__ == "__main__":
+    # Both do the same float math in the same order, so anything past rounding error means the two have drifted apart
+    TOLERANCE = 1e-9
+    worst = compare_with_entities()
+    print("Largest difference from Entity.update(): " + str(worst))
+    if not worst < TOLERANCE:
+        print("Error! EntityStore.update() doesn't match Entity.update(), the difference is over " + str(TOLERANCE))
+        sys.exit(1)
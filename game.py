@@ -4,8 +4,25 @@
 
 import sys
 import os
+import json
+import time
 import pygame
+import alloctrace
 import level
+import levelmanager
+import lighting
+import maprender
+import minimap
+import netplay
+import particles
+import inputqueue
+import hotreload
+import latency
+import profiler
+import replay
+import savestate
+import simulation
+import startup
 
 
 class Game():
@@ -13,23 +30,31 @@ class Game():
     ENGINE INIT AND CORE GAME LOOP
     """
 
-    def __init__(self):
+    def __init__(self, args=None, startup_timer=None):
         """
-        Default constructor for Game class, handles pygame init and starts
-        the main game loop
+        Default constructor for Game class, handles pygame init and starts loading the level
+        Only the things needed to show the first frame are done here, the level loads in the background
+        and joysticks are set up after the first frame. Call run() to start the main game loop
+        args defaults to sys.argv
         """
 
+        self.args = args
+        if self.args is None:
+            self.args = sys.argv
+        self.startup_timer = startup_timer
+        if self.startup_timer is None:
+            self.startup_timer = startup.StartupTimer()
+
         self.handle_sysargs()
         self.init_engine()
+        self.startup_timer.mark("engine")
         self.init_input()
+        self.startup_timer.mark("input")
         self.init_caches()
 
         self.start_game()
         self.running = True  # When this becomes false, main loop inside run() will quit
 
-        self.run()
-        self.quit()
-
     def handle_sysargs(self):
         """
         Sets Game class variables to their respective values depending on whether
@@ -41,15 +66,61 @@ class Game():
         self.debug = False
         self.use_joystick = False
         self.enable_cache_timeout = False
+        self.record_filename = None
+        self.profile_slowest = 0
+        self.startup_benchmark = False
+        self.mapfile = "data/map/frens.map"
+        self.trace_allocations = False
+        self.load_filename = None
+        self.net_peer = None
+        self.net_port = 7000
+        self.net_player = 0
+        self.net_delay = 2
+        self.net_loopback = None
+        self.use_lighting = True
+        self.split_players = 1
 
         # loop through sys args and set values as needed
-        for argument in sys.argv:
+        for i in range(0, len(self.args)):
+            argument = self.args[i]
             if argument == "--debug":
                 self.debug = True
             if argument == "--joystick-enable":
                 self.use_joystick = True
             if argument == "--cache-timeout":
                 self.enable_cache_timeout = True
+            if argument == "--record" and i + 1 < len(self.args):
+                self.record_filename = self.args[i + 1]
+            if argument == "--profile-slowest" and i + 1 < len(self.args):
+                self.profile_slowest = int(self.args[i + 1])
+            if argument == "--startup-benchmark":
+                self.startup_benchmark = True
+            if argument == "--map" and i + 1 < len(self.args):
+                self.mapfile = self.args[i + 1]
+            if argument == "--trace-allocations":
+                self.trace_allocations = True
+            if argument == "--load" and i + 1 < len(self.args):
+                self.load_filename = self.args[i + 1]
+            if argument == "--net-peer" and i + 1 < len(self.args):
+                self.net_peer = self.args[i + 1]
+            if argument == "--net-port" and i + 1 < len(self.args):
+                self.net_port = int(self.args[i + 1])
+            if argument == "--net-player" and i + 1 < len(self.args):
+                self.net_player = int(self.args[i + 1])
+            if argument == "--net-delay" and i + 1 < len(self.args):
+                self.net_delay = int(self.args[i + 1])
+            if argument == "--net-loopback" and i + 1 < len(self.args):
+                # Latency in ms, jitter in ms, and packet loss, like 80,20,0.05
+                self.net_loopback = [float(value) for value in self.args[i + 1].split(",")]
+            if argument == "--no-lighting":
+                self.use_lighting = False
+            if argument == "--split" and i + 1 < len(self.args):
+                # Local split screen for 2 to 4 players
+                self.split_players = max(1, min(4, int(self.args[i + 1])))
+
+        if self.split_players > 1 and (self.net_peer is not None or self.net_loopback is not None):
+            print("Error! Split screen can't be used with online play, starting online play on its own")
+            self.split_players = 1
 
     def init_engine(self):
         """
@@ -72,7 +143,9 @@ class Game():
         self.YELLOW = (255, 255, 0)
 
         # Actually init pygame
-        pygame.init()
+        # Only the display and fonts are needed for the first frame, joysticks are set up later by init_joysticks()
+        pygame.display.init()
+        pygame.font.init()
         pygame_flags = None  # we need to experiment to see if this or any other flags are any good
         if self.debug:
             if pygame_flags is None:
@@ -87,20 +160,59 @@ class Game():
         self.clock = pygame.time.Clock()
 
         # If in debug mode, show fps and other info in top left corner
+        # The overlay lines are only rebuilt when their numbers change so the overlay doesn't make new strings every frame
         self.show_fps = self.debug
         self.fps = 0
+        self.fps_text = "FPS: 0"
+        self.joystick_text = "Joysticks: 0"
+        self.skipped_blits_text = "Skipped Blits (total): 0"
+        self.skipped_blits_shown = 0
+        self.entity_text = "Entities: 0 active, 0 reduced, 0 asleep"
+        self.entity_counts_shown = (0, 0, 0)
+
+        # F3 toggles a profiler capture in debug mode, --profile-slowest N captures the N slowest frames
+        self.profiler = profiler.FrameProfiler(slowest_count=self.profile_slowest)
+
+        # Tracks the time from an input arriving to the flip that first shows it
+        self.latency_tracker = latency.LatencyTracker()
+        self.latency_text = "Latency: --"
+
+        # --trace-allocations counts what every frame allocates, see alloctrace.py
+        self.allocation_tracker = None
+        if self.trace_allocations:
+            self.allocation_tracker = alloctrace.AllocationTracker()
+            self.allocation_tracker.start()
 
     def input(self):
         """
         Handle input from the player, usually redirects to other functions for cleanliness
         """
+        poll_time = time.perf_counter_ns()
+        poll_ticks = pygame.time.get_ticks()
+        for input_queue in self.input_queues:
+            input_queue.begin_poll(poll_time)
         for event in pygame.event.get():
+            # SDL stamps every event with when it came in, but not every pygame passes that along (2.6.1 doesn't)
+            # Without it events go at the start of the frame and the latency overlay shows an upper bound
+            self.event_time = self.input_queue.get_event_time(getattr(event, "timestamp", None), poll_ticks)
             if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
                 self.running = False
                 break
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
-                self.start_joyconfig()
+                # The joystick config screen can't be opened until loading is done since it returns to the game
+                if self.gamestate != 1:
+                    self.start_joyconfig()
                 break
+            elif self.debug and event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.toggle()
+            elif self.debug and event.type == pygame.KEYDOWN and event.key == pygame.K_F4:
+                self.use_lighting = not self.use_lighting
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_m and self.gamestate == 0:
+                self.show_minimap = not self.show_minimap
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F5 and self.gamestate == 0 and self.netplay is None:
+                self.save_game("quicksave")
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F9 and self.gamestate == 0 and self.netplay is None:
+                self.load_game(os.path.join(self.save_writer.directory, "quicksave.sav"))
             elif self.gamestate == -1:
                 self.input_joyconfig(event)
             else:
@@ -111,8 +223,37 @@ class Game():
         Update game logic
         """
 
+        if self.gamestate == 1:
+            self.check_level_loaded()
+        elif self.gamestate == 0 and self.netplay is not None:
+            self.update_netplay()
+        elif self.gamestate == 0:
+            if self.map_watcher is not None:
+                self.check_hot_reload()
+            if self.recorder is not None:
+                self.recorder.record_frame(delta, self.input_queue)
+            self.level.update(delta, self.input_queue)
+            if self.split_levels is not None:
+                for i in range(1, len(self.split_levels)):
+                    self.split_levels[i].update(delta, self.input_queues[i])
+            self.prepare_tilesets()
+            if self.pending_restore is not None:
+                self.check_pending_restore()
+            else:
+                self.check_level_exit()
+            self.autosave_timer += delta
+            if self.autosave_timer >= self.AUTOSAVE_TIME:
+                self.save_game("autosave")
+
+        # Animated tiles and particles move along in game time, even during online play
+        if self.gamestate == 0 and self.map_renderer is not None:
+            self.map_renderer.update(delta)
         if self.gamestate == 0:
-            self.level.update(delta, self.input_queue, self.input_states)
+            self.update_particles(delta)
+            if self.split_levels is None:
+                self.level.update_entities(delta)
+            else:
+                self.level.update_entities(delta, [split_level.get_view() for split_level in self.split_levels])
 
         self.tick_cache_timeout(delta)
 
@@ -120,53 +261,130 @@ class Game():
         """
         Draw to the game screen here
         """
-        pygame.draw.rect(self.screen, self.BLACK, (0, 0, self.SCREEN_WIDTH, self.SCREEN_HEIGHT), False)
+        pygame.draw.rect(self.screen, self.BLACK, self.SCREEN_RECT, False)
 
         if self.gamestate == -1:
             self.render_joyconfig()
         elif self.gamestate == 0:
             self.render_game()
+        elif self.gamestate == 1:
+            self.render_text("Loading...", ("CENTERED", "CENTERED"), 22)
 
         if self.show_fps:
-            self.render_text("FPS: " + str(self.fps), (0, 0), 14, self.GREEN)
-            self.render_text("Joysticks: " + str(self.joystick_count), (0, 20), 14, self.GREEN)
+            self.render_text(self.fps_text, (0, 0), 14, self.GREEN)
+            self.render_text(self.joystick_text, (0, 20), 14, self.GREEN)
+            self.render_text(self.latency_text, (0, 40), 14, self.GREEN)
+            if self.profiler.is_capturing():
+                self.render_text("PROFILING (F3 to stop)", (0, 80), 14, self.RED)
+            if self.gamestate == 0:
+                if self.skipped_blits_total != self.skipped_blits_shown:
+                    self.skipped_blits_shown = self.skipped_blits_total
+                    self.skipped_blits_text = "Skipped Blits (total): " + str(self.skipped_blits_total)
+                self.render_text(self.skipped_blits_text, (0, 60), 14, self.GREEN)
+                entity_scheduler = self.level.scheduler
+                if entity_scheduler.active_count != self.entity_counts_shown[0] or entity_scheduler.reduced_count != self.entity_counts_shown[1] or entity_scheduler.asleep_count != self.entity_counts_shown[2]:
+                    self.entity_counts_shown = (entity_scheduler.active_count, entity_scheduler.reduced_count, entity_scheduler.asleep_count)
+                    self.entity_text = "Entities: {0} active, {1} reduced, {2} asleep".format(*self.entity_counts_shown)
+                self.render_text(self.entity_text, (0, 120), 14, self.GREEN)
+                if self.netplay is not None:
+                    self.render_text(self.net_text, (0, 100), 14, self.GREEN)
 
         pygame.display.flip()
+        self.latency_tracker.frame_presented()
 
     def run(self):
         """
         Sets up all the timing variables and calls the main game loop
         """
         SECOND = 1000
-        UPDATE_TIME = SECOND / 60
 
-        before_time = pygame.time.get_ticks()
-        before_sec = before_time
+        before_sec = pygame.time.get_ticks()
         frames = 0
-        delta = 0
 
         while self.running:
             self.clock.tick(self.TARGET_FPS)
 
+            self.profiler.begin_frame()
+            if self.allocation_tracker is not None:
+                self.allocation_tracker.begin_frame("input")
             self.input()
+            # The events just polled came in since the last poll, so the frame being simulated covers the time between the two
+            delta = (self.input_queue.last_poll - self.input_queue.frame_start) / simulation.NS_PER_FRAME
+            if self.allocation_tracker is not None:
+                self.allocation_tracker.phase("update")
             self.update(delta)
+            if self.allocation_tracker is not None:
+                self.allocation_tracker.phase("render")
             self.render()
+            if self.allocation_tracker is not None:
+                self.allocation_tracker.end_frame()
+            self.profiler.end_frame()
             frames += 1
 
+            # Anything we put off to get the first frame on screen quickly gets done now
+            if frames == 1 and not self.joysticks_ready:
+                self.startup_timer.mark("first_flip")
+                self.init_joysticks()
+                self.startup_timer.mark("joysticks")
+            if self.gamestate == 0 and self.startup_benchmark:
+                self.startup_timer.mark("first_game_frame")
+                json.dump(self.startup_timer.report(), sys.stdout, indent=4)
+                print()
+                self.running = False
+
             after_time = pygame.time.get_ticks()
-            delta = (after_time - before_time) / UPDATE_TIME
             if after_time - before_sec >= SECOND:
                 self.fps = frames
+                self.fps_text = "FPS: " + str(self.fps)
+                if self.netplay is not None:
+                    self.net_text = "Rollbacks: {0}, most frames resimulated: {1}, stalls: {2}, desyncs: {3}, bad packets: {4}".format(self.netplay.rollbacks, self.netplay.max_resimulated, self.netplay.stalls, self.netplay.desyncs, self.netplay.bad_packets)
                 frames = 0
                 before_sec += SECOND
-            before_time = pygame.time.get_ticks()
+                self.update_latency_text()
 
     def quit(self):
         """
         It quits the game
         """
+        if self.recorder is not None:
+            self.recorder.close()
+        self.save_writer.close()
+        if self.netplay is not None:
+            self.netplay.transport.close()
+        self.profiles_written = self.profiler.finish()
+        if self.allocation_tracker is not None:
+            self.allocation_tracker.stop()
+            self.profiles_written.append(self.allocation_tracker.write_report())
+        if self.debug:
+            self.write_session_report()
         pygame.quit()
 
+    def update_latency_text(self):
+        """
+        Refreshes the latency line of the debug overlay, done once a second since it has to sort the samples
+        """
+        latencies = self.latency_tracker.percentiles()
+        if latencies is not None:
+            # Without event timestamps the clock starts at the poll before the event, so this can be up to a frame high
+            label = "Latency upper bound" if self.input_queue.timestamps_missing else "Latency"
+            self.latency_text = label + " p50/p95/p99: {0:.1f} / {1:.1f} / {2:.1f} ms".format(latencies[0], latencies[1], latencies[2])
+
+    def write_session_report(self):
+        """
+        Writes a JSON summary of this play session to data/reports/
+        """
+        report = {}
+        report["date"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        report["fps"] = self.fps
+        report["input_latency"] = self.latency_tracker.report()
+        report["input_latency"]["upper_bound"] = self.input_queue.timestamps_missing
+        report["profiles"] = self.profiles_written
+
+        os.makedirs("data/reports", exist_ok=True)
+        report_file = open("data/reports/session-" + time.strftime("%Y%m%d-%H%M%S") + ".json", "w")
+        json.dump(report, report_file, indent=4)
+        report_file.close()
+
     """
     GAME OBJECTS AND LOGIC
     """
@@ -174,23 +392,483 @@ class Game():
     def start_game(self):
         """
         Initialize game objects, usually from other classes
+        The level is loaded on a worker thread while the loading screen is shown
         """
+        self.gamestate = 1
+        self.level = None
+        self.recorder = None
+        self.map_watcher = None
+        self.netplay = None
+        self.net_bot = None
+        self.remote_player = None
+        self.net_text = ""
+
+        # Split screen has a level per player, all sharing player one's map, and a part of the screen for each
+        self.split_levels = None
+        self.viewports = None
+
+        # Every fish being played, so drawing and effects don't need to know where each one came from
+        self.players = []
+
+        # Which tiles of each map have been seen, mapfile -> the minimap's revealed bytes, see minimap.py
+        # Tiles within MINIMAP_REVEAL_RADIUS of a player are revealed whenever they move onto a new tile
+        self.show_minimap = True
+        self.explored = {}
+        self.explored_from = {}
+        self.MINIMAP_REVEAL_RADIUS = 8
+        self.MINIMAP_RECT = pygame.Rect(self.SCREEN_WIDTH - 266, 10, 256, 160)
+        self.level_manager = levelmanager.LevelManager()
+        self.levels_to_prepare = []
+
+        # Saves are snapshots of the level written to disk by the save writer's thread
+        # An autosave is made every AUTOSAVE_TIME so there's something to go back to after a crash
+        self.save_writer = savestate.SaveWriter()
+        self.save_buffer = None
+        self.AUTOSAVE_TIME = 30 * 60
+        self.autosave_timer = 0
+
+        # A save that's waiting for its level to be ready before it can be restored
+        self.pending_restore = None
+        if self.load_filename is not None:
+            self.pending_restore = savestate.read_save(self.load_filename)
+            if self.pending_restore is not None:
+                self.mapfile = self.pending_restore[0]
+        self.level_manager.prepare(self.mapfile)
+
+        # Bubble trails and silt puffs, these are only for show so they live outside the simulation
+        self.particles = particles.ParticleSystem()
+        self.bubble_effect, self.silt_effect = particles.make_player_effects(self.particles)
+        self.fish_on_wall = {}
+
+    def check_level_loaded(self):
+        """
+        Switches from the loading screen to the game once the level manager has the first level ready
+        """
+        if self.level_manager.has_failed(self.mapfile):
+            # Most likely the map couldn't be loaded and the map loader already printed why
+            self.running = False
+            return
+        self.prepare_tilesets()
+        prepared = self.level_manager.get(self.mapfile)
+        if prepared is None or prepared.tileset_image is not None:
+            return
+        self.level = self.level_manager.take(self.mapfile).level
+        self.startup_timer.mark("level")
         self.gamestate = 0
-        self.level = level.Level()
+
+        # Online play replaces most of the single player features, since both sides have to see the same game
+        if self.net_peer is not None or self.net_loopback is not None:
+            self.start_netplay()
+            self.update_player_list()
+            return
+
+        self.level.latency = self.latency_tracker
+        if self.split_players > 1:
+            self.start_split_screen()
+        self.update_player_list()
+
+        started_from_save = self.pending_restore is not None
+        if started_from_save:
+            self.check_pending_restore()
+
+        # Start loading every level we can get to from here
+        self.level_manager.prepare_exits(self.level)
+
+        # If we're recording, every frame of input the level gets from here on is written to the file
+        # A replay starts from a freshly loaded map, so a game that started from a save can't be recorded
+        if self.record_filename is not None and started_from_save:
+            print("Error! Not recording, recordings can't start from a save")
+        elif self.record_filename is not None:
+            self.recorder = replay.InputRecorder(self.record_filename, self.level.mapfile)
+
+        # In debug mode, edits to the map or its tileset are applied while the game is running
+        if self.debug:
+            self.map_watcher = hotreload.FileWatcher()
+            self.watch_map_files()
+
+    def start_split_screen(self):
+        """
+        Gives every other player a level sharing our map and a part of the screen to see it through
+        Two players get the left and right halves, three or four get a quarter each
+        """
+        half_width = self.SCREEN_WIDTH // 2
+        half_height = self.SCREEN_HEIGHT // 2
+        if self.split_players == 2:
+            rects = [(0, 0, half_width, self.SCREEN_HEIGHT), (half_width, 0, half_width, self.SCREEN_HEIGHT)]
+        else:
+            rects = [(0, 0, half_width, half_height), (half_width, 0, half_width, half_height),
+                     (0, half_height, half_width, half_height), (half_width, half_height, half_width, half_height)]
+        # Subsurfaces draw straight into the screen, so nothing has to be copied across after each view is drawn
+        self.viewports = [self.screen.subsurface(rects[i]) for i in range(0, self.split_players)]
+
+        self.split_levels = [self.level]
+        for i in range(1, self.split_players):
+            self.split_levels.append(level.Level(self.level.mapfile, self.level.map))
+        self.fit_split_levels()
+
+    def fit_split_levels(self):
+        """
+        Sizes every split screen level's camera to its viewport
+        """
+        for i in range(0, len(self.split_levels)):
+            self.split_levels[i].set_view_size(self.viewports[i].get_width(), self.viewports[i].get_height())
+            self.split_levels[i].update_camera()
+
+    def update_player_list(self):
+        self.players = [self.level.player]
+        if self.split_levels is not None:
+            self.players = [split_level.player for split_level in self.split_levels]
+        if self.remote_player is not None:
+            self.players.append(self.remote_player)
+
+    def start_netplay(self):
+        """
+        Sets up a rollback session with another player, either over UDP or against a bot over a loopback connection
+        Player net_player is us, the other player gets a simulation sharing our map
+        """
+        mapfile = self.level.mapfile
+        gfx_path = self.level.map.GFX_PATH
+        other = simulation.Simulation(mapfile, gfx_path, self.level.map)
+        sims = [other, other]
+        sims[self.net_player] = self.level
+        self.remote_player = other.player
+
+        if self.net_loopback is not None:
+            latency, jitter, loss = self.net_loopback
+            transport, bot_transport = netplay.make_loopback_pair(latency / 1000, jitter / 1000, loss)
+            # The other side is a bot pressing random buttons on its own copy of the game
+            bot_sims = [simulation.Simulation(mapfile, gfx_path, self.level.map), simulation.Simulation(mapfile, gfx_path, self.level.map)]
+            self.net_bot = netplay.RollbackSession(bot_sims, 1 - self.net_player, bot_transport, input_delay=self.net_delay)
+            self.net_bot_script = netplay.random_input_frames(int(time.time()), 60 * 60 * 60)
+        else:
+            host, port = self.net_peer.split(":")
+            transport = netplay.UdpTransport(self.net_port, (host, int(port)))
+        self.netplay = netplay.RollbackSession(sims, self.net_player, transport, input_delay=self.net_delay)
+        self.net_events = []
+
+    def update_netplay(self):
+        """
+        Runs one frame of online play. Every display frame is one simulation frame, so that both sides step the same way
+        """
+        while self.input_queue.count != 0:
+            i = self.input_queue.pop()
+            self.net_events.append((self.input_queue.types[i], self.input_queue.actions[i], self.input_queue.values[i]))
+        # If we're too far ahead of the other player nothing happens this frame, and the events are sent again next frame
+        if self.netplay.advance(self.net_events):
+            self.net_events = []
+        if self.net_bot is not None:
+            self.net_bot.advance(self.net_bot_script.get(self.net_bot.local_latest + 1 - self.net_delay, []))
+
+    def prepare_tilesets(self):
+        """
+        Slices and converts the tileset of a level the level manager just finished loading
+        Only one tileset is sliced per call so a bunch of levels finishing at once can't blow the frame budget
+        """
+        self.levels_to_prepare += self.level_manager.poll()
+        while len(self.levels_to_prepare) != 0:
+            prepared = self.levels_to_prepare.pop(0)
+            if prepared.tileset_image is None:
+                continue
+            tileset_image = prepared.tileset_image
+            prepared.tileset_image = None
+            # Levels that share a tileset only need it sliced once
+            if prepared.level.map.tileset not in self.tileset_opacity:
+                self.load_tileset(prepared.level.map.tileset, prepared.level.map.alphas, tileset_image)
+                return
+
+    def check_level_exit(self):
+        """
+        If the player is standing on an exit, switches to the level it leads to
+        If that level isn't ready yet we just carry on in this one until it is
+        """
+        if self.level.exit_reached is None:
+            return
+        mapfile, spawn = self.level.exit_reached
+        if self.is_level_ready(mapfile):
+            self.switch_level(mapfile, spawn)
+            self.save_game("checkpoint")
+        elif self.level_manager.has_failed(mapfile):
+            # Close off every exit to that level so we don't keep trying
+            print("Error! Could not load " + mapfile + ", closing the exits to it")
+            exits = self.level.map.exits
+            self.level.map.exits = {tile: exits[tile] for tile in exits if exits[tile][0] != mapfile}
+
+    def is_level_ready(self, mapfile):
+        """
+        Returns true if the level for mapfile can be switched to without any loading
+        If it can't, makes sure it's on its way
+        """
+        prepared = self.level_manager.get(mapfile)
+        if prepared is None:
+            # It might have been dropped to make room for other levels
+            if not self.level_manager.has_failed(mapfile):
+                self.level_manager.prepare(mapfile)
+            return False
+        if prepared.tileset_image is not None:
+            # prepare_tilesets() hasn't gotten to it yet
+            return False
+        if prepared.level.map.tileset not in self.tileset_opacity:
+            # Only happens if the tileset was thrown out of the cache after the level was prepared
+            self.load_tileset(prepared.level.map.tileset, prepared.level.map.alphas)
+            return False
+        return True
+
+    def save_game(self, name):
+        """
+        Snapshots the level and hands it to the save writer, the file is written in the background
+        """
+        self.save_buffer = self.level.snapshot(self.save_buffer)
+        self.save_writer.save(name, self.level.mapfile, self.save_buffer)
+        self.autosave_timer = 0
+
+    def load_game(self, filename):
+        """
+        Goes back to the state in a save file, if the save is of another level it's restored once that level is ready
+        """
+        self.pending_restore = savestate.read_save(filename)
+        if self.pending_restore is not None:
+            self.check_pending_restore()
+
+    def check_pending_restore(self):
+        """
+        Restores the pending save if its level is ready, switching levels first if we need to
+        """
+        mapfile, state = self.pending_restore
+        if mapfile != self.level.mapfile:
+            if not self.is_level_ready(mapfile):
+                if self.level_manager.has_failed(mapfile):
+                    print("Error! Could not load " + mapfile + " for the save")
+                    self.pending_restore = None
+                return
+            self.stop_recording("recordings can't go back to a save")
+            self.switch_level(mapfile, None)
+        # A replay only has the inputs, so it would carry on from where we were instead of from the save
+        self.stop_recording("recordings can't go back to a save")
+        self.level.restore(state)
+        self.pending_restore = None
+
+    def stop_recording(self, reason):
+        """
+        Closes the recording if there is one, for when the game does something a replay can't follow
+        """
+        if self.recorder is None:
+            return
+        print("Stopped recording, " + reason)
+        self.recorder.close()
+        self.recorder = None
+
+    def switch_level(self, mapfile, spawn):
+        """
+        Swaps in a prepared level, everything expensive was already done so this is just moving some state around
+        """
+        start = time.perf_counter()
+        old_level = self.level
+        self.level = self.level_manager.take(mapfile).level
+        self.level.enter_from(old_level, spawn)
+        old_level.latency = None
+        old_level.exit_reached = None
+        self.level.latency = self.latency_tracker
+        self.level_manager.give_back(old_level)
+        self.level_manager.prepare_exits(self.level)
+
+        # Everyone else follows player one through the exit
+        if self.split_levels is not None:
+            old_levels = self.split_levels
+            self.split_levels = [self.level]
+            for i in range(1, len(old_levels)):
+                follower = level.Level(mapfile, self.level.map)
+                follower.enter_from(old_levels[i], spawn)
+                self.split_levels.append(follower)
+            self.fit_split_levels()
+        self.update_player_list()
+
+        # A recording only knows about one map, so it can't follow us into another
+        self.stop_recording("recordings can't go through level exits")
+        if self.map_watcher is not None:
+            self.watch_map_files()
+        self.particles.clear()
+        self.fish_on_wall = {}
+        if self.debug:
+            print("Switched to " + mapfile + " in {0:.2f} ms".format((time.perf_counter() - start) * 1000))
+
+    def update_particles(self, delta):
+        """
+        Emits bubbles behind any fish that's dashing or sprinting and a puff of silt when one hits a wall, then moves the particles
+        """
+        for fish in self.players:
+            center_x = fish.x + (fish.w / 2)
+            center_y = fish.y + (fish.h / 2)
+            if fish.is_dashing:
+                self.particles.emit(self.bubble_effect, center_x, center_y, 3, fish.dx, fish.dy)
+            elif fish.is_sprinting and (fish.dx != 0 or fish.dy != 0):
+                self.particles.emit(self.bubble_effect, center_x, center_y, 1, fish.dx, fish.dy)
+            # on_wall stays set while the fish rubs along a wall, so only the first frame of contact makes a puff
+            if fish.on_wall and not self.fish_on_wall.get(fish, False):
+                self.particles.emit(self.silt_effect, center_x, center_y, 30)
+            self.fish_on_wall[fish] = fish.on_wall
+        self.particles.update(delta)
+
+    def watch_map_files(self):
+        """
+        Points the map watcher at the current map file and its tileset
+        """
+        self.map_watcher.mtimes = {}
+        self.map_watcher.watch(self.level.mapfile)
+        self.map_watcher.watch(self.level.map.GFX_PATH + self.level.map.tileset + ".txt")
+        self.map_watcher.watch(self.level.map.GFX_PATH + self.level.map.tileset + ".png")
+
+    def check_hot_reload(self):
+        """
+        Applies any changes made to the map or tileset files since the last check
+        Only the changed tiles are updated, and the player and camera are left where they are
+        """
+        changed_files = self.map_watcher.poll()
+        if len(changed_files) == 0:
+            return
+
+        start = time.perf_counter()
+        game_map = self.level.map
+        tileset = game_map.tileset
+        message = "Hot reload:"
+        if game_map.GFX_PATH + tileset + ".txt" in changed_files:
+            try:
+                if game_map.reload_metadata():
+                    self.invalidate_tileset(tileset)
+                message += " tileset metadata,"
+            except ValueError as error:
+                # Same as the map, most likely the file is partway through being saved
+                print("Error! " + str(error))
+                message += " kept the old tileset metadata,"
+        if game_map.GFX_PATH + tileset + ".png" in changed_files:
+            self.invalidate_tileset(tileset)
+            message += " tileset image,"
+        if self.level.mapfile in changed_files:
+            try:
+                cells = game_map.reload_mapfile(self.level.mapfile)
+            except ValueError as error:
+                # Most likely the editor is partway through saving, the watcher will see it again once it's done
+                print("Error! " + str(error))
+                print(message + " kept the old map")
+                return
+            if cells is None:
+                # The map changed size or tileset, so it was loaded from scratch
+                self.invalidate_tileset(tileset)
+                self.watch_map_files()
+                self.lighting = None
+                message += " full map reload,"
+            else:
+                message += " " + str(len(cells)) + " tiles,"
+                # Only the changed cells are drawn again
+                if self.map_renderer is not None and self.map_renderer.map is game_map:
+                    self.map_renderer.index_animations()
+                    self.map_renderer.redraw_cells(cells)
+                if self.minimap is not None and self.minimap.map is game_map:
+                    self.minimap.redraw_cells(cells)
+            self.level_manager.prepare_exits(self.level)
+        # Light tiles could have been placed, moved, or redefined by either file
+        if self.lighting is not None and self.lighting.map is game_map:
+            self.lighting.index_lights()
+        print(message + " took {0:.2f} ms".format((time.perf_counter() - start) * 1000))
+
+    def invalidate_tileset(self, base_name):
+        """
+        Throws away the cached slices and opacity of a tileset so they're rebuilt next time they're drawn
+        """
+        prefix = base_name + ":"
+        for name in list(self.image_cache.keys()):
+            if name.startswith(prefix):
+                del self.image_cache[name]
+                if name in self.image_timeout:
+                    del self.image_timeout[name]
+        if base_name in self.tileset_opacity:
+            del self.tileset_opacity[base_name]
+        if base_name in self.tileset_names:
+            del self.tileset_names[base_name]
+        self.map_renderer = None
+        # Only hot reloads of the current level get here, so it's the only minimap that could be out of date
+        self.minimap = None
+        self.level.minimap = None
 
     def render_game(self):
+        if self.split_levels is None:
+            self.render_view(self.level)
+            if self.show_minimap:
+                self.render_minimap()
+            return
+
+        # Each view is drawn with self.screen swapped for its viewport, everything else is shared between them
+        screen = self.screen
+        for i in range(0, len(self.split_levels)):
+            self.screen = self.viewports[i]
+            self.render_view(self.split_levels[i])
+        self.screen = screen
+        pygame.draw.line(self.screen, self.BLACK, (self.SCREEN_WIDTH // 2, 0), (self.SCREEN_WIDTH // 2, self.SCREEN_HEIGHT), 4)
+        if len(self.split_levels) > 2:
+            pygame.draw.line(self.screen, self.BLACK, (0, self.SCREEN_HEIGHT // 2), (self.SCREEN_WIDTH, self.SCREEN_HEIGHT // 2), 4)
+        if self.show_minimap:
+            self.render_minimap()
+
+    def render_view(self, view_level):
+        """
+        Draws the game as seen by view_level's camera onto self.screen
+        """
         # pygame.draw.rect(self.screen, self.RED, self.level.player.as_rect())
-        self.render_map()
-        self.render_image("fish_0", self.level.get_rect(self.level.player))
-
-    def render_map(self):
-        for x in range(0, self.level.map.WIDTH_IN_TILES):
-            for y in range(0, self.level.map.HEIGHT_IN_TILES):
-                draw_rect = self.level.get_tile_rect(x, y)
-                if draw_rect.colliderect(self.SCREEN_RECT):
-                    self.render_image(self.level.map.tileset + ":" + str(self.level.map.get_tile(x, y)), draw_rect)
-                    if self.level.map.get_wall(x, y) != -1:
-                        self.render_image(self.level.map.tileset + ":" + str(self.level.map.get_wall(x, y)), draw_rect)
+        self.render_map(view_level)
+        for fish in self.players:
+            self.render_image("fish_0", view_level.get_rect(fish))
+        self.particles.draw(self.screen, view_level.camera_x, view_level.camera_y)
+        if self.use_lighting:
+            self.render_lighting(view_level)
+
+    def render_map(self, view_level):
+        # Make sure the tileset is sliced and classified before the renderer asks for its tiles
+        game_map = view_level.map
+        if game_map.tileset not in self.tileset_opacity:
+            self.load_tileset(game_map.tileset)
+            self.map_renderer = None
+        if self.map_renderer is None or self.map_renderer.map is not game_map:
+            tiles = [self.image_cache[name] for name in self.tileset_names[game_map.tileset]]
+            # Every view shares the one renderer, so it has to be able to hold the chunks all of them can see
+            self.map_renderer = maprender.MapRenderer(game_map, tiles, self.tileset_opacity[game_map.tileset], 24 * self.split_players)
+
+        self.map_renderer.draw(self.screen, view_level.camera_x, view_level.camera_y)
+        self.skipped_blits_total = self.map_renderer.skipped_blits_total
+
+    def render_lighting(self, view_level):
+        game_map = view_level.map
+        if self.lighting is None or self.lighting.map is not game_map:
+            self.lighting = lighting.Lighting(game_map, 24 * self.split_players)
+
+        camera_x = view_level.camera_x
+        camera_y = view_level.camera_y
+        self.lighting.begin(self.screen, camera_x, camera_y)
+        for fish in self.players:
+            self.lighting.add_light(fish.x + (fish.w / 2), fish.y + (fish.h / 2), lighting.Lighting.PLAYER_LIGHT_RADIUS, lighting.Lighting.PLAYER_LIGHT_COLOR)
+        self.lighting.apply(self.screen, camera_x, camera_y)
+
+    def render_minimap(self):
+        game_map = self.level.map
+        if self.level.minimap is None:
+            # Only levels that didn't come from the level manager, or whose tileset was just reloaded, end up here
+            # The map's tiles were sliced by render_map() already
+            tiles = [self.image_cache[name] for name in self.tileset_names[game_map.tileset]]
+            self.level.minimap = minimap.Minimap(game_map, [tuple(pygame.transform.average_color(tile))[:3] for tile in tiles])
+        if self.minimap is not self.level.minimap:
+            self.minimap = self.level.minimap
+            revealed = self.explored.get(self.level.mapfile)
+            if revealed is None or len(revealed) != len(self.minimap.revealed):
+                self.explored[self.level.mapfile] = self.minimap.revealed
+            elif revealed is not self.minimap.revealed:
+                self.minimap.set_revealed(revealed)
+            self.explored_from = {}
+
+        # Only moving onto a new tile can reveal anything
+        for fish in self.players:
+            tile = (int((fish.x + (fish.w / 2)) // game_map.TILE_WIDTH), int((fish.y + (fish.h / 2)) // game_map.TILE_HEIGHT))
+            if self.explored_from.get(fish) != tile:
+                self.explored_from[fish] = tile
+                self.minimap.reveal(tile[0], tile[1], self.MINIMAP_REVEAL_RADIUS)
+        self.minimap.draw(self.screen, self.MINIMAP_RECT, self.players)
 
     """
     FONT AND RENDERING
@@ -207,6 +885,23 @@ class Game():
         self.text_cache = {}
         self.image_cache = {}
 
+        # Maps tileset name -> list where index i is True if tile i is fully opaque
+        # This never times out since it's tiny and only computed once per tileset
+        self.tileset_opacity = {}
+        self.skipped_blits_total = 0
+
+        # Maps tileset name -> list where index i is the image cache name of tile i, so we don't build names while drawing
+        self.tileset_names = {}
+
+        # Draws the current level's map, made again whenever the map or its tileset changes
+        self.map_renderer = None
+
+        # Darkens the map by depth and lights it back up, made again whenever the map changes
+        self.lighting = None
+
+        # The current level's minimap, the exploring is kept in self.explored so it survives the minimap being made again
+        self.minimap = None
+
         # Timeouts for caches so we don't hold on to variables we won't use
         self.CACHE_TIMEOUT = 3 * 60 * 60
         self.font_timeout = {}
@@ -261,8 +956,9 @@ class Game():
         # If the font / text object for the passed string isn't in the cache, add it to the cache
         if size not in self.font_cache:
             self.font_cache[size] = pygame.font.SysFont("Serif", size)
-        # This variable prevents us from using an object of the same message but a different size/color than requested
-        text_id = text + "&sz=" + str(size) + "&colo=" + str(color)
+        # This key prevents us from using an object of the same message but a different size/color than requested
+        # A tuple is used rather than building a string, small tuples are reused by python instead of allocated
+        text_id = (text, size, color)
         if text_id not in self.text_cache:
             self.text_cache[text_id] = self.font_cache[size].render(text, False, color)
 
@@ -297,18 +993,7 @@ class Game():
         if ":" in name:
             # If tileset not loaded, load each image of the tileset into the cache
             if name not in self.image_cache:
-                base_name = name[:name.index(":")]
-                tileset = pygame.image.load("res/gfx/" + base_name + ".png")
-                tileset_rect = tileset.get_rect()
-                tileset_width = int(tileset_rect.w / 64)
-                tileset_height = int(tileset_rect.h / 64)
-                for x in range(0, tileset_width):
-                    for y in range(0, tileset_height):
-                        index = x + (y * tileset_width)
-                        if index in self.level.map.alphas:
-                            self.image_cache[base_name + ":" + str(index)] = tileset.subsurface(pygame.Rect(x * 64, y * 64, 64, 64))
-                        else:
-                            self.image_cache[base_name + ":" + str(index)] = tileset.subsurface(pygame.Rect(x * 64, y * 64, 64, 64)).convert()
+                self.load_tileset(name[:name.index(":")])
 
         # If the image object for the passed string isn't in the cache, add it to the cache
         if name not in self.image_cache:
@@ -332,6 +1017,48 @@ class Game():
 
         self.screen.blit(self.image_cache[name], (draw_x, draw_y))
 
+    def load_tileset(self, base_name, alphas=None, tileset=None):
+        """
+        Slices a tileset into 64x64 tiles and puts each of them in the image cache
+        under the name "<tileset-name>:<index>"
+        While we have the pixels on hand we also classify each tile as opaque or not,
+        that way the map renderer knows which floor tiles are completely hidden by walls
+        alphas defaults to the current map's, and tileset can be an image that's already been decoded
+        """
+        if alphas is None:
+            alphas = self.level.map.alphas
+        if tileset is None:
+            tileset = pygame.image.load("res/gfx/" + base_name + ".png")
+        tileset_rect = tileset.get_rect()
+        tileset_width = int(tileset_rect.w / 64)
+        tileset_height = int(tileset_rect.h / 64)
+        opacity = [False] * (tileset_width * tileset_height)
+        names = [base_name + ":" + str(index) for index in range(0, tileset_width * tileset_height)]
+        for x in range(0, tileset_width):
+            for y in range(0, tileset_height):
+                index = x + (y * tileset_width)
+                tile = tileset.subsurface(pygame.Rect(x * 64, y * 64, 64, 64))
+                if index in alphas:
+                    self.image_cache[names[index]] = tile
+                    opacity[index] = self.is_surface_opaque(tile)
+                else:
+                    # Tiles not listed in alphas get converted without an alpha channel, so they always cover what's under them
+                    self.image_cache[names[index]] = tile.convert()
+                    opacity[index] = True
+        self.tileset_opacity[base_name] = opacity
+        self.tileset_names[base_name] = names
+
+    def is_surface_opaque(self, surface):
+        """
+        Returns true if every pixel of the surface is fully opaque
+        """
+        # Surfaces without per pixel alpha or a colorkey can't have any see-through pixels
+        if surface.get_flags() & pygame.SRCALPHA == 0 and surface.get_colorkey() is None:
+            return surface.get_alpha() is None or surface.get_alpha() == 255
+        # A mask with threshold 254 only sets the bits of pixels with alpha == 255
+        mask = pygame.mask.from_surface(surface, 254)
+        return mask.count() == surface.get_width() * surface.get_height()
+
     """
     GENERAL INPUT HANDLING
     """
@@ -345,7 +1072,7 @@ class Game():
         """
 
         # Define game inputs
-        self.input_names = ["Axis Player Horiz", "Axis Player Vert", "Fish Dash", "Fish Sprint"]
+        self.input_names = list(inputqueue.ACTION_NAMES)
 
         # Refill the input_names array, adding values for axis-as-button
         placeholder = self.input_names
@@ -368,13 +1095,11 @@ class Game():
         self.key_map[pygame.K_SPACE] = "Fish Dash"
         self.key_map[pygame.K_LSHIFT] = "Fish Sprint"
 
-        # Initialize joysticks
+        # Joysticks aren't opened until after the first frame, see init_joysticks()
         self.joystick_labels = "ABCDEFGHIJ"
-        self.joystick_count = pygame.joystick.get_count()
+        self.joystick_count = 0
         self.joysticks = []
-        for i in range(0, self.joystick_count):
-            self.joysticks.append(pygame.joystick.Joystick(i))
-            self.joysticks[i].init()
+        self.joysticks_ready = False
 
         # Initialize input map and states
         self.input_map = {}
@@ -388,156 +1113,319 @@ class Game():
                 self.input_states[self.input_names[i]] = 0
             else:
                 self.input_states[self.input_names[i]] = False
-        self.input_queue = []
+        self.input_queue = inputqueue.InputQueue()
+        self.event_time = None
+
+        # Each split screen player has their own input states and queue, player one's are the ones above
+        self.player_input_states = [self.input_states]
+        self.input_queues = [self.input_queue]
+        for i in range(1, self.split_players):
+            self.player_input_states.append(dict(self.input_states))
+            self.input_queues.append(inputqueue.InputQueue())
 
         # Attempt to load inputs from file
         self.load_joyconfig()
+        self.compile_input_bindings()
+
+    def init_joysticks(self):
+        """
+        Initializes the joystick module and opens every connected joystick
+        This can take a while with a lot of devices connected so it's done after the first frame is shown
+        """
+        pygame.joystick.init()
+        self.joystick_count = pygame.joystick.get_count()
+        self.joysticks = []
+        for i in range(0, self.joystick_count):
+            self.joysticks.append(pygame.joystick.Joystick(i))
+            self.joysticks[i].init()
+        self.joystick_text = "Joysticks: " + str(self.joystick_count)
+        self.joysticks_ready = True
+
+    def compile_input_bindings(self):
+        """
+        Turns key_map and input_map into lookup tables so that handle_event() doesn't have to do any string work
+        Must be called whenever key_map or input_map changes
+        Each binding is a tuple of (action id, axis sign, opposite control, press event type, release event type)
+        where axis sign is 1 or -1 for an axis-as-button and 0 for a regular button, and opposite control
+        is the control bound to the other direction of the same axis (or None)
+        """
+
+        # Action ids are indices into the list of input state names
+        self.action_names = inputqueue.ACTION_NAMES
+        self.action_ids = {}
+        for i in range(0, len(self.action_names)):
+            self.action_ids[self.action_names[i]] = i
+
+        # Keyboard bindings
+        key_controls = {}
+        for key in self.key_map:
+            key_controls[self.key_map[key]] = ("key", key)
+        self.key_dispatch = {}
+        for key in self.key_map:
+            self.key_dispatch[key] = self.compile_binding(self.key_map[key], key_controls)
+
+        # Joystick bindings, one table per joystick label so the joystick index can be used directly
+        joystick_controls = {}
+        for input_name in self.input_map:
+            control = self.parse_control(input_name)
+            if control is not None:
+                joystick_controls[self.input_map[input_name]] = control
+        self.joy_button_dispatch = []
+        self.joy_axis_dispatch = []
+        self.joy_hat_dispatch = []
+        for i in range(0, len(self.joystick_labels)):
+            self.joy_button_dispatch.append({})
+            self.joy_axis_dispatch.append({})
+            self.joy_hat_dispatch.append({})
+        for name in joystick_controls:
+            control = joystick_controls[name]
+            joy = control[1]
+            if control[0] == "button":
+                self.joy_button_dispatch[joy][control[2]] = self.compile_binding(name, joystick_controls)
+            elif control[0] == "axis":
+                # Axis entries are [analog binding, pos binding, neg binding]
+                if control[2] not in self.joy_axis_dispatch[joy]:
+                    self.joy_axis_dispatch[joy][control[2]] = [None, None, None]
+                if control[3] == 0:
+                    self.joy_axis_dispatch[joy][control[2]][0] = self.action_ids[name]
+                elif control[3] == 1:
+                    self.joy_axis_dispatch[joy][control[2]][1] = self.compile_binding(name, joystick_controls)
+                else:
+                    self.joy_axis_dispatch[joy][control[2]][2] = self.compile_binding(name, joystick_controls)
+            elif control[0] == "hat":
+                # Hat entries are [up, down, left, right]
+                if control[2] not in self.joy_hat_dispatch[joy]:
+                    self.joy_hat_dispatch[joy][control[2]] = [None, None, None, None]
+                self.joy_hat_dispatch[joy][control[2]]["UDLR".index(control[5])] = self.compile_binding(name, joystick_controls)
+
+        # In split screen everyone plays with the controls set up for joystick A, each on their own joystick
+        if self.split_players > 1:
+            for joy in range(1, len(self.joystick_labels)):
+                self.joy_button_dispatch[joy] = {}
+                for button in self.joy_button_dispatch[0]:
+                    self.joy_button_dispatch[joy][button] = self.retarget_binding(self.joy_button_dispatch[0][button], joy)
+                self.joy_axis_dispatch[joy] = {}
+                for axis in self.joy_axis_dispatch[0]:
+                    analog, positive, negative = self.joy_axis_dispatch[0][axis]
+                    self.joy_axis_dispatch[joy][axis] = [analog, self.retarget_binding(positive, joy), self.retarget_binding(negative, joy)]
+                self.joy_hat_dispatch[joy] = {}
+                for hat in self.joy_hat_dispatch[0]:
+                    self.joy_hat_dispatch[joy][hat] = [self.retarget_binding(binding, joy) for binding in self.joy_hat_dispatch[0][hat]]
+
+    def retarget_binding(self, binding, joy):
+        """
+        Returns a copy of a joystick binding for the same control on another joystick
+        """
+        if binding is None:
+            return None
+        opposite = binding[2]
+        if opposite is not None and opposite[0] != "key":
+            opposite = (opposite[0], joy) + opposite[2:]
+        return (binding[0], binding[1], opposite, binding[3], binding[4])
+
+    def compile_binding(self, name, controls):
+        """
+        Returns the binding tuple for the game input name, see compile_input_bindings()
+        controls maps game input names to the control they're bound to, and is used to find the opposite control
+        """
+        if name.endswith(" Pos") or name.endswith(" Neg"):
+            base_name = name[:-4]
+            name_as_axis = "Axis " + base_name
+            if name.endswith(" Pos"):
+                sign = 1
+                opposite = controls.get(base_name + " Neg")
+            else:
+                sign = -1
+                opposite = controls.get(base_name + " Pos")
+            return (self.action_ids[name_as_axis], sign, opposite, inputqueue.EVENT_AXIS_MOVED, inputqueue.EVENT_AXIS_MOVED)
+        return (self.action_ids[name], 0, None, inputqueue.EVENT_BUTTON_DOWN, inputqueue.EVENT_BUTTON_UP)
+
+    def parse_control(self, input_name):
+        """
+        Turns a controller input code like A0, Bx1+ or At0U into a control tuple
+            ("button", joystick, button)
+            ("axis", joystick, axis, sign) where sign is 0 for the whole axis or 1 / -1 for axis-as-button
+            ("hat", joystick, hat, hat axis, value, direction letter)
+        Returns None if the joystick label is unknown or the code can't be read
+        """
+        if len(input_name) < 2 or input_name[0] not in self.joystick_labels:
+            return None
+        joy = self.joystick_labels.index(input_name[0])
+        code = input_name[1:]
+        try:
+            if code.startswith("x"):
+                if code.endswith("+"):
+                    return ("axis", joy, int(code[1:-1]), 1)
+                elif code.endswith("-"):
+                    return ("axis", joy, int(code[1:-1]), -1)
+                return ("axis", joy, int(code[1:]), 0)
+            elif code.startswith("t"):
+                direction = code[-1]
+                hat = int(code[1:-1])
+                if direction == "U":
+                    return ("hat", joy, hat, 1, 1, direction)
+                elif direction == "D":
+                    return ("hat", joy, hat, 1, -1, direction)
+                elif direction == "L":
+                    return ("hat", joy, hat, 0, -1, direction)
+                elif direction == "R":
+                    return ("hat", joy, hat, 0, 1, direction)
+                raise ValueError("unknown hat direction " + direction)
+            return ("button", joy, int(code))
+        except ValueError:
+            # A hand edited config can have anything in it, a bad code just leaves the action unbound
+            print("Error! Couldn't read controller input " + input_name)
+            return None
+
+    def control_down(self, control):
+        """
+        Returns true if the control (a tuple from parse_control() or a ("key", key) tuple) is being held
+        """
+        if control is None:
+            return False
+        if control[0] == "key":
+            return bool(pygame.key.get_pressed()[control[1]])
+        if control[1] >= self.joystick_count:
+            return False
+        joystick = self.joysticks[control[1]]
+        if control[0] == "button":
+            return joystick.get_button(control[2]) == 1
+        elif control[0] == "axis":
+            return joystick.get_axis(control[2]) * control[3] > self.AXIS_THRESHOLD
+        return joystick.get_hat(control[2])[control[3]] == control[4]
 
     def handle_event(self, event):
         """
         This function handles key input when the input is for an actual game key / joystick press
         It then takes that input and changes the various state variables
+        All the work of figuring out what an input does is done ahead of time in compile_input_bindings()
         """
-        if not self.use_joystick:
+        if event.type == pygame.KEYDOWN or event.type == pygame.KEYUP:
+            if self.use_joystick:
+                return
             if event.type == pygame.KEYDOWN:
-                if event.key in self.key_map.keys():
-                    name = self.key_map[event.key]
-                    self.handle_button_press(name)
-            elif event.type == pygame.KEYUP:
-                if event.key in self.key_map.keys():
-                    name = self.key_map[event.key]
-                    opposite_down = False
-                    if name.endswith(" Pos"):
-                        opposite_name = name[:name.index(" Pos")] + " Neg"
-                        opposite_key = list(self.key_map.keys())[list(self.key_map.values()).index(opposite_name)]
-                        opposite_down = (pygame.key.get_pressed())[opposite_key]
-                    elif name.endswith(" Neg"):
-                        opposite_name = name[:name.index(" Neg")] + " Pos"
-                        opposite_key = list(self.key_map.keys())[list(self.key_map.values()).index(opposite_name)]
-                        opposite_down = (pygame.key.get_pressed())[opposite_key]
-                    self.handle_button_release(name, opposite_down)
-        else:
+                binding = self.key_dispatch.get(event.key)
+                if binding is not None:
+                    self.handle_button_press(binding)
+            else:
+                binding = self.key_dispatch.get(event.key)
+                if binding is not None:
+                    self.handle_button_release(binding, self.control_down(binding[2]))
+        elif self.use_joystick or self.split_players > 1:
+            # In split screen the keyboard is player one, so joysticks are used even without --joystick-enable
+            if event.type not in (pygame.JOYBUTTONDOWN, pygame.JOYBUTTONUP, pygame.JOYAXISMOTION, pygame.JOYHATMOTION):
+                return
+            player = self.get_joystick_player(event.joy)
+            if player is None:
+                return
             if event.type == pygame.JOYBUTTONDOWN:
-                input_name = self.joystick_labels[event.joy] + str(event.button)
-                if input_name in self.input_map.keys():
-                    name = self.input_map[input_name]
-                    self.handle_button_press(name)
+                binding = self.joy_button_dispatch[event.joy].get(event.button)
+                if binding is not None:
+                    self.handle_button_press(binding, player)
             elif event.type == pygame.JOYBUTTONUP:
-                input_name = self.joystick_labels[event.joy] + str(event.button)
-                if input_name in self.input_map.keys():
-                    name = self.input_map[input_name]
-                    opposite_down = False
-                    if name.endswith(" Pos"):
-                        opposite_name = name[:name.index(" Pos")] + " Neg"
-                        opposite_key = list(self.input_map.keys())[list(self.input_map.values()).index(opposite_name)]
-                        opposite_down = (pygame.key.get_pressed())[opposite_key]
-                    elif name.endswith(" Neg"):
-                        opposite_name = name[:name.index(" Neg")] + " Pos"
-                        opposite_key = list(self.input_map.keys())[list(self.input_map.values()).index(opposite_name)]
-                        opposite_down = (pygame.key.get_pressed())[opposite_key]
-                    self.handle_button_release(name, opposite_down)
+                binding = self.joy_button_dispatch[event.joy].get(event.button)
+                if binding is not None:
+                    self.handle_button_release(binding, self.control_down(binding[2]), player)
             elif event.type == pygame.JOYAXISMOTION:
-                input_name = self.joystick_labels[event.joy] + "x" + str(event.axis)
+                axis = self.joy_axis_dispatch[event.joy].get(event.axis)
+                if axis is None:
+                    return
                 axis_pos = self.joysticks[event.joy].get_axis(event.axis)
                 if abs(axis_pos) < self.AXIS_THRESHOLD:
                     axis_pos = 0
-                if input_name in self.input_map.keys():
-                    name = self.input_map[input_name]
-                    self.input_queue.append("AxisMoved:" + name)
-                    self.input_states[name] = axis_pos
-                input_pos = input_name + "+"
-                if input_pos in self.input_map.keys():
-                    name = self.input_map[input_pos]
+                if axis[0] is not None:
+                    self.player_input_states[player][self.action_names[axis[0]]] = axis_pos
+                    self.input_queues[player].push(inputqueue.EVENT_AXIS_MOVED, axis[0], axis_pos, self.event_time)
+                if axis[1] is not None:
                     if axis_pos > 0:
-                        self.handle_button_press(name)
+                        self.handle_button_press(axis[1], player)
                     else:
-                        self.handle_button_release(name, axis_pos < 0)  # If axis pos is < 0, that means opposite_down = true
-                input_neg = input_name + "-"
-                if input_neg in self.input_map.keys():
-                    name = self.input_map[input_neg]
+                        self.handle_button_release(axis[1], axis_pos < 0, player)  # If axis pos is < 0, that means opposite_down = true
+                if axis[2] is not None:
                     if axis_pos < 0:
-                        self.handle_button_press(name)
+                        self.handle_button_press(axis[2], player)
                     else:
-                        self.handle_button_release(name, axis_pos > 0)  # If axis pos is > 0, that means opposite_down = true
+                        self.handle_button_release(axis[2], axis_pos > 0, player)  # If axis pos is > 0, that means opposite_down = true
             elif event.type == pygame.JOYHATMOTION:
-                input_name = self.joystick_labels[event.joy] + "t" + str(event.hat)
+                hat = self.joy_hat_dispatch[event.joy].get(event.hat)
+                if hat is None:
+                    return
                 hat_pos = self.joysticks[event.joy].get_hat(event.hat)
-                input_up = input_name + "U"
-                if input_up in self.input_map.keys():
-                    name = self.input_map[input_up]
+                if hat[0] is not None:
                     if hat_pos[1] == 1:
-                        self.handle_button_press(name)
+                        self.handle_button_press(hat[0], player)
                     else:
-                        self.handle_button_release(name, hat_pos[1] == -1)
-                input_down = input_name + "D"
-                if input_down in self.input_map.keys():
-                    name = self.input_map[input_down]
+                        self.handle_button_release(hat[0], hat_pos[1] == -1, player)
+                if hat[1] is not None:
                     if hat_pos[1] == -1:
-                        self.handle_button_press(name)
+                        self.handle_button_press(hat[1], player)
                     else:
-                        self.handle_button_release(name, hat_pos[1] == 1)
-                input_left = input_name + "L"
-                if input_left in self.input_map.keys():
-                    name = self.input_map[input_left]
+                        self.handle_button_release(hat[1], hat_pos[1] == 1, player)
+                if hat[2] is not None:
                     if hat_pos[0] == -1:
-                        self.handle_button_press(name)
+                        self.handle_button_press(hat[2], player)
                     else:
-                        self.handle_button_release(name, hat_pos[0] == 1)
-                input_right = input_name + "R"
-                if input_right in self.input_map.keys():
-                    name = self.input_map[input_right]
+                        self.handle_button_release(hat[2], hat_pos[0] == 1, player)
+                if hat[3] is not None:
                     if hat_pos[0] == 1:
-                        self.handle_button_press(name)
+                        self.handle_button_press(hat[3], player)
                     else:
-                        self.handle_button_release(name, hat_pos[0] == -1)
+                        self.handle_button_release(hat[3], hat_pos[0] == -1, player)
 
-    def handle_button_press(self, name):
+    def get_joystick_player(self, joy):
+        """
+        Returns which player the joystick with index joy plays as, or None if it isn't anyone's
+        Without split screen every joystick is player one. With it, joystick i is player i + 1, unless the keyboard
+        is being used, in which case the keyboard is player one and joystick i is player i + 2
+        """
+        if self.split_players == 1:
+            return 0
+        player = joy
+        if not self.use_joystick:
+            player += 1
+        if player >= self.split_players:
+            return None
+        return player
+
+    def handle_button_press(self, binding, player=0):
         """
         Triggers the change in input states for a button being pressed
         The button press will only be triggered once
         """
-        if name.endswith(" Pos"):
-            name_as_axis = "Axis " + name[:name.index(" Pos")]
-            if self.input_states[name_as_axis] != 1:
-                self.input_queue.append("AxisMoved:" + name_as_axis)
-                self.input_states[name_as_axis] = 1
-        elif name.endswith(" Neg"):
-            name_as_axis = "Axis " + name[:name.index(" Neg")]
-            if self.input_states[name_as_axis] != -1:
-                self.input_queue.append("AxisMoved:" + name_as_axis)
-                self.input_states[name_as_axis] = -1
+        input_states = self.player_input_states[player]
+        input_queue = self.input_queues[player]
+        name = self.action_names[binding[0]]
+        sign = binding[1]
+        if sign != 0:
+            if input_states[name] != sign:
+                input_states[name] = sign
+                input_queue.push(binding[3], binding[0], sign, self.event_time)
         else:
-            if not self.input_states[name]:
-                self.input_queue.append("ButtonDown:" + name)
-                self.input_states[name] = True
+            if not input_states[name]:
+                input_states[name] = True
+                input_queue.push(binding[3], binding[0], 1, self.event_time)
 
-    def handle_button_release(self, name, opposite_down):
+    def handle_button_release(self, binding, opposite_down, player=0):
         """
         Triggers the change in input states for a button being released
         The trigger will only be called once per release
         """
-        if name.endswith(" Pos"):
-            name_as_axis = "Axis " + name[:name.index(" Pos")]
-            if self.input_states[name_as_axis] == 1:
-                self.input_queue.append("AxisMoved:" + name_as_axis)
-                # If the opposite key is being held, axis state is -1, else it's 0
-                if opposite_down:
-                    self.input_states[name_as_axis] = -1
-                else:
-                    self.input_states[name_as_axis] = 0
-        elif name.endswith(" Neg"):
-            name_as_axis = "Axis " + name[:name.index(" Neg")]
-            if self.input_states[name_as_axis] == -1:
-                self.input_queue.append("AxisMoved:" + name_as_axis)
-                # If the opposite key is being held, axis state is -1, else it's 0
+        input_states = self.player_input_states[player]
+        input_queue = self.input_queues[player]
+        name = self.action_names[binding[0]]
+        sign = binding[1]
+        if sign != 0:
+            if input_states[name] == sign:
+                # If the opposite key is being held, axis state is the opposite direction, else it's 0
                 if opposite_down:
-                    self.input_states[name_as_axis] = 1
+                    input_states[name] = -sign
                 else:
-                    self.input_states[name_as_axis] = 0
+                    input_states[name] = 0
+                input_queue.push(binding[4], binding[0], input_states[name], self.event_time)
         else:
-            if self.input_states[name]:
-                self.input_queue.append("ButtonUp:" + name)
-                self.input_states[name] = False
+            if input_states[name]:
+                input_states[name] = False
+                input_queue.push(binding[4], binding[0], 0, self.event_time)
 
     """
     JOYCONFIG
@@ -878,7 +1766,20 @@ class Game():
                 key = list(self.input_map.keys())[index]
                 del self.input_map[key]
             self.input_map[name] = game_input
+        self.compile_input_bindings()
+
+
+def main():
+    """
+    Entry point, starts timing right away so --startup-benchmark can break down the startup phases
+    """
+    startup_timer = startup.StartupTimer()
+    startup_timer.mark("interpreter_and_imports")
+    os.environ['SDL_VIDEO_CENTERED'] = '1'  # centers the pygame window
+    game = Game(startup_timer=startup_timer)
+    game.run()
+    game.quit()
 
 
-os.environ['SDL_VIDEO_CENTERED'] = '1'  # centers the pygame window
-game = Game()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# Mariana
+# Code - Matt Madden
+# hotreload.py -- Watches files for changes so maps can be reloaded while the game is running
+
+import os
+import time
+
+
+class FileWatcher():
+    """
+    Polls the modification times of a set of files. Polling is throttled to once every interval
+    seconds so it's cheap enough to call every frame
+    """
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.last_poll = time.perf_counter()
+        self.mtimes = {}
+
+    def get_mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def watch(self, path):
+        """
+        Starts watching path, the current version of the file doesn't count as a change
+        """
+        self.mtimes[path] = self.get_mtime(path)
+
+    def unwatch(self, path):
+        if path in self.mtimes:
+            del self.mtimes[path]
+
+    def poll(self):
+        """
+        Returns a list of the watched files that changed since the last poll
+        """
+        now = time.perf_counter()
+        if now - self.last_poll < self.interval:
+            return []
+        self.last_poll = now
+        changed = []
+        for path in self.mtimes:
+            mtime = self.get_mtime(path)
+            # A missing file is most likely an editor in the middle of saving, so wait until it's back
+            if mtime is not None and mtime != self.mtimes[path]:
+                self.mtimes[path] = mtime
+                changed.append(path)
+        return changed
@@ -0,0 +1,149 @@
+# Mariana
+# Code - Matt Madden
+# inputqueue.py -- Fixed size queue of typed input events passed from the game to the simulation
+
+import sys
+import time
+
+# Event types
+EVENT_AXIS_MOVED = 0
+EVENT_BUTTON_DOWN = 1
+EVENT_BUTTON_UP = 2
+
+# Game actions, an action id is the index of the action in ACTION_NAMES
+ACTION_NAMES = ["Axis Player Horiz", "Axis Player Vert", "Fish Dash", "Fish Sprint"]
+ACTION_PLAYER_HORIZ = 0
+ACTION_PLAYER_VERT = 1
+ACTION_FISH_DASH = 2
+ACTION_FISH_SPRINT = 3
+
+
+class InputQueue():
+    """
+    A ring buffer of input events, read in the order they were pushed
+    Each event is an event type, an action id, a value, and a perf_counter_ns() timestamp
+    The events are stored in preallocated parallel lists so pushing and popping doesn't allocate anything
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.types = [0] * capacity
+        self.actions = [0] * capacity
+        self.values = [0] * capacity
+        self.times = [0] * capacity
+        self.head = 0  # Index of the oldest event
+        self.count = 0
+
+        # Events pushed while the queue is full are thrown away, this counts how many
+        self.dropped = 0
+
+        # The timestamp the current frame started at, the simulation places each event in the frame relative to this
+        # In the live game that's the previous poll, since the events polled this frame came in some time after it
+        self.frame_start = time.perf_counter_ns()
+        self.last_poll = None
+
+        # Set once an event comes in without an SDL timestamp, see get_event_time()
+        self.timestamps_missing = False
+
+    def __len__(self):
+        return self.count
+
+    def begin_frame(self, timestamp=None):
+        """
+        Sets the start of the frame directly, for replays and headless runs that push events with their own times
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter_ns()
+        self.frame_start = timestamp
+
+    def begin_poll(self, timestamp=None):
+        """
+        Call right before polling for a frame's input. Whatever is polled now came in since the last poll,
+        so the frame the events are placed in starts there, and delta covers the time between the two polls
+        """
+        if timestamp is None:
+            timestamp = time.perf_counter_ns()
+        # The first poll has nothing before it, so its frame is empty
+        self.frame_start = timestamp if self.last_poll is None else self.last_poll
+        self.last_poll = timestamp
+
+    def get_event_time(self, sdl_timestamp, poll_ticks):
+        """
+        Converts an SDL event timestamp (ms, the same clock as pygame.time.get_ticks()) to a perf_counter_ns() time
+        poll_ticks is pygame.time.get_ticks() read at the last poll. Without a timestamp all we know is that the event
+        came in since the last poll, so it's put at the start of the frame
+        pygame 2.6.1 doesn't pass the timestamp along, so there every event is placed at the start of its frame
+        and nothing is placed in between. Latency is then measured from the earliest the event could have come in,
+        which makes it an upper bound that can be up to a frame too long
+        """
+        if sdl_timestamp is None:
+            self.timestamps_missing = True
+            return self.frame_start
+        return self.last_poll - ((poll_ticks - sdl_timestamp) * 1000000)
+
+    def get_fraction(self, i, frame_ns):
+        """
+        Returns how far into a frame frame_ns long the event in slot i came in, from 0 to 1
+        """
+        if frame_ns <= 0:
+            return 0
+        fraction = (self.times[i] - self.frame_start) / frame_ns
+        return min(1, max(0, fraction))
+
+    def push(self, event_type, action, value, timestamp=None):
+        """
+        Adds an event to the back of the queue. If no timestamp is given the current time is used
+        """
+        if self.count == self.capacity:
+            self.dropped += 1
+            return
+        if timestamp is None:
+            timestamp = time.perf_counter_ns()
+        i = (self.head + self.count) % self.capacity
+        self.types[i] = event_type
+        self.actions[i] = action
+        self.values[i] = value
+        self.times[i] = timestamp
+        self.count += 1
+
+    def pop(self):
+        """
+        Removes the oldest event and returns its slot index
+        Read the event from types[i], actions[i], values[i] and times[i], the slot stays valid until the next push
+        """
+        i = self.head
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+        return i
+
+    def peek(self, n):
+        """
+        Returns the slot index of the nth oldest event without removing it
+        """
+        return (self.head + n) % self.capacity
+
+    def clear(self):
+        self.head = 0
+        self.count = 0
+
+
+def check_placement(frame_ns=1000000000 / 60):
+    """
+    Checks that a key pressed halfway between two polls is placed halfway through the frame
+    Returns True if it is
+    """
+    queue = InputQueue()
+    queue.begin_poll(0)
+    # SDL only gives timestamps to the millisecond, so the press lands up to a millisecond off halfway
+    poll_ticks = 1000 + int(frame_ns // 1000000)
+    queue.begin_poll(int(frame_ns))
+    queue.push(EVENT_BUTTON_DOWN, ACTION_FISH_DASH, 1, queue.get_event_time(1000 + int(frame_ns // 2000000), poll_ticks))
+    fraction = queue.get_fraction(queue.pop(), frame_ns)
+    print("Key pressed halfway between polls is placed at {0:.3f} of the frame".format(fraction))
+    return abs(fraction - 0.5) < 0.07
+
+
+if __name__ == "__main__":
+    if not check_placement():
+        print("Error! Input events aren't placed where they came in")
+        sys.exit(1)
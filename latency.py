@@ -0,0 +1,76 @@
+# Mariana
+# Code - Matt Madden
+# latency.py -- Measures how long it takes for an input to show up on screen
+
+import time
+
+
+class LatencyTracker():
+    """
+    Input events are tagged with the time they arrived (see InputQueue). When the simulation applies an
+    event that changes the player, it hands the tag to mark_effect(), and the next call to frame_presented()
+    (right after the display flip) stops the clock for every tag marked since the last flip
+    Samples are kept in a fixed size ring so the tracker never grows
+    """
+
+    def __init__(self, capacity=1024, pending_capacity=64):
+        self.samples = [0] * capacity
+        self.sample_count = 0
+        self.next_sample = 0
+        self.total_samples = 0
+
+        # Timestamps of inputs that have changed the player but haven't been shown yet
+        self.pending = [0] * pending_capacity
+        self.pending_count = 0
+
+    def mark_effect(self, timestamp):
+        """
+        Call when an input tagged with timestamp has changed the player state
+        """
+        if self.pending_count < len(self.pending):
+            self.pending[self.pending_count] = timestamp
+            self.pending_count += 1
+
+    def frame_presented(self, timestamp=None):
+        """
+        Call right after pygame.display.flip(), records the latency of every input shown by this frame
+        """
+        if self.pending_count == 0:
+            return
+        if timestamp is None:
+            timestamp = time.perf_counter_ns()
+        for i in range(0, self.pending_count):
+            self.samples[self.next_sample] = timestamp - self.pending[i]
+            self.next_sample = (self.next_sample + 1) % len(self.samples)
+            if self.sample_count < len(self.samples):
+                self.sample_count += 1
+            self.total_samples += 1
+        self.pending_count = 0
+
+    def percentiles(self, wanted=(50, 95, 99)):
+        """
+        Returns a list with the latency in milliseconds at each of the wanted percentiles of the recent samples
+        Returns None if there aren't any samples yet
+        """
+        if self.sample_count == 0:
+            return None
+        ordered = sorted(self.samples[:self.sample_count])
+        results = []
+        for percentile in wanted:
+            index = min(self.sample_count - 1, int(percentile / 100 * self.sample_count))
+            results.append(ordered[index] / 1000000)
+        return results
+
+    def report(self):
+        """
+        Returns a dict summarizing the recent samples, for session reports
+        """
+        results = {"samples": self.total_samples}
+        if self.sample_count != 0:
+            p50, p95, p99 = self.percentiles()
+            results["p50_ms"] = p50
+            results["p95_ms"] = p95
+            results["p99_ms"] = p99
+            results["max_ms"] = max(self.samples[:self.sample_count]) / 1000000
+            results["mean_ms"] = sum(self.samples[:self.sample_count]) / self.sample_count / 1000000
+        return results
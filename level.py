@@ -2,207 +2,82 @@
 # Code - Matt Madden
 # level.py -- Logic for actual gameplay goes here
 
-import entities
-import map
+import simulation
+import scheduler
 import pygame
-import math
 
 
-class Level():
-    def __init__(self):
+class Level(simulation.Simulation):
+    """
+    The gameplay simulation plus the pygame specific helpers the renderer needs
+    """
+
+    def __init__(self, mapfile="data/map/frens.map", game_map=None):
         """
-        Default constructor, should only be ran once as the level
-        will in the future be able to be given
+        Default constructor, loads the given map (frens.map if no map is given)
+        If game_map is given it's shared instead, for split screen players in the same level
         """
+        super().__init__(mapfile, game_map=game_map)
+
+        # Reused by the get_*_rect() functions so that we don't make a new rect every time we need one
+        self.entity_rect = pygame.Rect(0, 0, 0, 0)
+        self.tile_rect = pygame.Rect(0, 0, self.map.TILE_WIDTH, self.map.TILE_HEIGHT)
+        self.collider_rect = pygame.Rect(0, 0, 64, 64)
 
-        # Initialize the player
-        self.player = entities.Player()
+        # Every entity in the level other than the player, updated by how close they are to the camera
+        self.scheduler = scheduler.UpdateScheduler()
 
-        # Initialize the map
-        self.map = map.Map()
-        self.map.load_mapfile("data/map/frens.map")
+        # The level manager makes the minimap on its worker thread so the game doesn't stall building it when the
+        # level is switched to. Levels made anywhere else leave it None and the game makes it the first time it's drawn
+        self.minimap = None
 
-        # Initialize the camera
-        self.CAMERA_RIGHT = 1280 * 0.75
-        self.CAMERA_LEFT = 1280 * 0.25
-        self.CAMERA_TOP = 720 * 0.25
-        self.CAMERA_BOT = 720 * 0.75
-        self.camera_x = 0
-        self.camera_y = 0
+    def add_entity(self, entity):
+        self.scheduler.add(entity)
 
-        # Set camera position based on player spawn in map
-        self.spawn_player_at_tile(self.map.player_spawn)
+    def remove_entity(self, entity):
+        self.scheduler.remove(entity)
 
-    def spawn_player_at_tile(self, pos):
+    def get_view(self):
         """
-        This spawns the player in the center of the tile at the given tile coordinate
+        Returns the (x, y, width, height) region the camera is looking at
         """
+        return (self.camera_x, self.camera_y, self.VIEW_WIDTH, self.VIEW_HEIGHT)
 
-        # Get x and y variables from the pos
-        x = pos[0]
-        y = pos[1]
-
-        # Set the player in teh correct tile
-        self.player.x = x * self.map.TILE_WIDTH
-        self.player.y = y * self.map.TILE_HEIGHT
-
-        # Center the player position within that tile
-        x_diff = self.map.TILE_WIDTH - self.player.w
-        y_diff = self.map.TILE_HEIGHT - self.player.h
-        x_offset = int(x_diff / 2)
-        y_offset = int(y_diff / 2)
-        self.player.x += x_offset
-        self.player.y += y_offset
-
-        # Now set the camera according to player pos
-        # TODO test to make sure that the camera doesn't break at any point by us doing this
-        self.camera_x = self.player.x - (1280 / 2)
-        self.camera_y = self.player.y - (720 / 2)
+    def update_entities(self, delta, views=None):
+        """
+        Updates the level's entities, views is a list of regions from get_view() and defaults to just this level's camera
+        This is kept out of update() since the entities aren't part of the simulation that gets saved and rolled back
+        """
+        if views is None:
+            views = [self.get_view()]
+        self.scheduler.update(delta, views)
 
     def get_rect(self, entity):
         """
         Returns a pygame rect of the passed entity, where the x and y are adjusted to account
         for camera position
+        The same rect is returned every call, so copy it if you need to keep it around
         """
-        return pygame.Rect(entity.x - self.camera_x, entity.y - self.camera_y, entity.w, entity.h)
+        self.entity_rect.x = entity.x - self.camera_x
+        self.entity_rect.y = entity.y - self.camera_y
+        self.entity_rect.w = entity.w
+        self.entity_rect.h = entity.h
+        return self.entity_rect
 
     def get_tile_rect(self, x, y):
         """
         Returns a pygame rect of the tile at the passed coordinates, where the x and y are adjusted
         to account for camera position
+        The same rect is returned every call, so copy it if you need to keep it around
         """
-        return pygame.Rect(self.map.START_X + (x * self.map.TILE_WIDTH) - self.camera_x, self.map.START_Y + (y * self.map.TILE_HEIGHT) - self.camera_y, self.map.TILE_WIDTH, self.map.TILE_HEIGHT)
+        self.tile_rect.x = self.map.START_X + (x * self.map.TILE_WIDTH) - self.camera_x
+        self.tile_rect.y = self.map.START_Y + (y * self.map.TILE_HEIGHT) - self.camera_y
+        return self.tile_rect
 
     def get_collider_rect(self, collider):
-        x = (collider[0] * self.map.TILE_WIDTH) - self.camera_x
-        y = (collider[1] * self.map.TILE_HEIGHT) - self.camera_y
-        w = 64
-        h = 64
-        return pygame.Rect(x, y, w, h)
-
-    def update(self, delta, input_queue, input_states):
-        """
-        Updates the level logic
-        """
-
-        # First update the player
-        self.update_player(delta, input_queue, input_states)
-
-        # Check player collisions
-        self.check_collisions(delta)
-
-        # Now update the camera
-        player_rect = self.get_rect(self.player)
-        if player_rect.x > self.CAMERA_RIGHT:
-            self.camera_x += player_rect.x - self.CAMERA_RIGHT
-        elif player_rect.x < self.CAMERA_LEFT:
-            self.camera_x += player_rect.x - self.CAMERA_LEFT
-        if player_rect.y > self.CAMERA_BOT:
-            self.camera_y += player_rect.y - self.CAMERA_BOT
-        elif player_rect.y < self.CAMERA_TOP:
-            self.camera_y += player_rect.y - self.CAMERA_TOP
-
-        # Make sure the camera hasn't overstepped its bounds
-        if self.camera_x > self.map.MAX_CAMERA_X:
-            self.camera_x = self.map.MAX_CAMERA_X
-        elif self.camera_x < self.map.MIN_CAMERA_X:
-            self.camera_x = self.map.MIN_CAMERA_X
-        if self.camera_y > self.map.MAX_CAMERA_Y:
-            self.camera_y = self.map.MAX_CAMERA_Y
-        elif self.camera_y < self.map.MIN_CAMERA_Y:
-            self.camera_y = self.map.MIN_CAMERA_Y
-
-    def check_collisions(self, delta):
         """
-        Checks and handles game collisions
+        Same as get_tile_rect() but for a collider, the same rect is returned every call
         """
-        player_rect = self.get_rect(self.player)
-        wall_collision_occured = False
-        for collider in self.map.colliders:
-            if player_rect.colliderect(self.get_collider_rect(collider)):
-                # We have a collision, so let's first revert player to pre-collision coords
-                x_step = self.player.dx * delta
-                y_step = self.player.dy * delta
-                self.player.x -= x_step
-                self.player.y -= y_step
-
-                # Now check if collision is caused by x dir or y dir movement
-                self.player.x += x_step  # x dir move check
-                player_rect = self.get_rect(self.player)
-                x_causes_collision = player_rect.colliderect(self.get_collider_rect(collider))
-                self.player.x -= x_step
-
-                self.player.y += y_step  # y dir move check
-                player_rect = self.get_rect(self.player)
-                y_causes_collision = player_rect.colliderect(self.get_collider_rect(collider))
-                self.player.y -= y_step
-
-                # If x movement doesn't cause collision, go ahead and keep doing x movement
-                if not x_causes_collision:
-                    self.player.x += x_step
-                # else:
-                #    self.player.dx = 0
-
-                # Same with y dir movement
-                if not y_causes_collision:
-                    self.player.y += y_step
-                # else:
-                #    self.player.dy = 0
-
-                self.player.handle_collision()
-                wall_collision_occured = True
-                player_rect = self.get_rect(self.player)
-        if not wall_collision_occured:
-            self.player.on_wall = False
-
-    def update_player(self, delta, input_queue, input_states):
-        """
-        Handles just the player updating, used for code organization
-        """
-        used_player_move_axis = False
-        player_dash = False
-        player_reset_dash = False
-        player_sprint = self.player.is_sprinting
-
-        # Read the input queue
-        while len(input_queue) != 0:
-            event = input_queue.pop()
-            if event == "AxisMoved:Axis Player Horiz" or event == "AxisMoved:Axis Player Vert":
-                used_player_move_axis = True
-            elif event == "ButtonDown:Fish Dash":
-                player_dash = True
-            elif event == "ButtonUp:Fish Dash":
-                player_reset_dash = True
-            elif event == "ButtonDown:Fish Sprint":
-                player_sprint = True
-            elif event == "ButtonUp:Fish Sprint":
-                player_sprint = False
-
-        # Perform actions based on the input queue
-        #
-        # Update player acceleration
-        if used_player_move_axis:
-            axis_pos = [input_states["Axis Player Horiz"], input_states["Axis Player Vert"]]
-            if axis_pos[0] == 0 or axis_pos[1] == 0:
-                self.player.ax = self.player.MAX_ACC * axis_pos[0]
-                self.player.ay = self.player.MAX_ACC * axis_pos[1]
-            else:
-                hyp = math.sqrt(axis_pos[0] ** 2 + axis_pos[1] ** 2)
-                percentage = hyp / math.sqrt(2)
-                hyp2 = self.player.MAX_ACC * percentage
-                scale = hyp2 / hyp
-                self.player.ax = axis_pos[0] * scale
-                self.player.ay = axis_pos[1] * scale
-
-        # Call player fish dash
-        if player_dash:
-            self.player.dash()
-
-        # If the player released the dash button, enable the dash action
-        if player_reset_dash:
-            self.player.can_dash = True
-
-        # Update if the player is sprinting as necessary
-        self.player.is_sprinting = player_sprint
-
-        self.player.update(delta)
+        self.collider_rect.x = (collider[0] * self.map.TILE_WIDTH) - self.camera_x
+        self.collider_rect.y = (collider[1] * self.map.TILE_HEIGHT) - self.camera_y
+        return self.collider_rect
@@ -0,0 +1,153 @@
+# Mariana
+# Code - Matt Madden
+# levelmanager.py -- Loads levels on a worker thread so that moving between them doesn't stall the game
+
+import collections
+import queue
+import threading
+import time
+import pygame
+import level
+import minimap
+
+
+class PreparedLevel():
+    """
+    A level that's been loaded and is ready to be swapped in, along with its minimap pixels
+    tileset_image is the decoded tileset, it still has to be sliced and converted on the main thread
+    (see Game.load_tileset()), after that it's set back to None
+    """
+
+    def __init__(self, mapfile, loaded_level, tileset_image, load_time):
+        self.mapfile = mapfile
+        self.level = loaded_level
+        self.tileset_image = tileset_image
+        self.load_time = load_time
+
+
+class LevelManager():
+    """
+    Keeps levels ready to be switched to. prepare() queues a map to be loaded on the worker thread,
+    which parses the map, builds its colliders and minimap and decodes its tileset while the current level keeps running
+    At most max_prepared levels are held at once, when there are more the least recently used one is dropped
+    A level that's left can be handed back with give_back() so that going back to it is instant too
+    """
+
+    def __init__(self, max_prepared=3):
+        self.max_prepared = max_prepared
+
+        # mapfile -> PreparedLevel, the least recently used is first
+        self.prepared = collections.OrderedDict()
+
+        # Maps that are queued or being loaded, and maps that couldn't be loaded
+        self.loading = set()
+        self.failed = set()
+
+        # Maps the worker finished since the last poll()
+        self.newly_ready = []
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.requests = queue.Queue()
+        self.worker = None
+
+    def prepare(self, mapfile):
+        """
+        Starts loading mapfile in the background, does nothing if it's already loaded or loading
+        """
+        with self.lock:
+            if mapfile in self.prepared:
+                self.prepared.move_to_end(mapfile)
+                return
+            if mapfile in self.loading:
+                return
+            self.loading.add(mapfile)
+            self.failed.discard(mapfile)
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run_worker, daemon=True)
+            self.worker.start()
+        self.requests.put(mapfile)
+
+    def prepare_exits(self, current_level):
+        """
+        Starts loading every level that current_level has an exit to
+        """
+        for target in current_level.map.exits.values():
+            self.prepare(target[0])
+
+    def run_worker(self):
+        """
+        Loads the requested maps one at a time, forever. Runs on the worker thread
+        """
+        while True:
+            mapfile = self.requests.get()
+            start = time.perf_counter()
+            try:
+                loaded_level = level.Level(mapfile)
+                tileset_image = pygame.image.load(loaded_level.map.GFX_PATH + loaded_level.map.tileset + ".png")
+                loaded_level.minimap = minimap.Minimap(loaded_level.map, minimap.get_tile_colors(tileset_image))
+            except (Exception, SystemExit):
+                # The map loader prints what went wrong and exits, here that only means this map can't be used
+                with self.lock:
+                    self.loading.discard(mapfile)
+                    self.failed.add(mapfile)
+                    self.changed.notify_all()
+                continue
+            prepared = PreparedLevel(mapfile, loaded_level, tileset_image, time.perf_counter() - start)
+            with self.lock:
+                self.loading.discard(mapfile)
+                self.prepared[mapfile] = prepared
+                self.newly_ready.append(prepared)
+                self.trim()
+                self.changed.notify_all()
+
+    def trim(self):
+        """
+        Drops the least recently used levels until we're within max_prepared, call with the lock held
+        """
+        while len(self.prepared) > self.max_prepared:
+            self.prepared.popitem(last=False)
+
+    def poll(self):
+        """
+        Returns the levels that finished loading since the last call and are still held
+        """
+        with self.lock:
+            ready = [prepared for prepared in self.newly_ready if self.prepared.get(prepared.mapfile) is prepared]
+            self.newly_ready = []
+        return ready
+
+    def get(self, mapfile):
+        """
+        Returns the PreparedLevel for mapfile without taking it, or None if it isn't ready
+        """
+        with self.lock:
+            return self.prepared.get(mapfile)
+
+    def has_failed(self, mapfile):
+        with self.lock:
+            return mapfile in self.failed
+
+    def take(self, mapfile):
+        """
+        Removes the PreparedLevel for mapfile and returns it, or returns None if it isn't ready
+        """
+        with self.lock:
+            return self.prepared.pop(mapfile, None)
+
+    def give_back(self, old_level):
+        """
+        Holds on to a level that's no longer being played so it can be switched back to without loading it
+        """
+        with self.lock:
+            self.prepared[old_level.mapfile] = PreparedLevel(old_level.mapfile, old_level, None, 0)
+            self.trim()
+
+    def wait(self, mapfile, timeout=None):
+        """
+        Blocks until mapfile has finished loading or failed, returns true if it loaded
+        Only for tools and benchmarks, the game itself never waits on a level
+        """
+        with self.lock:
+            self.changed.wait_for(lambda: mapfile not in self.loading, timeout)
+            return mapfile in self.prepared
@@ -0,0 +1,182 @@
+# Mariana
+# Code - Matt Madden
+# lighting.py -- Darkness that gets deeper the further down you go, and the lights that cut through it
+
+import collections
+import pygame
+
+
+class Lighting():
+    """
+    Lighting is worked out in a light buffer SCALE times smaller than the screen, which is scaled up
+    and multiplied over the frame. White leaves the frame alone and black blacks it out
+    The ambient darkness and the map's static lights never change, so they're baked into a lightmap per chunk
+    the first time the chunk comes on screen, the same way MapRenderer bakes the tiles. A frame is then a blit per
+    visible chunk, one add per moving light, the scale up and the multiply, no matter how many static lights there are
+    """
+
+    SCALE = 4
+    CHUNK_TILES = 8
+
+    # Ambient light at the top and the bottom of the map, in between it's blended by depth
+    SURFACE_AMBIENT = (90, 110, 140)
+    DEEP_AMBIENT = (8, 10, 22)
+
+    # Light tiles from the map's special layer, radius is in tiles
+    STATIC_LIGHT_RADIUS = 4
+    STATIC_LIGHT_COLOR = (255, 170, 90)
+
+    # The fish's own light, radius is in world pixels
+    PLAYER_LIGHT_RADIUS = 320
+    PLAYER_LIGHT_COLOR = (200, 230, 255)
+
+    def __init__(self, game_map, max_chunks=24):
+        self.map = game_map
+        self.max_chunks = max_chunks
+
+        # Size of a chunk in light buffer pixels
+        self.chunk_size = (self.CHUNK_TILES * game_map.TILE_WIDTH) // self.SCALE
+        self.map_height = game_map.HEIGHT_IN_TILES * game_map.TILE_HEIGHT
+
+        # (view width, view height) -> (light buffer, scaled up buffer), one pair for each size of view we light
+        # Views of the same size take turns with the same pair, see begin()
+        self.view_buffers = {}
+        self.buffer = None
+        self.scaled = None
+        self.row_rect = pygame.Rect(0, 0, self.chunk_size, 1)
+
+        # (radius, color) -> glow surface
+        self.glows = {}
+
+        # (chunk x, chunk y) -> lightmap surface, the least recently drawn is first
+        self.chunks = collections.OrderedDict()
+        self.index_lights()
+
+        # Where the buffer is in light buffer pixels, set by begin()
+        self.origin_x = 0
+        self.origin_y = 0
+
+    def index_lights(self):
+        """
+        Works out which chunks each static light reaches, call again if the map's lights change
+        Lightmaps already baked are thrown away
+        """
+        self.chunks.clear()
+
+        # (chunk x, chunk y) -> list of (x, y) of the lights that reach into it
+        self.chunk_lights = {}
+        reach = self.STATIC_LIGHT_RADIUS * self.map.TILE_WIDTH
+        chunk_width = self.CHUNK_TILES * self.map.TILE_WIDTH
+        chunk_height = self.CHUNK_TILES * self.map.TILE_HEIGHT
+        for x, y in self.map.lights:
+            center_x = (x + 0.5) * self.map.TILE_WIDTH
+            center_y = (y + 0.5) * self.map.TILE_HEIGHT
+            for chunk_x in range(int((center_x - reach) // chunk_width), int((center_x + reach) // chunk_width) + 1):
+                for chunk_y in range(int((center_y - reach) // chunk_height), int((center_y + reach) // chunk_height) + 1):
+                    self.chunk_lights.setdefault((chunk_x, chunk_y), []).append((x, y))
+
+    def get_glow(self, radius, color):
+        """
+        Returns a circle of light radius world pixels across, bright in the middle and fading to nothing
+        at the edge, at light buffer size. These are made once and kept
+        """
+        key = (radius, color)
+        glow = self.glows.get(key)
+        if glow is None:
+            size = max(1, radius // self.SCALE)
+            glow = pygame.Surface((size * 2, size * 2)).convert()
+            glow.fill((0, 0, 0))
+            # Drawn from the outside in, each ring a bit brighter than the last
+            for ring in range(size, 0, -1):
+                brightness = (1 - (ring / size)) ** 2
+                ring_color = (int(color[0] * brightness), int(color[1] * brightness), int(color[2] * brightness))
+                pygame.draw.circle(glow, ring_color, (size, size), ring)
+            self.glows[key] = glow
+        return glow
+
+    def get_ambient(self, world_y):
+        """
+        Returns the ambient light at world_y pixels down the map
+        """
+        depth = min(1, max(0, world_y / self.map_height)) if self.map_height != 0 else 0
+        return (int(self.SURFACE_AMBIENT[0] + ((self.DEEP_AMBIENT[0] - self.SURFACE_AMBIENT[0]) * depth)),
+                int(self.SURFACE_AMBIENT[1] + ((self.DEEP_AMBIENT[1] - self.SURFACE_AMBIENT[1]) * depth)),
+                int(self.SURFACE_AMBIENT[2] + ((self.DEEP_AMBIENT[2] - self.SURFACE_AMBIENT[2]) * depth)))
+
+    def bake_chunk(self, chunk_x, chunk_y):
+        """
+        Draws the ambient light and every static light that reaches a chunk into a new lightmap
+        """
+        surface = pygame.Surface((self.chunk_size, self.chunk_size)).convert()
+        top = chunk_y * self.chunk_size * self.SCALE
+        for row in range(0, self.chunk_size):
+            self.row_rect.y = row
+            surface.fill(self.get_ambient(top + (row * self.SCALE)), self.row_rect)
+
+        glow = self.get_glow(self.STATIC_LIGHT_RADIUS * self.map.TILE_WIDTH, self.STATIC_LIGHT_COLOR)
+        half_size = glow.get_width() // 2
+        for x, y in self.chunk_lights.get((chunk_x, chunk_y), []):
+            light_x = int(((x + 0.5) * self.map.TILE_WIDTH) // self.SCALE) - (chunk_x * self.chunk_size)
+            light_y = int(((y + 0.5) * self.map.TILE_HEIGHT) // self.SCALE) - (chunk_y * self.chunk_size)
+            surface.blit(glow, (light_x - half_size, light_y - half_size), special_flags=pygame.BLEND_ADD)
+        return surface
+
+    def begin(self, screen, camera_x, camera_y):
+        """
+        Starts lighting screen by copying the baked lightmaps of every chunk on it into the light buffer
+        screen can be the whole screen or one player's view of it
+        """
+        view_size = screen.get_size()
+        buffers = self.view_buffers.get(view_size)
+        if buffers is None:
+            # The buffer is a pixel bigger each way so it can be lined up with the camera to the exact screen pixel
+            buffer = pygame.Surface(((view_size[0] // self.SCALE) + 2, (view_size[1] // self.SCALE) + 2)).convert()
+            scaled = pygame.Surface((buffer.get_width() * self.SCALE, buffer.get_height() * self.SCALE)).convert()
+            buffers = (buffer, scaled)
+            self.view_buffers[view_size] = buffers
+        self.buffer, self.scaled = buffers
+
+        view_x = camera_x - self.map.START_X
+        view_y = camera_y - self.map.START_Y
+        self.origin_x = int(view_x // self.SCALE)
+        self.origin_y = int(view_y // self.SCALE)
+
+        # Anything past the edge of the map is as dark as it gets
+        self.buffer.fill(self.DEEP_AMBIENT)
+        first_x = max(0, self.origin_x // self.chunk_size)
+        last_x = min((self.map.WIDTH_IN_TILES - 1) // self.CHUNK_TILES, (self.origin_x + self.buffer.get_width()) // self.chunk_size)
+        first_y = max(0, self.origin_y // self.chunk_size)
+        last_y = min((self.map.HEIGHT_IN_TILES - 1) // self.CHUNK_TILES, (self.origin_y + self.buffer.get_height()) // self.chunk_size)
+        for chunk_x in range(first_x, last_x + 1):
+            for chunk_y in range(first_y, last_y + 1):
+                chunk = (chunk_x, chunk_y)
+                surface = self.chunks.get(chunk)
+                if surface is None:
+                    surface = self.bake_chunk(chunk_x, chunk_y)
+                    self.chunks[chunk] = surface
+                    if len(self.chunks) > self.max_chunks:
+                        self.chunks.popitem(last=False)
+                else:
+                    self.chunks.move_to_end(chunk)
+                self.buffer.blit(surface, ((chunk_x * self.chunk_size) - self.origin_x, (chunk_y * self.chunk_size) - self.origin_y))
+
+    def add_light(self, world_x, world_y, radius, color):
+        """
+        Adds a moving light centered on (world_x, world_y) to this frame, radius is in world pixels
+        Call between begin() and apply()
+        """
+        glow = self.get_glow(radius, color)
+        half_size = glow.get_width() // 2
+        light_x = int((world_x - self.map.START_X) // self.SCALE) - self.origin_x
+        light_y = int((world_y - self.map.START_Y) // self.SCALE) - self.origin_y
+        self.buffer.blit(glow, (light_x - half_size, light_y - half_size), special_flags=pygame.BLEND_ADD)
+
+    def apply(self, screen, camera_x, camera_y):
+        """
+        Scales the light buffer up and multiplies it over everything drawn so far
+        """
+        # smoothscale looks a touch softer but costs more than twice as much, and the light is soft already
+        pygame.transform.scale(self.buffer, self.scaled.get_size(), self.scaled)
+        offset_x = int((self.origin_x * self.SCALE) - (camera_x - self.map.START_X))
+        offset_y = int((self.origin_y * self.SCALE) - (camera_y - self.map.START_Y))
+        screen.blit(self.scaled, (offset_x, offset_y), special_flags=pygame.BLEND_MULT)
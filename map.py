@@ -4,6 +4,8 @@
 
 import os
 import sys
+import math
+import collision
 
 
 class Map():
@@ -15,10 +17,21 @@ class Map():
         """
         self._tiles = []
         self._walls = []
+        self._specials = []
         self.colliders = []
 
+        # (x, y) of every tile that gives off light, see lighting.py
+        self.lights = []
+
+        # One byte per tile, 1 if the tile is a collider. Indexed by x * HEIGHT_IN_TILES + y
+        self.collider_grid = bytearray()
+
         self.player_spawn = [1280 / 2, 720 / 2]
 
+        # Maps (x, y) of an exit tile -> (mapfile, spawn), where spawn is the tile to put the player on
+        # in the other map or None to use that map's player spawn
+        self.exits = {}
+
         self.WIDTH_IN_TILES = 0
         self.HEIGHT_IN_TILES = 0
         self.START_X = 0
@@ -39,110 +52,341 @@ class Map():
 
         self.tileset = ""
         self.alphas = []
+        self.player_index = -2
+        self.collider_indeces = []
+        self.light_indeces = []
+
+        # Animated tiles from the tileset metadata, maps tile index -> (frames, durations)
+        # frames is the list of tile indeces shown in turn, and durations is how many frames each one is shown for
+        self.animations = {}
+
+        # Every cell with an animated floor or wall, grouped by timing. Maps durations -> list of (x, y)
+        # Animations with the same durations change frame at the same time, so they're redrawn together
+        self.animated_cells = {}
+
+        # Unit vectors for raycast_fan(), keyed by (count, start angle, arc) so a sonar ping doesn't redo the trig each time
+        self.fan_directions = {}
+
+        # Where tilesets and their metadata files are looked for
+        self.GFX_PATH = "res/gfx/"
 
     def load_mapfile(self, filename):
         """
         Takes a tet file and reads the map in from in
         """
+        try:
+            self.replace_map(*self.read_mapfile(filename))
+        except ValueError as error:
+            print("Error! " + str(error))
+            sys.exit(0)
+
+    def replace_map(self, settings, layers):
+        """
+        Replaces the whole map with one read by read_mapfile()
+        Every tile is parsed before the map is touched, so if this raises ValueError the map is left as it was
+        """
+        width = settings["width"]
+        height = settings["height"]
+        metadata = self.parse_metadata(settings["tileset"])
+        tiles = []
+        walls = []
+        specials = []
+        for x in range(0, width):
+            tiles.append([0] * height)
+            walls.append([0] * height)
+            specials.append([-1] * height)
+        for y in range(0, height):
+            floor_row = layers["floor"][y].split(",")
+            wall_row = layers["wall"][y].split(",")
+            special_row = layers["special"][y].split(",")
+            for x in range(0, width):
+                tiles[x][y] = int(floor_row[x]) - 1
+                walls[x][y] = int(wall_row[x]) - 1
+                specials[x][y] = int(special_row[x])
+
+        self.tileset = settings["tileset"]
+        self.WIDTH_IN_TILES = width
+        self.HEIGHT_IN_TILES = height
+        self.exits = settings["exits"]
+        self.read_metadata(metadata)
+        self._tiles = tiles
+        self._walls = walls
+        self._specials = specials
+
+        # The raw rows are kept so that reload_mapfile() can tell which rows changed without parsing them
+        self.layer_rows = layers
+        self.update_specials()
+        self.update_animated_cells()
+
+        self.MAX_CAMERA_X = self.get_width() - 1280
+        self.MIN_CAMERA_X = 0
+        self.MAX_CAMERA_Y = self.get_height() - 720
+        self.MIN_CAMERA_Y = 0
+
+        self.MAX_ENTITY_X = self.get_width()
+        self.MIN_ENTITY_X = 0
+        self.MAX_ENTITY_Y = self.get_height()
+        self.MIN_ENTITY_Y = 0
+
+    def read_mapfile(self, filename):
+        """
+        Reads a map file without changing the map
+        Returns (settings, layers) where settings has the tileset, width, height and exits, and layers maps
+        each layer name to a list of its rows as unparsed strings
+        Exits are written as exit=x,y,mapfile or exit=x,y,mapfile,spawn_x,spawn_y
+        Don't put the spawn on an exit tile in the other map, or the player will go straight back
+        Raises ValueError if the file is missing or incomplete. Editors often empty a file before writing it back out,
+        so a hot reload can catch a map halfway through being saved
+        """
 
         # First check if file exists
         if not os.path.isfile(filename):
-            print("Error! Could not find " + filename)
-            sys.exit(0)
+            raise ValueError("Could not find " + filename)
 
         # Now read the file
         map_file = open(filename, "r")
 
         mode = ""
-        floor_data = []
-        wall_data = []
-        special_data = []
-        special_entries = []
-        player_index = -2
-        collider_indeces = []
-
-        # flags for specific error messaging
-        found_tileset = False
+        settings = {"tileset": "", "width": 0, "height": 0, "exits": {}}
+        layers = {"floor": [], "wall": [], "special": []}
 
         for line in map_file.read().splitlines():
-            if line.startswith("tileset="):
-                found_tileset = True
-                self.tileset = line[(line.index("=") + 1):]
-            elif line.startswith("alpha-tileset="):
-                self.alpha_tileset = line[(line.index("=") + 1):]
-            elif line.startswith("width="):
-                self.WIDTH_IN_TILES = int(line[(line.index("=") + 1):])
-            elif line.startswith("height="):
-                self.HEIGHT_IN_TILES = int(line[(line.index("=") + 1):])
-            elif line.startswith("layer="):
-                mode = line[(line.index("=") + 1):]
-            else:
-                if mode == "floor":
-                    floor_data.append(line.split(","))
-                elif mode == "wall":
-                    wall_data.append(line.split(","))
-                elif mode == "special":
-                    special_data.append(line.split(","))
+            try:
+                if line.startswith("tileset="):
+                    settings["tileset"] = line[(line.index("=") + 1):]
+                elif line.startswith("alpha-tileset="):
+                    self.alpha_tileset = line[(line.index("=") + 1):]
+                elif line.startswith("width="):
+                    settings["width"] = int(line[(line.index("=") + 1):])
+                elif line.startswith("height="):
+                    settings["height"] = int(line[(line.index("=") + 1):])
+                elif line.startswith("exit="):
+                    values = line[(line.index("=") + 1):].split(",")
+                    spawn = None
+                    if len(values) == 5:
+                        spawn = [int(values[3]), int(values[4])]
+                    settings["exits"][(int(values[0]), int(values[1]))] = (values[2], spawn)
+                elif line.startswith("layer="):
+                    mode = line[(line.index("=") + 1):]
+                elif mode in layers:
+                    layers[mode].append(line)
+            except (ValueError, IndexError):
+                map_file.close()
+                raise ValueError("Couldn't read the line " + line + " in " + filename)
         map_file.close()
 
-        # Since we have the tilset now is a good time to load in the tileset metadata and to verify that the tileset exists
-        if not os.path.isfile("res/gfx/" + self.tileset + ".png"):
-            print("Error! Tileset res/gfx/" + self.tileset + ".png not found!")
-            if not found_tileset:
-                print("The map file " + filename + " did not specify any tileset to use!")
-            sys.exit(0)
-        if not os.path.isfile("res/gfx/" + self.tileset + ".txt"):
-            print("Error! Tileset metadata file res/gfx/" + self.tileset + ".txt not found!")
-            sys.exit(0)
+        # Since we have the tilset now is a good time to verify that the tileset and its metadata exist
+        if settings["tileset"] == "":
+            raise ValueError("The map file " + filename + " did not specify any tileset to use!")
+        if not os.path.isfile(self.GFX_PATH + settings["tileset"] + ".png"):
+            raise ValueError("Tileset " + self.GFX_PATH + settings["tileset"] + ".png not found!")
+        if not os.path.isfile(self.GFX_PATH + settings["tileset"] + ".txt"):
+            raise ValueError("Tileset metadata file " + self.GFX_PATH + settings["tileset"] + ".txt not found!")
 
-        meta_file = open("res/gfx/" + self.tileset + ".txt")
-        for line in meta_file.read().splitlines():
-            if line.startswith("alphas="):
-                alphas_as_string = line[(line.index("=") + 1):]
-                self.alphas = list(map(int, alphas_as_string.split(",")))
-                for i in range(0, len(self.alphas)):
-                    self.alphas[i] -= 1
-            elif line.startswith("player="):
-                player_index = int(line[(line.index("=") + 1):])
-            elif line.startswith("colliders="):
-                colliders_as_string = line[(line.index("=") + 1):]
-                collider_indeces = list(map(int, colliders_as_string.split(",")))
-        meta_file.close()
-
-        # Now setup the tiles with the appropriate dimensions
-        self._tiles = []
-        self._walls = []
+        # Every layer needs a full grid of tiles. Counting commas is enough here, the tiles themselves are parsed later
+        for layer in layers:
+            rows = layers[layer]
+            if len(rows) != settings["height"]:
+                raise ValueError("The " + layer + " layer of " + filename + " has " + str(len(rows)) + " rows but the map is " + str(settings["height"]) + " tall")
+            for y in range(0, len(rows)):
+                if rows[y].count(",") + 1 != settings["width"]:
+                    raise ValueError("Row " + str(y) + " of the " + layer + " layer of " + filename + " isn't " + str(settings["width"]) + " tiles wide")
+
+        return (settings, layers)
+
+    def parse_metadata(self, tileset):
+        """
+        Reads a tileset's metadata file without changing the map
+        Returns a dict with the alphas, player index, collider indeces, light indeces and animations
+        Animations are written as anim=tile:frame,frame,...:duration or with one duration per frame,
+        for example anim=5:5,6,7,8:10 shows tiles 5 to 8 for 10 frames each wherever tile 5 is placed
+        Raises ValueError with the file and line if a line can't be read. Like the map, the metadata is hot reloaded,
+        so this can catch a file halfway through being saved. A bad animation is only reported and skipped
+        """
+        filename = self.GFX_PATH + tileset + ".txt"
+        metadata = {"alphas": [], "player": -2, "colliders": [], "lights": [], "animations": {}}
+
+        try:
+            meta_file = open(filename)
+            lines = meta_file.read().splitlines()
+            meta_file.close()
+        except OSError:
+            raise ValueError("Couldn't open " + filename)
+        for line_number in range(0, len(lines)):
+            line = lines[line_number]
+            try:
+                if line.startswith("alphas="):
+                    alphas_as_string = line[(line.index("=") + 1):]
+                    metadata["alphas"] = [int(alpha) - 1 for alpha in alphas_as_string.split(",")]
+                elif line.startswith("player="):
+                    metadata["player"] = int(line[(line.index("=") + 1):])
+                elif line.startswith("colliders="):
+                    colliders_as_string = line[(line.index("=") + 1):]
+                    metadata["colliders"] = list(map(int, colliders_as_string.split(",")))
+                elif line.startswith("lights="):
+                    lights_as_string = line[(line.index("=") + 1):]
+                    metadata["lights"] = list(map(int, lights_as_string.split(",")))
+            except ValueError:
+                raise ValueError("Couldn't read line " + str(line_number + 1) + " of " + filename + ": " + line)
+            if line.startswith("anim="):
+                try:
+                    tile, frames_as_string, durations_as_string = line[(line.index("=") + 1):].split(":")
+                    tile = int(tile)
+                    frames = [int(frame) - 1 for frame in frames_as_string.split(",")]
+                    durations = [float(duration) for duration in durations_as_string.split(",")]
+                except ValueError:
+                    print("Error! Couldn't read animation " + line + " in " + filename)
+                    continue
+                if len(durations) == 1:
+                    durations = durations * len(frames)
+                if len(durations) != len(frames):
+                    print("Error! Animation for tile " + str(tile) + " in " + filename + " needs one duration or one per frame")
+                    continue
+                # A frame that lasts no time would never let the animation clock catch up
+                if not all(duration > 0 for duration in durations):
+                    print("Error! Animation for tile " + str(tile) + " in " + filename + " has a duration that isn't above 0")
+                    continue
+                metadata["animations"][tile - 1] = (frames, tuple(durations))
+        return metadata
+
+    def read_metadata(self, metadata=None):
+        """
+        Loads the tileset metadata file, or uses metadata from parse_metadata() if it's given
+        Returns true if anything that affects how the tileset is drawn changed
+        Raises ValueError if the file can't be read, in which case the map is left as it was
+        """
+        if metadata is None:
+            metadata = self.parse_metadata(self.tileset)
+        drawing_changed = self.alphas != metadata["alphas"] or self.animations != metadata["animations"]
+        self.alphas = metadata["alphas"]
+        self.player_index = metadata["player"]
+        self.collider_indeces = metadata["colliders"]
+        self.light_indeces = metadata["lights"]
+        self.animations = metadata["animations"]
+        return drawing_changed
+
+    def update_specials(self):
+        """
+        Goes through the special layer and sets up the player spawn, colliders and lights from it
+        """
+        self.colliders = []
+        self.lights = []
+        self.collider_grid = bytearray(self.WIDTH_IN_TILES * self.HEIGHT_IN_TILES)
         for x in range(0, self.WIDTH_IN_TILES):
-            self._tiles.append([])
-            self._walls.append([])
             for y in range(0, self.HEIGHT_IN_TILES):
-                self._tiles[x].append(0)
-                self._walls[x].append(0)
+                special = self._specials[x][y]
+                if special == -1:
+                    continue
+                if special == self.player_index:
+                    self.player_spawn = [x, y]
+                if special in self.collider_indeces:
+                    self.colliders.append((x, y))
+                    self.collider_grid[(x * self.HEIGHT_IN_TILES) + y] = 1
+                if special in self.light_indeces:
+                    self.lights.append((x, y))
 
-        # And copy the map data to the tiles values
+    def update_animated_cells(self):
+        """
+        Finds every cell with an animated floor or wall and groups them by the timing of their animation
+        """
+        self.animated_cells = {}
+        if len(self.animations) == 0:
+            return
         for x in range(0, self.WIDTH_IN_TILES):
             for y in range(0, self.HEIGHT_IN_TILES):
-                self._tiles[x][y] = int(floor_data[y][x]) - 1
-                self._walls[x][y] = int(wall_data[y][x]) - 1
-                if int(special_data[y][x]) != -1:
-                    special_entries.append((x, y, int(special_data[y][x])))
-
-        # Now loop through all the special entries and do any action needed
-        for entry in special_entries:
-            if entry[2] == player_index:
-                self.player_spawn = [entry[0], entry[1]]
-            if entry[2] in collider_indeces:
-                self.colliders.append((entry[0], entry[1]))
+                # A cell with both layers animated with different timings goes in both groups
+                for tile in (self._tiles[x][y], self._walls[x][y]):
+                    if tile in self.animations:
+                        cells = self.animated_cells.setdefault(self.animations[tile][1], [])
+                        if len(cells) == 0 or cells[-1] != (x, y):
+                            cells.append((x, y))
 
-        self.MAX_CAMERA_X = self.get_width() - 1280
-        self.MIN_CAMERA_X = 0
-        self.MAX_CAMERA_Y = self.get_height() - 720
-        self.MIN_CAMERA_Y = 0
+    def set_special(self, x, y, special):
+        """
+        Changes a single tile of the special layer, keeping the colliders and lights up to date
+        """
+        was_light = self._specials[x][y] in self.light_indeces
+        is_light = special in self.light_indeces
+        was_collider = self.collider_grid[(x * self.HEIGHT_IN_TILES) + y] == 1
+        is_collider = special in self.collider_indeces
+        self._specials[x][y] = special
+        if special == self.player_index:
+            self.player_spawn = [x, y]
+        if was_collider and not is_collider:
+            self.colliders.remove((x, y))
+            self.collider_grid[(x * self.HEIGHT_IN_TILES) + y] = 0
+        elif is_collider and not was_collider:
+            self.colliders.append((x, y))
+            self.collider_grid[(x * self.HEIGHT_IN_TILES) + y] = 1
+        if was_light and not is_light:
+            self.lights.remove((x, y))
+        elif is_light and not was_light:
+            self.lights.append((x, y))
 
-        self.MAX_ENTITY_X = self.get_width()
-        self.MIN_ENTITY_X = 0
-        self.MAX_ENTITY_Y = self.get_height()
-        self.MIN_ENTITY_Y = 0
+    def reload_mapfile(self, filename):
+        """
+        Reloads a map that has changed on disk, only touching the tiles that are different
+        Returns a list of the (x, y) coords of every changed tile, or None if the size or tileset of the
+        map changed and the whole map had to be loaded again
+        Raises ValueError if the file can't be read, in which case the map is left as it was
+        """
+        settings, layers = self.read_mapfile(filename)
+        if settings["width"] != self.WIDTH_IN_TILES or settings["height"] != self.HEIGHT_IN_TILES or settings["tileset"] != self.tileset:
+            self.replace_map(settings, layers)
+            return None
+
+        # Every changed tile is parsed before any are set, so a bad tile can't leave the map half updated
+        updates = []
+        for layer in ["floor", "wall", "special"]:
+            old_rows = self.layer_rows[layer]
+            new_rows = layers[layer]
+            for y in range(0, self.HEIGHT_IN_TILES):
+                # Rows that are exactly the same as before don't even need to be split
+                if old_rows[y] == new_rows[y]:
+                    continue
+                row = new_rows[y].split(",")
+                for x in range(0, self.WIDTH_IN_TILES):
+                    if layer == "special":
+                        updates.append((layer, x, y, int(row[x])))
+                    else:
+                        updates.append((layer, x, y, int(row[x]) - 1))
+
+        self.exits = settings["exits"]
+        changed = set()
+        for layer, x, y, value in updates:
+            if layer == "floor":
+                if self._tiles[x][y] != value:
+                    self._tiles[x][y] = value
+                    changed.add((x, y))
+            elif layer == "wall":
+                if self._walls[x][y] != value:
+                    self._walls[x][y] = value
+                    changed.add((x, y))
+            else:
+                if self._specials[x][y] != value:
+                    self.set_special(x, y, value)
+                    changed.add((x, y))
+        self.layer_rows = layers
+        if len(changed) != 0:
+            self.update_animated_cells()
+        return list(changed)
+
+    def reload_metadata(self):
+        """
+        Reloads the tileset metadata after it changed on disk
+        Returns true if anything that affects how the tileset is drawn changed
+        Raises ValueError if the file can't be read, in which case the map is left as it was
+        """
+        old_player_index = self.player_index
+        old_collider_indeces = self.collider_indeces
+        old_light_indeces = self.light_indeces
+        old_animations = self.animations
+        drawing_changed = self.read_metadata()
+        if self.player_index != old_player_index or self.collider_indeces != old_collider_indeces or self.light_indeces != old_light_indeces:
+            self.update_specials()
+        if self.animations != old_animations:
+            self.update_animated_cells()
+        return drawing_changed
 
     def get_tile(self, x, y):
         """
@@ -151,6 +395,13 @@ class Map():
 
         return self._tiles[x][y]
 
+    def get_layers(self):
+        """
+        Returns the floor and wall layers as lists of columns, so layer[x][y] is the tile at x, y
+        This is for things that need the whole map at once, don't change them
+        """
+        return self._tiles, self._walls
+
     def get_wall(self, x, y):
         """
         Return the image id of the tile at the x and y coords on the wall layer
@@ -171,3 +422,165 @@ class Map():
         Returns the height in pixels of the map
         """
         return self.HEIGHT_IN_TILES * self.TILE_HEIGHT
+
+    def is_collider(self, x, y):
+        """
+        Returns true if the tile at the x and y coords is a collider
+        Anything outside the map isn't a collider
+        """
+        if x < 0 or y < 0 or x >= self.WIDTH_IN_TILES or y >= self.HEIGHT_IN_TILES:
+            return False
+        return self.collider_grid[(x * self.HEIGHT_IN_TILES) + y] == 1
+
+    def sweep_box(self, x, y, w, h, step_x, step_y):
+        """
+        Moves a box in map coordinates along (step_x, step_y) and finds the first collider tile it hits
+        Returns (time, normal_x, normal_y, tile_x, tile_y) where time is the fraction of the step
+        at which the box touches the tile, or None if the box can make the whole step
+        """
+
+        # Only the tiles covered by the box over the whole step can be hit
+        first_x = math.floor(min(x, x + step_x) / self.TILE_WIDTH)
+        last_x = math.floor(max(x + w, x + w + step_x) / self.TILE_WIDTH)
+        first_y = math.floor(min(y, y + step_y) / self.TILE_HEIGHT)
+        last_y = math.floor(max(y + h, y + h + step_y) / self.TILE_HEIGHT)
+
+        closest = None
+        for tile_x in range(max(first_x, 0), min(last_x, self.WIDTH_IN_TILES - 1) + 1):
+            for tile_y in range(max(first_y, 0), min(last_y, self.HEIGHT_IN_TILES - 1) + 1):
+                if self.collider_grid[(tile_x * self.HEIGHT_IN_TILES) + tile_y] == 0:
+                    continue
+                hit = collision.sweep_aabb(x, y, w, h, step_x, step_y, tile_x * self.TILE_WIDTH, tile_y * self.TILE_HEIGHT, self.TILE_WIDTH, self.TILE_HEIGHT)
+                if hit is not None and (closest is None or hit[0] < closest[0]):
+                    closest = (hit[0], hit[1], hit[2], tile_x, tile_y)
+        return closest
+
+    def raycast(self, x, y, dir_x, dir_y, max_distance=None):
+        """
+        Casts a ray from (x, y) in map coordinates along (dir_x, dir_y) and finds the first collider tile it enters
+        The ray walks the grid a tile at a time (a DDA walk), so the cost is the number of tiles crossed
+        Returns (distance, tile_x, tile_y, normal_x, normal_y) where distance is in pixels and the normal is the side
+        of the tile that was hit, or None if the ray leaves the map or goes max_distance without hitting anything
+        A ray that starts inside a collider hits it at distance 0 with a normal of (0, 0)
+        """
+        length = math.sqrt((dir_x * dir_x) + (dir_y * dir_y))
+        if length == 0:
+            return None
+        dir_x /= length
+        dir_y /= length
+        if max_distance is None:
+            max_distance = float("inf")
+        width = self.WIDTH_IN_TILES * self.TILE_WIDTH
+        height = self.HEIGHT_IN_TILES * self.TILE_HEIGHT
+
+        # Clip the ray to the map so a ray from outside starts walking where it comes in
+        start = 0
+        end = max_distance
+        normal_x = 0
+        normal_y = 0
+        if dir_x != 0:
+            near_x = (0 if dir_x > 0 else width) - x
+            far_x = (width if dir_x > 0 else 0) - x
+            if near_x / dir_x > start:
+                start = near_x / dir_x
+                normal_x = -1 if dir_x > 0 else 1
+            end = min(end, far_x / dir_x)
+        elif x < 0 or x >= width:
+            return None
+        if dir_y != 0:
+            near_y = (0 if dir_y > 0 else height) - y
+            far_y = (height if dir_y > 0 else 0) - y
+            if near_y / dir_y > start:
+                start = near_y / dir_y
+                normal_x = 0
+                normal_y = -1 if dir_y > 0 else 1
+            end = min(end, far_y / dir_y)
+        elif y < 0 or y >= height:
+            return None
+        if start > end:
+            return None
+
+        tile_x = min(max(int((x + (dir_x * start)) // self.TILE_WIDTH), 0), self.WIDTH_IN_TILES - 1)
+        tile_y = min(max(int((y + (dir_y * start)) // self.TILE_HEIGHT), 0), self.HEIGHT_IN_TILES - 1)
+
+        # Distance along the ray to the next vertical and horizontal grid line, and between grid lines
+        if dir_x > 0:
+            step_x = 1
+            next_x = (((tile_x + 1) * self.TILE_WIDTH) - x) / dir_x
+            delta_x = self.TILE_WIDTH / dir_x
+        elif dir_x < 0:
+            step_x = -1
+            next_x = ((tile_x * self.TILE_WIDTH) - x) / dir_x
+            delta_x = -self.TILE_WIDTH / dir_x
+        else:
+            step_x = 0
+            next_x = float("inf")
+            delta_x = 0
+        if dir_y > 0:
+            step_y = 1
+            next_y = (((tile_y + 1) * self.TILE_HEIGHT) - y) / dir_y
+            delta_y = self.TILE_HEIGHT / dir_y
+        elif dir_y < 0:
+            step_y = -1
+            next_y = ((tile_y * self.TILE_HEIGHT) - y) / dir_y
+            delta_y = -self.TILE_HEIGHT / dir_y
+        else:
+            step_y = 0
+            next_y = float("inf")
+            delta_y = 0
+
+        # Walk the grid using a flat index so each step is an add, see collider_grid
+        grid = self.collider_grid
+        index = (tile_x * self.HEIGHT_IN_TILES) + tile_y
+        index_step_x = step_x * self.HEIGHT_IN_TILES
+        distance = start
+        while True:
+            if grid[index] == 1:
+                return (distance, tile_x, tile_y, normal_x, normal_y)
+            if next_x < next_y:
+                distance = next_x
+                tile_x += step_x
+                if distance > end or tile_x < 0 or tile_x >= self.WIDTH_IN_TILES:
+                    return None
+                index += index_step_x
+                next_x += delta_x
+                normal_x = -step_x
+                normal_y = 0
+            else:
+                distance = next_y
+                tile_y += step_y
+                if distance > end or tile_y < 0 or tile_y >= self.HEIGHT_IN_TILES:
+                    return None
+                index += step_y
+                next_y += delta_y
+                normal_x = 0
+                normal_y = -step_y
+
+    def raycast_fan(self, x, y, count, start_angle=0, arc=360, max_distance=None):
+        """
+        Casts count rays from (x, y) spread evenly over arc degrees starting at start_angle, like a sonar ping
+        Angles are in degrees, 0 is right and 90 is down. Returns a list with a raycast() result for each ray
+        """
+        key = (count, start_angle, arc)
+        directions = self.fan_directions.get(key)
+        if directions is None:
+            # A full circle would put the last ray on top of the first one, anything less includes both ends
+            spacing = arc / count if arc >= 360 or count == 1 else arc / (count - 1)
+            directions = []
+            for i in range(0, count):
+                angle = math.radians(start_angle + (i * spacing))
+                directions.append((math.cos(angle), math.sin(angle)))
+            self.fan_directions[key] = directions
+        raycast = self.raycast
+        return [raycast(x, y, dir_x, dir_y, max_distance) for dir_x, dir_y in directions]
+
+    def has_line_of_sight(self, from_x, from_y, to_x, to_y):
+        """
+        Returns true if nothing solid is between the two points in map coordinates
+        """
+        dir_x = to_x - from_x
+        dir_y = to_y - from_y
+        distance = math.sqrt((dir_x * dir_x) + (dir_y * dir_y))
+        if distance == 0:
+            return not self.is_collider(int(from_x // self.TILE_WIDTH), int(from_y // self.TILE_HEIGHT))
+        return self.raycast(from_x, from_y, dir_x, dir_y, distance) is None
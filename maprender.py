@@ -0,0 +1,163 @@
+# Mariana
+# Code - Matt Madden
+# maprender.py -- Draws the map from pre-drawn chunks, only redrawing the tiles that animate
+
+import collections
+import pygame
+
+
+class MapRenderer():
+    """
+    The map is drawn into chunks of CHUNK_TILES by CHUNK_TILES tiles the first time they come on screen,
+    after that a frame is just a blit per visible chunk. Only the most recently used max_chunks chunks are kept
+    Animated tiles are the exception. update() moves the animations along, and when an animation changes frame
+    the cells using it are redrawn into their chunks and nothing else is touched
+    tiles is a list of tile surfaces where index i is tile i, and opacity is a list of whether each tile is fully opaque
+    """
+
+    CHUNK_TILES = 8
+
+    def __init__(self, game_map, tiles, opacity, max_chunks=24):
+        self.map = game_map
+        self.tiles = tiles
+        self.opacity = opacity
+        self.max_chunks = max_chunks
+        self.chunk_width = self.CHUNK_TILES * game_map.TILE_WIDTH
+        self.chunk_height = self.CHUNK_TILES * game_map.TILE_HEIGHT
+
+        # (chunk x, chunk y) -> surface, the least recently drawn is first
+        self.chunks = collections.OrderedDict()
+        self.cell_rect = pygame.Rect(0, 0, game_map.TILE_WIDTH, game_map.TILE_HEIGHT)
+
+        # Floor blits skipped because an opaque wall covers them, and cells redrawn for animations, for the debug overlay
+        # Blits are only skipped when a cell is drawn into a chunk, not every frame, so these are running totals
+        self.skipped_blits_total = 0
+        self.redrawn_cells = 0
+
+        self.clocks = {}
+        self.index_animations()
+
+    def index_animations(self):
+        """
+        Sets up the animation clocks and the index of which animated cells are in which chunk
+        Call again if the map's animations or animated cells change
+        """
+        # Timing groups, keyed by durations. Each has [time into the current frame, current frame number]
+        # Groups that were already running keep their place
+        old_clocks = self.clocks
+        self.clocks = {}
+        for frames, durations in self.map.animations.values():
+            self.clocks[durations] = old_clocks.get(durations, [0, 0])
+
+        # (chunk x, chunk y) -> durations -> list of (x, y)
+        self.chunk_cells = {}
+        for durations in self.map.animated_cells:
+            for x, y in self.map.animated_cells[durations]:
+                chunk = (x // self.CHUNK_TILES, y // self.CHUNK_TILES)
+                self.chunk_cells.setdefault(chunk, {}).setdefault(durations, []).append((x, y))
+
+        # Tile index -> the tile to draw right now
+        self.current_tiles = list(range(0, len(self.tiles)))
+        for tile in self.map.animations:
+            self.update_current_tile(tile)
+
+    def update_current_tile(self, tile):
+        frames, durations = self.map.animations[tile]
+        if tile < len(self.current_tiles):
+            self.current_tiles[tile] = frames[self.clocks[durations][1] % len(frames)]
+
+    def update(self, delta):
+        """
+        Moves the animations forward by delta and redraws the cells of any that changed frame
+        """
+        changed = []
+        for durations in self.clocks:
+            clock = self.clocks[durations]
+            clock[0] += delta
+            if clock[0] < durations[clock[1]]:
+                continue
+            # A long frame could skip more than one animation frame
+            while clock[0] >= durations[clock[1]]:
+                clock[0] -= durations[clock[1]]
+                clock[1] = (clock[1] + 1) % len(durations)
+            changed.append(durations)
+        if len(changed) == 0:
+            return
+
+        for tile in self.map.animations:
+            if self.map.animations[tile][1] in changed:
+                self.update_current_tile(tile)
+
+        # Only chunks that have been drawn need fixing, the rest get the right frame when they're first drawn
+        for chunk in self.chunks:
+            groups = self.chunk_cells.get(chunk)
+            if groups is None:
+                continue
+            surface = self.chunks[chunk]
+            for durations in changed:
+                cells = groups.get(durations)
+                if cells is not None:
+                    for x, y in cells:
+                        self.draw_cell(surface, x, y)
+                        self.redrawn_cells += 1
+
+    def draw_cell(self, surface, x, y):
+        """
+        Draws the floor and wall of the tile at (x, y) into its chunk's surface
+        """
+        self.cell_rect.x = (x % self.CHUNK_TILES) * self.map.TILE_WIDTH
+        self.cell_rect.y = (y % self.CHUNK_TILES) * self.map.TILE_HEIGHT
+        wall = self.map.get_wall(x, y)
+        if wall != -1:
+            wall = self.current_tiles[wall]
+        # If the wall completely hides the floor there's no point drawing the floor first
+        if wall != -1 and self.opacity[wall]:
+            self.skipped_blits_total += 1
+        else:
+            surface.fill((0, 0, 0), self.cell_rect)
+            surface.blit(self.tiles[self.current_tiles[self.map.get_tile(x, y)]], self.cell_rect)
+        if wall != -1:
+            surface.blit(self.tiles[wall], self.cell_rect)
+
+    def bake_chunk(self, chunk_x, chunk_y):
+        """
+        Draws every tile of a chunk into a new surface
+        """
+        surface = pygame.Surface((self.chunk_width, self.chunk_height)).convert()
+        surface.fill((0, 0, 0))
+        for x in range(chunk_x * self.CHUNK_TILES, min(self.map.WIDTH_IN_TILES, (chunk_x + 1) * self.CHUNK_TILES)):
+            for y in range(chunk_y * self.CHUNK_TILES, min(self.map.HEIGHT_IN_TILES, (chunk_y + 1) * self.CHUNK_TILES)):
+                self.draw_cell(surface, x, y)
+        return surface
+
+    def redraw_cells(self, cells):
+        """
+        Redraws the given (x, y) cells in any chunks that have been drawn, for when the map is edited
+        """
+        for x, y in cells:
+            surface = self.chunks.get((x // self.CHUNK_TILES, y // self.CHUNK_TILES))
+            if surface is not None:
+                self.draw_cell(surface, x, y)
+
+    def draw(self, screen, camera_x, camera_y):
+        """
+        Blits every chunk that's on screen, drawing any that haven't been drawn yet
+        """
+        view_x = camera_x - self.map.START_X
+        view_y = camera_y - self.map.START_Y
+        first_x = max(0, int(view_x // self.chunk_width))
+        last_x = min((self.map.WIDTH_IN_TILES - 1) // self.CHUNK_TILES, int((view_x + screen.get_width()) // self.chunk_width))
+        first_y = max(0, int(view_y // self.chunk_height))
+        last_y = min((self.map.HEIGHT_IN_TILES - 1) // self.CHUNK_TILES, int((view_y + screen.get_height()) // self.chunk_height))
+        for chunk_x in range(first_x, last_x + 1):
+            for chunk_y in range(first_y, last_y + 1):
+                chunk = (chunk_x, chunk_y)
+                surface = self.chunks.get(chunk)
+                if surface is None:
+                    surface = self.bake_chunk(chunk_x, chunk_y)
+                    self.chunks[chunk] = surface
+                    if len(self.chunks) > self.max_chunks:
+                        self.chunks.popitem(last=False)
+                else:
+                    self.chunks.move_to_end(chunk)
+                screen.blit(surface, (int((chunk_x * self.chunk_width) - view_x), int((chunk_y * self.chunk_height) - view_y)))
@@ -0,0 +1,166 @@
+# Mariana
+# Code - Matt Madden
+# minimap.py -- A small map of the trench that fills in as the player explores it
+
+import numpy
+import pygame
+
+# Maps up to this many pixels across get a 2x2 block per tile, anything bigger gets 1 pixel per tile to keep the surface small
+MAX_BLOCK_SIZE = 2048
+
+
+def get_block(game_map):
+    """
+    Returns how many pixels across each tile of game_map is drawn on the minimap
+    """
+    if max(game_map.WIDTH_IN_TILES, game_map.HEIGHT_IN_TILES) * 2 > MAX_BLOCK_SIZE:
+        return 1
+    return 2
+
+
+def get_tile_colors(tileset, tile_width=64, tile_height=64):
+    """
+    Returns the average (r, g, b) of each tile of a tileset image, in the same order Game.load_tileset() numbers them
+    This only reads the image, so it can run on the level manager's worker thread
+    """
+    across = tileset.get_width() // tile_width
+    down = tileset.get_height() // tile_height
+    tile_rect = pygame.Rect(0, 0, tile_width, tile_height)
+    colors = []
+    for index in range(0, across * down):
+        tile_rect.x = (index % across) * tile_width
+        tile_rect.y = (index // across) * tile_height
+        colors.append(tuple(pygame.transform.average_color(tileset, tile_rect))[:3])
+    return colors
+
+
+def build_pixels(game_map, tile_colors, block=None):
+    """
+    Returns the whole minimap as a (width, height, 3) array of colors, ready for pygame.surfarray.blit_array()
+    """
+    if block is None:
+        block = get_block(game_map)
+    # The extra black entry at the end is what a tile index of -1 (nothing there) picks
+    palette = numpy.array(list(tile_colors) + [(0, 0, 0)], dtype=numpy.uint8)
+    if game_map.WIDTH_IN_TILES == 0 or game_map.HEIGHT_IN_TILES == 0:
+        return numpy.zeros((max(1, game_map.WIDTH_IN_TILES * block), max(1, game_map.HEIGHT_IN_TILES * block), 3), dtype=numpy.uint8)
+    floors, walls = game_map.get_layers()
+    floors = numpy.array(floors, dtype=numpy.intp)
+    walls = numpy.array(walls, dtype=numpy.intp)
+    pixels = palette[numpy.where(walls != -1, walls, floors)]
+    if block != 1:
+        pixels = pixels.repeat(block, axis=0).repeat(block, axis=1)
+    return pixels
+
+
+class Minimap():
+    """
+    Each tile is drawn as a block of block by block pixels in the average color of its tile, or its wall if it has one
+    pixels is the whole map from build_pixels(), revealed tiles are copied from there into surface as they're seen
+    After that surface only changes when tiles are revealed or edited, and drawing it is one blit
+    revealed has a byte per tile that's 1 once it's been seen, indexed by x * HEIGHT_IN_TILES + y like collider_grid
+    Making one is slow for a big map, so the level manager makes each level's minimap on its worker thread
+    and the game only has to hand it what's been explored with set_revealed()
+    """
+
+    MARKER_SIZE = 4
+
+    def __init__(self, game_map, tile_colors, revealed=None):
+        self.map = game_map
+        self.tile_colors = tile_colors
+        self.pixels = build_pixels(game_map, tile_colors)
+        self.block = max(1, self.pixels.shape[0] // max(1, game_map.WIDTH_IN_TILES))
+        self.revealed = bytearray(game_map.WIDTH_IN_TILES * game_map.HEIGHT_IN_TILES)
+
+        # Not converted, since that needs the display and this could be on the worker thread
+        # A plain surface already has the display's pixel format anyway
+        self.surface = pygame.Surface(self.pixels.shape[:2])
+        self.surface.fill((0, 0, 0))
+        self.cell_rect = pygame.Rect(0, 0, self.block, self.block)
+        self.reveal_rect = pygame.Rect(0, 0, 0, 0)
+        self.view_rect = pygame.Rect(0, 0, 0, 0)
+        self.marker_rect = pygame.Rect(0, 0, self.MARKER_SIZE, self.MARKER_SIZE)
+        if revealed is not None:
+            self.set_revealed(revealed)
+
+    def set_revealed(self, revealed):
+        """
+        Switches to another record of which tiles have been seen, like the one kept from the last time we were on
+        this map, and redraws the surface to match
+        """
+        self.revealed = revealed
+        self.surface.fill((0, 0, 0))
+        seen = numpy.frombuffer(self.revealed, dtype=numpy.uint8).reshape(self.map.WIDTH_IN_TILES, self.map.HEIGHT_IN_TILES)
+        columns = numpy.flatnonzero(seen.any(axis=1))
+        if len(columns) == 0:
+            return
+        # Only the box around everything that's been seen is copied, most of a big map usually hasn't been
+        rows = numpy.flatnonzero(seen.any(axis=0))
+        seen = seen[columns[0]:columns[-1] + 1, rows[0]:rows[-1] + 1]
+        if self.block != 1:
+            seen = seen.repeat(self.block, axis=0).repeat(self.block, axis=1)
+        self.reveal_rect.x = int(columns[0]) * self.block
+        self.reveal_rect.y = int(rows[0]) * self.block
+        self.reveal_rect.w = seen.shape[0]
+        self.reveal_rect.h = seen.shape[1]
+        pixels = self.pixels[self.reveal_rect.x:self.reveal_rect.right, self.reveal_rect.y:self.reveal_rect.bottom]
+        pygame.surfarray.blit_array(self.surface.subsurface(self.reveal_rect), pixels * seen[:, :, numpy.newaxis])
+
+    def get_cell_color(self, x, y):
+        wall = self.map.get_wall(x, y)
+        if wall != -1:
+            return self.tile_colors[wall]
+        tile = self.map.get_tile(x, y)
+        if tile == -1:
+            return (0, 0, 0)
+        return self.tile_colors[tile]
+
+    def reveal(self, tile_x, tile_y, radius):
+        """
+        Reveals the square of tiles within radius of (tile_x, tile_y)
+        """
+        first_x = max(0, tile_x - radius)
+        last_x = min(self.map.WIDTH_IN_TILES - 1, tile_x + radius)
+        first_y = max(0, tile_y - radius)
+        last_y = min(self.map.HEIGHT_IN_TILES - 1, tile_y + radius)
+        if first_x > last_x or first_y > last_y:
+            return
+        column = b"\x01" * (last_y - first_y + 1)
+        for x in range(first_x, last_x + 1):
+            start = (x * self.map.HEIGHT_IN_TILES) + first_y
+            self.revealed[start:start + len(column)] = column
+        self.reveal_rect.x = first_x * self.block
+        self.reveal_rect.y = first_y * self.block
+        self.reveal_rect.w = (last_x - first_x + 1) * self.block
+        self.reveal_rect.h = (last_y - first_y + 1) * self.block
+        pygame.surfarray.blit_array(self.surface.subsurface(self.reveal_rect), self.pixels[self.reveal_rect.x:self.reveal_rect.right, self.reveal_rect.y:self.reveal_rect.bottom])
+
+    def redraw_cells(self, cells):
+        """
+        Redraws the given (x, y) cells after the map is edited
+        """
+        for x, y in cells:
+            self.cell_rect.x = x * self.block
+            self.cell_rect.y = y * self.block
+            color = self.get_cell_color(x, y)
+            self.pixels[self.cell_rect.x:self.cell_rect.right, self.cell_rect.y:self.cell_rect.bottom] = color
+            if self.revealed[(x * self.map.HEIGHT_IN_TILES) + y] == 1:
+                self.surface.fill(color, self.cell_rect)
+
+    def draw(self, screen, rect, players, color=(255, 255, 255)):
+        """
+        Draws the part of the minimap around the first player into rect on screen, with a marker for each player
+        Player positions are in map coordinates
+        """
+        self.view_rect.w = rect.w
+        self.view_rect.h = rect.h
+        self.view_rect.centerx = int((players[0].x / self.map.TILE_WIDTH) * self.block)
+        self.view_rect.centery = int((players[0].y / self.map.TILE_HEIGHT) * self.block)
+        self.view_rect.clamp_ip(self.surface.get_rect())
+        screen.blit(self.surface, rect, self.view_rect)
+
+        for player in players:
+            self.marker_rect.centerx = rect.x + int(((player.x + (player.w / 2)) / self.map.TILE_WIDTH) * self.block) - self.view_rect.x
+            self.marker_rect.centery = rect.y + int(((player.y + (player.h / 2)) / self.map.TILE_HEIGHT) * self.block) - self.view_rect.y
+            if rect.contains(self.marker_rect):
+                screen.fill(color, self.marker_rect)
@@ -0,0 +1,447 @@
+# Mariana
+# Code - Matt Madden
+# netplay.py -- Two player online play using rollback, plus the transports that carry the inputs
+
+import argparse
+import heapq
+import json
+import random
+import socket
+import struct
+import sys
+import time
+import zlib
+import inputqueue
+import simulation
+
+# Packet header: the newest frame we have all of the other side's input up to (an ack), the first frame
+# of input in the packet, the number of frames in it, and the newest frame we have a checksum for along with the checksum
+PACKET = struct.Struct("<iiBiI")
+FRAME_INPUT = struct.Struct("<B")  # Number of events in a frame
+EVENT = struct.Struct("<BBd")  # Event type, action id, value
+
+# How many confirmed frames to remember checksums for
+CHECKSUM_HISTORY = 600
+
+
+class LoopbackTransport():
+    """
+    One end of an in-process connection, they're made in pairs by make_loopback_pair()
+    Packets arrive latency seconds after they're sent, give or take up to jitter seconds, and loss is the
+    chance of a packet being thrown away. With jitter packets can arrive out of order, same as over UDP
+    clock is the function used to tell the time, tests can pass a fake clock to make runs repeatable
+    """
+
+    def __init__(self, latency=0, jitter=0, loss=0, seed=0, clock=time.perf_counter):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.clock = clock
+        self.peer = None
+
+        # Heap of (arrival time, send order, packet) for the packets on their way to this end
+        self.in_flight = []
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, packet):
+        self.sent += 1
+        if self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = max(0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        heapq.heappush(self.peer.in_flight, (self.clock() + delay, self.sent, packet))
+
+    def receive(self):
+        """
+        Returns a list of the packets that have arrived since the last call
+        """
+        packets = []
+        now = self.clock()
+        while len(self.in_flight) != 0 and self.in_flight[0][0] <= now:
+            packets.append(heapq.heappop(self.in_flight)[2])
+        return packets
+
+    def close(self):
+        pass
+
+
+def make_loopback_pair(latency=0, jitter=0, loss=0, seed=0, clock=time.perf_counter):
+    """
+    Returns two LoopbackTransports that are connected to each other
+    """
+    first = LoopbackTransport(latency, jitter, loss, seed, clock)
+    second = LoopbackTransport(latency, jitter, loss, seed + 1, clock)
+    first.peer = second
+    second.peer = first
+    return (first, second)
+
+
+class UdpTransport():
+    """
+    Sends packets to the other player over UDP. Nothing is resent here, RollbackSession keeps sending
+    every frame the other side hasn't acked yet so lost packets don't matter
+    """
+
+    def __init__(self, local_port, peer_address):
+        # recvfrom() gives back an IP, so a host name is looked up once here to compare against
+        self.peer_address = (socket.gethostbyname(peer_address[0]), peer_address[1])
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", local_port))
+        self.socket.setblocking(False)
+
+        # Packets thrown away because they didn't come from the other player
+        self.strangers = 0
+
+    def send(self, packet):
+        try:
+            self.socket.sendto(packet, self.peer_address)
+        except OSError:
+            # Some platforms report the other side not being up yet as an error, we just try again next frame
+            pass
+
+    def receive(self):
+        packets = []
+        while True:
+            try:
+                packet, address = self.socket.recvfrom(4096)
+            except (BlockingIOError, OSError):
+                return packets
+            if address != self.peer_address:
+                self.strangers += 1
+                continue
+            packets.append(packet)
+
+    def close(self):
+        self.socket.close()
+
+
+class RollbackSession():
+    """
+    Keeps one simulation per player in step with a copy of the game on the other player's machine
+    Every frame the local player's input is sent to the other side. For frames where we haven't heard from
+    the other player yet, their input is predicted: input events are changes, so predicting no events means
+    they keep holding whatever they were holding. When their real input for a frame turns up and it had events,
+    we restore the snapshot from the start of that frame and simulate back up to the present, all within one
+    display frame. The simulations always run with a delta of 1 so both machines get exactly the same results
+    Both machines have to pass the simulations in the same order, local_index says which one is ours
+    The players don't affect each other yet, once they do they'll need to share one simulation
+    """
+
+    def __init__(self, sims, local_index, transport, max_rollback=12, input_delay=0):
+        """
+        max_rollback is how many frames we'll run ahead of the other player's input before waiting for it
+        input_delay holds back the local input by that many frames, which means fewer rollbacks at the cost of some lag
+        """
+        self.sims = sims
+        self.local_index = local_index
+        self.transport = transport
+        self.max_rollback = max_rollback
+        self.input_delay = input_delay
+
+        self.frame = 0  # The next frame to simulate
+        self.remote_confirmed = -1  # We have the other player's input for every frame up to and including this one
+        self.peer_ack = -1  # The other player has our input for every frame up to and including this one
+        self.local_latest = input_delay - 1  # The newest frame we have local input for
+
+        # Frame -> list of (event type, action id, value)
+        self.local_inputs = {}
+        self.remote_inputs = {}
+        for frame in range(0, input_delay):
+            self.local_inputs[frame] = []
+        self.forgotten = -1  # Inputs up to this frame have been thrown away
+
+        # Snapshots of every simulation at the start of each of the last max_rollback + 1 frames
+        self.history_length = max_rollback + 1
+        self.record_size = simulation.STATE.size * len(sims)
+        self.snapshots = bytearray(self.record_size * self.history_length)
+        self.queue = inputqueue.InputQueue()
+
+        # Checksums of confirmed states, used to check that both sides are seeing the same game
+        self.checksums = {}
+        self.remote_checksums = {}
+        self.checked_frame = -1
+
+        # Stats
+        self.rollbacks = 0
+        self.resimulated_frames = 0
+        self.max_resimulated = 0
+        self.stalls = 0
+        self.desyncs = 0
+        self.bad_packets = 0
+
+    def advance(self, local_events):
+        """
+        Call once per display frame with the local input events for this frame
+        Returns false if we're too far ahead of the other player to predict any further, in which case
+        nothing was simulated and the events should be passed in again next frame
+        """
+        self.receive()
+        if self.frame - self.remote_confirmed > self.max_rollback:
+            self.stalls += 1
+            self.send()
+            return False
+        self.local_latest += 1
+        self.local_inputs[self.local_latest] = local_events
+        self.send()
+        self.simulate_frame()
+        self.forget_old_inputs()
+        return True
+
+    def simulate_frame(self):
+        """
+        Saves the state at the start of the current frame, then runs every simulation through it
+        """
+        self.save(self.frame)
+        for i in range(0, len(self.sims)):
+            if i == self.local_index:
+                events = self.local_inputs.get(self.frame)
+            else:
+                events = self.remote_inputs.get(self.frame)
+            self.queue.begin_frame(0)
+            if events is not None:
+                for event in events:
+                    self.queue.push(event[0], event[1], event[2], 0)
+            self.sims[i].update(1, self.queue)
+        self.frame += 1
+
+    def save(self, frame):
+        offset = (frame % self.history_length) * self.record_size
+        for sim in self.sims:
+            sim.snapshot(self.snapshots, offset)
+            offset += simulation.STATE.size
+
+    def restore(self, frame):
+        offset = (frame % self.history_length) * self.record_size
+        for sim in self.sims:
+            sim.restore(self.snapshots, offset)
+            offset += simulation.STATE.size
+
+    def rollback(self, frame):
+        """
+        Goes back to the start of frame and simulates forward to where we were
+        """
+        present = self.frame
+        self.restore(frame)
+        self.frame = frame
+        while self.frame < present:
+            self.simulate_frame()
+        self.rollbacks += 1
+        self.resimulated_frames += present - frame
+        self.max_resimulated = max(self.max_resimulated, present - frame)
+
+    def send(self):
+        """
+        Sends every frame of local input the other side hasn't acked yet
+        """
+        first = max(self.peer_ack + 1, self.local_latest - 254)
+        checksum = self.checksums.get(self.checked_frame, 0)
+        parts = [PACKET.pack(self.remote_confirmed, first, self.local_latest - first + 1, self.checked_frame, checksum)]
+        for frame in range(first, self.local_latest + 1):
+            events = self.local_inputs[frame]
+            parts.append(FRAME_INPUT.pack(len(events)))
+            for event in events:
+                parts.append(EVENT.pack(event[0], event[1], event[2]))
+        self.transport.send(b"".join(parts))
+
+    def read_packet(self, packet):
+        """
+        Splits a packet into its header and a list of the events of each frame in it
+        Raises struct.error if the packet is too short for what it says is in it
+        """
+        header = PACKET.unpack_from(packet, 0)
+        offset = PACKET.size
+        frames = []
+        for i in range(0, header[2]):
+            event_count = FRAME_INPUT.unpack_from(packet, offset)[0]
+            offset += FRAME_INPUT.size
+            if offset + (event_count * EVENT.size) > len(packet):
+                raise struct.error("packet ends partway through a frame")
+            events = []
+            for j in range(0, event_count):
+                events.append(EVENT.unpack_from(packet, offset))
+                offset += EVENT.size
+            frames.append(events)
+        return header, frames
+
+    def receive(self):
+        """
+        Reads the other player's input from every packet that's arrived, and rolls back if we predicted any of it wrong
+        Packets that can't be read, like a stray one left over from an earlier game, are counted and skipped
+        """
+        rollback_frame = None
+        for packet in self.transport.receive():
+            # The whole packet is read before any of it is used, so a bad one can't be half applied
+            try:
+                header, frames = self.read_packet(packet)
+            except struct.error:
+                self.bad_packets += 1
+                continue
+            ack, first, count, checksum_frame, checksum = header
+            self.peer_ack = max(self.peer_ack, ack)
+            if checksum_frame > self.checked_frame:
+                self.remote_checksums[checksum_frame] = checksum
+            elif checksum_frame in self.checksums and self.checksums[checksum_frame] != checksum:
+                self.desyncs += 1
+            for i in range(0, count):
+                frame = first + i
+                events = frames[i]
+                if frame <= self.remote_confirmed or frame in self.remote_inputs:
+                    continue
+                self.remote_inputs[frame] = events
+                # We already ran this frame guessing there were no events, if there were we guessed wrong
+                if frame < self.frame and len(events) != 0 and (rollback_frame is None or frame < rollback_frame):
+                    rollback_frame = frame
+        while self.remote_confirmed + 1 in self.remote_inputs:
+            self.remote_confirmed += 1
+        if rollback_frame is not None:
+            self.rollback(rollback_frame)
+        self.record_checksums()
+
+    def record_checksums(self):
+        """
+        Takes a checksum of every saved state that can't change anymore, that is every state that only
+        depends on confirmed input, and compares it with the other side's if we have it
+        """
+        last = min(self.remote_confirmed + 1, self.frame - 1)
+        while self.checked_frame < last:
+            self.checked_frame += 1
+            frame = self.checked_frame
+            self.checksums.pop(frame - CHECKSUM_HISTORY, None)
+            if frame <= self.frame - self.history_length:
+                # Already overwritten, this only happens to the frames right at the start
+                continue
+            offset = (frame % self.history_length) * self.record_size
+            self.checksums[frame] = zlib.crc32(memoryview(self.snapshots)[offset:offset + self.record_size])
+            remote = self.remote_checksums.pop(frame, None)
+            if remote is not None and remote != self.checksums[frame]:
+                self.desyncs += 1
+
+    def forget_old_inputs(self):
+        """
+        Throws away inputs that can't be needed again, for resending or for a rollback
+        """
+        limit = min(self.frame - self.history_length, self.remote_confirmed, self.peer_ack)
+        while self.forgotten < limit:
+            self.forgotten += 1
+            self.local_inputs.pop(self.forgotten, None)
+            self.remote_inputs.pop(self.forgotten, None)
+
+    def report(self):
+        """
+        Returns a dict of stats about the session
+        """
+        return {
+            "frame": self.frame,
+            "remote_confirmed": self.remote_confirmed,
+            "rollbacks": self.rollbacks,
+            "resimulated_frames": self.resimulated_frames,
+            "max_resimulated": self.max_resimulated,
+            "stalls": self.stalls,
+            "desyncs": self.desyncs,
+            "bad_packets": self.bad_packets
+        }
+
+
+def random_input_frames(seed, frames):
+    """
+    Makes frames frames of random input with batch.random_inputs(), as a dict of frame -> events
+    """
+    # batch pulls in multiprocessing, so it's only imported when it's needed
+    import batch
+    script = {}
+    for tick, events in batch.random_inputs(seed, frames):
+        script.setdefault(tick, []).extend(events)
+    return script
+
+
+def run_loopback_test(mapfile, frames=1200, latency=0.08, jitter=0.02, loss=0.05, input_delay=2, max_rollback=12, seed=0, gfx_path="res/gfx/"):
+    """
+    Plays two sessions against each other over a loopback connection with random input on both sides,
+    on a fake clock so every run with the same arguments is the same
+    Afterwards both sides are checked against each other and against running the same input without any network
+    """
+    now = [0.0]
+
+    def clock():
+        return now[0]
+
+    transports = make_loopback_pair(latency, jitter, loss, seed, clock)
+    scripts = [random_input_frames(seed + 100, frames), random_input_frames(seed + 200, frames)]
+
+    sessions = []
+    for index in range(0, 2):
+        first = simulation.Simulation(mapfile, gfx_path)
+        second = simulation.Simulation(mapfile, gfx_path, first.map)
+        sessions.append(RollbackSession([first, second], index, transports[index], max_rollback, input_delay))
+
+    # Both sides keep going with no new input after the scripts run out, until everything has been confirmed
+    next_input = [0, 0]
+    worst_advance = 0
+    display_frames = 0
+    while min(sessions[0].checked_frame, sessions[1].checked_frame) < frames + input_delay:
+        for index in range(0, 2):
+            session = sessions[index]
+            events = []
+            if next_input[index] < frames:
+                events = scripts[index].get(next_input[index], [])
+            start = time.perf_counter()
+            if session.advance(events):
+                next_input[index] += 1
+            worst_advance = max(worst_advance, time.perf_counter() - start)
+        now[0] += 1 / 60
+        display_frames += 1
+
+    # The same input without a network in the way, the local input of each side lands input_delay frames late
+    offline = [simulation.Simulation(mapfile, gfx_path), simulation.Simulation(mapfile, gfx_path)]
+    queue = inputqueue.InputQueue()
+    check_frame = frames + input_delay
+    for frame in range(0, check_frame):
+        for index in range(0, 2):
+            queue.begin_frame(0)
+            for event in scripts[index].get(frame - input_delay, []):
+                queue.push(event[0], event[1], event[2], 0)
+            offline[index].update(1, queue)
+    offline_state = bytearray(simulation.STATE.size * 2)
+    offline[0].snapshot(offline_state, 0)
+    offline[1].snapshot(offline_state, simulation.STATE.size)
+
+    return {
+        "frames": frames,
+        "display_frames": display_frames,
+        "latency_ms": latency * 1000,
+        "jitter_ms": jitter * 1000,
+        "loss": loss,
+        "input_delay": input_delay,
+        "packets_dropped": transports[0].dropped + transports[1].dropped,
+        "worst_advance_ms": worst_advance * 1000,
+        "sessions": [session.report() for session in sessions],
+        "in_sync": sessions[0].checksums[check_frame] == sessions[1].checksums[check_frame],
+        "matches_offline": sessions[0].checksums[check_frame] == zlib.crc32(offline_state)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test rollback netplay over a simulated connection")
+    parser.add_argument("map", help="map file to play")
+    parser.add_argument("--gfx-path", default="res/gfx/", help="folder holding the tileset metadata")
+    parser.add_argument("--frames", type=int, default=1200, help="frames of random input for each player")
+    parser.add_argument("--latency", type=float, default=80, help="one way latency in milliseconds")
+    parser.add_argument("--jitter", type=float, default=20, help="latency varies by up to this many milliseconds")
+    parser.add_argument("--loss", type=float, default=0.05, help="chance of a packet being lost")
+    parser.add_argument("--delay", type=int, default=2, help="frames of input delay")
+    parser.add_argument("--max-rollback", type=int, default=12, help="most frames to predict before waiting")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = run_loopback_test(args.map, args.frames, args.latency / 1000, args.jitter / 1000, args.loss, args.delay, args.max_rollback, args.seed, args.gfx_path)
+    json.dump(results, sys.stdout, indent=4)
+    print()
+    if not results["in_sync"] or not results["matches_offline"]:
+        print("Error! The two sides didn't end up with the same game")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
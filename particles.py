@@ -0,0 +1,258 @@
+# Mariana
+# Code - Matt Madden
+# particles.py -- Bubbles, silt and anything else there's thousands of, kept in numpy arrays
+
+import numpy
+import pygame
+
+
+class Emitter():
+    """
+    Describes a kind of particle and how it's thrown out. Ranges are (low, high) and each particle gets a random value in them
+    sprites is the list of animation frames, each shown for frame_time frames. Angles are in degrees, 0 is right and 90 is down
+    drag is the fraction of velocity lost each frame, buoyancy is added to dy every frame (negative floats up)
+    inherit is how much of the emitter's own velocity the particles start with
+    """
+
+    def __init__(self, sprites, lifetime=(30, 60), speed=(0, 1), angle=(0, 360), spread=0, drag=0, buoyancy=0, inherit=0, frame_time=10):
+        self.sprites = sprites
+        self.lifetime = lifetime
+        self.speed = speed
+        self.angle = angle
+        self.spread = spread
+        self.drag = drag
+        self.buoyancy = buoyancy
+        self.inherit = inherit
+        self.frame_time = frame_time
+
+
+class ParticleSystem():
+    """
+    Holds every live particle in fixed size numpy arrays, so there's never a python object per particle
+    Live particles are always packed into the first count slots. update() moves all of them at once and packs the
+    survivors back to the front, and draw() hands all of the visible ones to a single Surface.blits() call
+    When the arrays are full new particles are dropped rather than growing, dropped counts how many
+    """
+
+    def __init__(self, capacity=10000, seed=None):
+        self.capacity = capacity
+        self.count = 0
+        self.dropped = 0
+        self.rng = numpy.random.default_rng(seed)
+
+        self.x = numpy.zeros(capacity)
+        self.y = numpy.zeros(capacity)
+        self.dx = numpy.zeros(capacity)
+        self.dy = numpy.zeros(capacity)
+        self.age = numpy.zeros(capacity)
+        self.lifetime = numpy.zeros(capacity)
+        self.kind = numpy.zeros(capacity, dtype=numpy.intp)
+
+        # Per kind constants, one entry per emitter. Sprites of every kind go in one list, and each kind knows where its frames start
+        self.emitters = []
+        self.sprites = []
+        self.kind_drag = numpy.zeros(0)
+        self.kind_buoyancy = numpy.zeros(0)
+        self.kind_frame_time = numpy.zeros(0)
+        self.kind_first_sprite = numpy.zeros(0, dtype=numpy.intp)
+        self.kind_last_frame = numpy.zeros(0, dtype=numpy.intp)
+        self.kind_half_w = numpy.zeros(0)
+        self.kind_half_h = numpy.zeros(0)
+
+        # The biggest sprite of any kind, anything further off screen than this can't show
+        self.max_sprite_w = 0
+        self.max_sprite_h = 0
+
+    def add_emitter(self, emitter):
+        """
+        Registers an emitter and returns its kind id for emit()
+        """
+        # Frames are picked by dividing a particle's age by frame_time
+        if not emitter.frame_time > 0:
+            raise ValueError("Emitter frame_time has to be above 0, got " + str(emitter.frame_time))
+        self.emitters.append(emitter)
+        self.kind_drag = numpy.append(self.kind_drag, float(emitter.drag))
+        self.kind_buoyancy = numpy.append(self.kind_buoyancy, float(emitter.buoyancy))
+        self.kind_frame_time = numpy.append(self.kind_frame_time, float(emitter.frame_time))
+        self.kind_first_sprite = numpy.append(self.kind_first_sprite, len(self.sprites))
+        self.kind_last_frame = numpy.append(self.kind_last_frame, len(emitter.sprites) - 1)
+        # Particles are positioned by their center, so the sprites are drawn half their size up and left
+        self.kind_half_w = numpy.append(self.kind_half_w, emitter.sprites[0].get_width() / 2)
+        self.kind_half_h = numpy.append(self.kind_half_h, emitter.sprites[0].get_height() / 2)
+        for sprite in emitter.sprites:
+            self.max_sprite_w = max(self.max_sprite_w, sprite.get_width())
+            self.max_sprite_h = max(self.max_sprite_h, sprite.get_height())
+        self.sprites.extend(emitter.sprites)
+        return len(self.emitters) - 1
+
+    def emit(self, kind, x, y, count, dx=0, dy=0):
+        """
+        Throws out count particles of the given kind from (x, y). dx and dy are the velocity of whatever is emitting them
+        Returns how many were actually made, which is less than count if the system is full
+        """
+        made = min(count, self.capacity - self.count)
+        self.dropped += count - made
+        if made <= 0:
+            return 0
+        emitter = self.emitters[kind]
+        start = self.count
+        end = start + made
+
+        angle = numpy.radians(self.rng.uniform(emitter.angle[0], emitter.angle[1], made))
+        speed = self.rng.uniform(emitter.speed[0], emitter.speed[1], made)
+        self.x[start:end] = x
+        self.y[start:end] = y
+        if emitter.spread != 0:
+            self.x[start:end] += self.rng.uniform(-emitter.spread, emitter.spread, made)
+            self.y[start:end] += self.rng.uniform(-emitter.spread, emitter.spread, made)
+        self.dx[start:end] = (numpy.cos(angle) * speed) + (dx * emitter.inherit)
+        self.dy[start:end] = (numpy.sin(angle) * speed) + (dy * emitter.inherit)
+        self.age[start:end] = 0
+        self.lifetime[start:end] = self.rng.uniform(emitter.lifetime[0], emitter.lifetime[1], made)
+        self.kind[start:end] = kind
+        self.count = end
+        return made
+
+    def update(self, delta):
+        """
+        Moves every particle forward by delta frames and gets rid of the ones that have run out of life
+        """
+        n = self.count
+        if n == 0:
+            return
+
+        kind = self.kind[:n]
+        dx = self.dx[:n]
+        dy = self.dy[:n]
+        age = self.age[:n]
+
+        # Drag is a fraction per frame, so over delta frames it compounds
+        friction = (1 - self.kind_drag[kind]) ** delta
+        dx *= friction
+        dy *= friction
+        dy += self.kind_buoyancy[kind] * delta
+        self.x[:n] += dx * delta
+        self.y[:n] += dy * delta
+        age += delta
+
+        alive = age < self.lifetime[:n]
+        survivors = int(numpy.count_nonzero(alive))
+        if survivors == n:
+            return
+        # Pack the survivors to the front, keeping their order
+        for array in (self.x, self.y, self.dx, self.dy, self.age, self.lifetime, self.kind):
+            array[:survivors] = array[:n][alive]
+        self.count = survivors
+
+    def clear(self):
+        self.count = 0
+
+    def draw(self, screen, camera_x, camera_y):
+        """
+        Draws every particle that's on screen with one blits() call
+        Returns how many were drawn
+        """
+        n = self.count
+        if n == 0:
+            return 0
+
+        kind = self.kind[:n]
+        screen_x = self.x[:n] - self.kind_half_w[kind] - camera_x
+        screen_y = self.y[:n] - self.kind_half_h[kind] - camera_y
+        # screen_x and screen_y are the top left of each sprite, so anything less than a sprite's size off the top or left might still show
+        visible = (screen_x > -self.max_sprite_w) & (screen_x < screen.get_width()) & (screen_y > -self.max_sprite_h) & (screen_y < screen.get_height())
+        if not visible.all():
+            kind = kind[visible]
+            screen_x = screen_x[visible]
+            screen_y = screen_y[visible]
+            frame = (self.age[:n][visible] // self.kind_frame_time[kind]).astype(numpy.intp)
+        else:
+            frame = (self.age[:n] // self.kind_frame_time[kind]).astype(numpy.intp)
+        numpy.minimum(frame, self.kind_last_frame[kind], out=frame)
+        sprite = self.kind_first_sprite[kind] + frame
+
+        sprites = self.sprites
+        screen.blits(zip(map(sprites.__getitem__, sprite.tolist()), zip(screen_x.astype(numpy.intp).tolist(), screen_y.astype(numpy.intp).tolist())), doreturn=False)
+        return len(sprite)
+
+
+def make_bubble_sprites(sizes=(2, 3, 4, 5, 6)):
+    """
+    Bubble frames that grow as they rise, returns a list of surfaces
+    """
+    # Every frame is the same size so the bubble stays centered as it grows
+    size = (max(sizes) * 2) + 2
+    center = size // 2
+    sprites = []
+    for radius in sizes:
+        sprite = pygame.Surface((size, size)).convert()
+        sprite.fill((0, 0, 0))
+        sprite.set_colorkey((0, 0, 0))
+        pygame.draw.circle(sprite, (150, 210, 240), (center, center), radius, 1)
+        pygame.draw.circle(sprite, (230, 250, 255), (center - (radius // 3), center - (radius // 3)), max(1, radius // 3))
+        sprites.append(sprite)
+    return sprites
+
+
+def make_silt_sprites(colors=((120, 100, 70), (95, 80, 58), (70, 60, 45))):
+    """
+    Specks of silt that darken as they settle, returns a list of surfaces
+    """
+    sprites = []
+    for color in colors:
+        sprite = pygame.Surface((3, 3)).convert()
+        sprite.fill(color)
+        sprites.append(sprite)
+    return sprites
+
+
+def make_player_effects(system):
+    """
+    Registers the emitters the player uses with system and returns the (bubble trail, silt puff) kind ids
+    """
+    bubbles = system.add_emitter(Emitter(make_bubble_sprites(), lifetime=(40, 80), speed=(0.2, 1), angle=(0, 360),
+                                         spread=6, drag=0.04, buoyancy=-0.03, inherit=-0.2, frame_time=12))
+    silt = system.add_emitter(Emitter(make_silt_sprites(), lifetime=(30, 70), speed=(0.5, 3), angle=(0, 360),
+                                      spread=4, drag=0.08, buoyancy=0.01, frame_time=25))
+    return bubbles, silt
+
+
+def benchmark(count=10000, frames=300, seed=0):
+    """
+    Keeps about count particles alive on a 1280x720 screen and returns the average update and draw time in ms
+    Run with SDL_VIDEODRIVER=dummy to try it without a window
+    """
+    import time
+
+    pygame.display.init()
+    screen = pygame.display.set_mode((1280, 720))
+    system = ParticleSystem(count, seed)
+    bubbles, silt = make_player_effects(system)
+    rng = numpy.random.default_rng(seed)
+
+    update_time = 0
+    draw_time = 0
+    drawn = 0
+    for frame in range(0, frames):
+        # Top up to count from a handful of points on screen, like a lot of fish dashing at once
+        while system.count < count - 100:
+            system.emit(bubbles if rng.random() < 0.7 else silt, rng.uniform(0, 1280), rng.uniform(0, 720), 100)
+        start = time.perf_counter()
+        system.update(1)
+        update_time += time.perf_counter() - start
+        screen.fill((0, 0, 0))
+        start = time.perf_counter()
+        drawn += system.draw(screen, 0, 0)
+        draw_time += time.perf_counter() - start
+    return {
+        "particles": count,
+        "update_ms": update_time * 1000 / frames,
+        "draw_ms": draw_time * 1000 / frames,
+        "drawn_per_frame": drawn / frames,
+        "budget_ms": 1000 / 60
+    }
+
+
+if __name__ == "__main__":
+    for key, value in benchmark().items():
+        print(key + ": " + str(value))
@@ -0,0 +1,122 @@
+# Mariana
+# Code - Matt Madden
+# profiler.py -- cProfile captures of the main loop, either toggled by hand or of the slowest frames
+
+import cProfile
+import heapq
+import os
+import pstats
+import time
+
+
+class FrameProfiler():
+    """
+    Two ways of profiling the game
+    A manual capture is started and stopped with toggle(), and everything in between is dumped to one file
+    If slowest_count is set, every frame is profiled on its own and the slowest_count slowest frames are
+    kept and dumped when finish() is called
+    Each dump is a .prof file that can be opened with pstats or snakeviz, plus a .txt summary of the
+    top functions by cumulative time
+    """
+
+    def __init__(self, directory="data/profiles", slowest_count=0):
+        self.directory = directory
+        self.slowest_count = slowest_count
+
+        self.capture = None
+        self.capture_started = 0
+
+        # Heap of (frame seconds, frame number, profile) for the slowest frames, the fastest of them is first
+        self.slowest = []
+        self.frame_profile = None
+        self.frame_running = False
+        self.frame_start = 0
+        self.frame_number = 0
+
+        self.written = []
+
+    def is_capturing(self):
+        return self.capture is not None
+
+    def toggle(self):
+        """
+        Starts a manual capture, or stops and dumps the current one
+        """
+        if self.capture is None:
+            # Toggling happens partway through a frame, so that frame's profile has to be stopped and thrown away first
+            # or the capture would be switched off with it at the end of the frame
+            if self.frame_running:
+                self.frame_profile.disable()
+                self.frame_profile.clear()
+                self.frame_running = False
+            self.capture = cProfile.Profile()
+            self.capture_started = time.perf_counter()
+            self.capture.enable()
+        else:
+            self.capture.disable()
+            seconds = time.perf_counter() - self.capture_started
+            self.dump(self.capture, "capture-" + time.strftime("%Y%m%d-%H%M%S"), "Manual capture of {0:.2f} seconds".format(seconds))
+            self.capture = None
+
+    def begin_frame(self):
+        """
+        Call at the start of every frame of the main loop
+        """
+        if self.slowest_count == 0 or self.capture is not None:
+            # Only one profiler can be running at a time, so frames aren't profiled during a manual capture
+            return
+        if self.frame_profile is None:
+            self.frame_profile = cProfile.Profile()
+        self.frame_start = time.perf_counter()
+        self.frame_profile.enable()
+        self.frame_running = True
+
+    def end_frame(self):
+        """
+        Call at the end of every frame of the main loop
+        """
+        self.frame_number += 1
+        if not self.frame_running or self.capture is not None:
+            return
+        self.frame_profile.disable()
+        self.frame_running = False
+        seconds = time.perf_counter() - self.frame_start
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, (seconds, self.frame_number, self.frame_profile))
+            self.frame_profile = None
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, self.frame_number, self.frame_profile))
+            self.frame_profile = None
+        else:
+            # Not one of the slowest, so reuse the profiler for the next frame
+            self.frame_profile.clear()
+
+    def finish(self):
+        """
+        Stops any manual capture and dumps the slowest frames, call when the game quits
+        Returns the list of files written during the session
+        """
+        if self.capture is not None:
+            self.toggle()
+        if self.frame_running:
+            self.frame_profile.disable()
+            self.frame_running = False
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        for seconds, frame_number, profile in sorted(self.slowest, reverse=True):
+            self.dump(profile, "frame-" + stamp + "-" + str(frame_number), "Frame {0} took {1:.2f} ms".format(frame_number, seconds * 1000))
+        self.slowest = []
+        return self.written
+
+    def dump(self, profile, name, title, top=25):
+        """
+        Writes the profile to <name>.prof and a summary of the top functions to <name>.txt
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + ".prof")
+        summary_file = open(path + ".txt", "w")
+        summary_file.write(title + "\n")
+        stats = pstats.Stats(profile, stream=summary_file)
+        stats.sort_stats("cumulative").print_stats(top)
+        summary_file.close()
+        self.written.append(path + ".prof")
@@ -0,0 +1,123 @@
+# Mariana
+# Code - Matt Madden
+# replay.py -- Records the input fed to the level each frame and replays it headlessly
+
+import argparse
+import json
+import struct
+import sys
+import time
+import inputqueue
+import simulation
+
+MAGIC = b"MRNR"
+VERSION = 2
+
+# Header is the magic, the version, and then the length of the map file name
+HEADER = struct.Struct("<4sHH")
+FRAME = struct.Struct("<dB")  # delta and the number of events in the frame
+# Event type, action id, value, and the event's time in nanoseconds after the start of the frame
+EVENT = struct.Struct("<BBdq")
+
+
+class InputRecorder():
+    """
+    Writes the input events the level gets each frame to a compact binary file
+    Event times are stored relative to the start of their frame, so a replay places every
+    event at exactly the same point within its frame
+    """
+
+    def __init__(self, filename, mapfile):
+        self.file = open(filename, "wb")
+        encoded = mapfile.encode("utf-8")
+        self.file.write(HEADER.pack(MAGIC, VERSION, len(encoded)))
+        self.file.write(encoded)
+        self.frames = 0
+
+    def record_frame(self, delta, input_queue):
+        """
+        Call this with exactly what is about to be passed to Level.update(), the queue isn't changed
+        """
+        self.file.write(FRAME.pack(delta, input_queue.count))
+        for n in range(0, input_queue.count):
+            i = input_queue.peek(n)
+            self.file.write(EVENT.pack(input_queue.types[i], input_queue.actions[i], input_queue.values[i], input_queue.times[i] - input_queue.frame_start))
+        self.frames += 1
+
+    def close(self):
+        self.file.close()
+
+
+def read_recording(filename):
+    """
+    Reads a recording and returns (mapfile, frames) where frames is a list of (delta, events)
+    and events is a list of (event type, action id, value, time after frame start)
+    """
+    data = open(filename, "rb").read()
+    magic, version, map_length = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        print("Error! " + filename + " is not a recording this version can read")
+        sys.exit(0)
+    offset = HEADER.size
+    mapfile = data[offset:(offset + map_length)].decode("utf-8")
+    offset += map_length
+
+    frames = []
+    while offset < len(data):
+        delta, event_count = FRAME.unpack_from(data, offset)
+        offset += FRAME.size
+        events = []
+        for i in range(0, event_count):
+            events.append(EVENT.unpack_from(data, offset))
+            offset += EVENT.size
+        frames.append((delta, events))
+    return (mapfile, frames)
+
+
+def replay(filename, gfx_path="res/gfx/"):
+    """
+    Feeds a recording back through a headless simulation as fast as possible
+    Returns a dict with the final player position and how fast the replay ran
+    """
+    mapfile, frames = read_recording(filename)
+    sim = simulation.Simulation(mapfile, gfx_path)
+    queue = inputqueue.InputQueue()
+    start = time.perf_counter()
+    for delta, events in frames:
+        # Every frame starts at time 0 so the recorded event times can be used as is
+        queue.begin_frame(0)
+        for event in events:
+            queue.push(event[0], event[1], event[2], event[3])
+        sim.update(delta, queue)
+    elapsed = time.perf_counter() - start
+    return {
+        "recording": filename,
+        "map": mapfile,
+        "frames": len(frames),
+        "seconds": elapsed,
+        "frames_per_second": len(frames) / elapsed if elapsed > 0 else 0,
+        "final_x": sim.player.x,
+        "final_y": sim.player.y
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a mariana input recording headlessly")
+    parser.add_argument("recording", help="file written by running the game with --record")
+    parser.add_argument("--gfx-path", default="res/gfx/", help="folder holding the tileset metadata")
+    parser.add_argument("--expect", metavar="X,Y", help="exit with an error if the final player position isn't X,Y")
+    args = parser.parse_args()
+
+    result = replay(args.recording, args.gfx_path)
+    json.dump(result, sys.stdout, indent=4)
+    print()
+
+    if args.expect is not None:
+        expected = [float(value) for value in args.expect.split(",")]
+        if expected != [result["final_x"], result["final_y"]]:
+            print("Final position does not match " + args.expect)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Mariana
+# Code - Matt Madden
+# savestate.py -- Save files made from simulation snapshots, written on a background thread
+
+import os
+import queue
+import struct
+import threading
+import time
+import simulation
+
+MAGIC = b"MRNS"
+VERSION = 1
+
+# Header is the magic, the version, the length of the map file name, and the length of the snapshot
+HEADER = struct.Struct("<4sHHH")
+
+
+def encode_save(mapfile, state):
+    """
+    Returns the bytes of a save file holding a snapshot of the simulation playing mapfile
+    """
+    encoded = mapfile.encode("utf-8")
+    return HEADER.pack(MAGIC, VERSION, len(encoded), len(state)) + encoded + bytes(state)
+
+
+def read_save(filename):
+    """
+    Reads a save file and returns (mapfile, state) where state can be passed to Simulation.restore()
+    Returns None if the file is missing or isn't a save this version can read
+    """
+    if not os.path.isfile(filename):
+        print("Error! Could not find " + filename)
+        return None
+    save_file = open(filename, "rb")
+    data = save_file.read()
+    save_file.close()
+    if len(data) < HEADER.size:
+        print("Error! " + filename + " is not a save file")
+        return None
+    magic, version, map_length, state_length = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION or state_length != simulation.STATE.size or len(data) != HEADER.size + map_length + state_length:
+        print("Error! " + filename + " is not a save this version can read")
+        return None
+    try:
+        mapfile = data[HEADER.size:HEADER.size + map_length].decode("utf-8")
+    except UnicodeDecodeError:
+        # The header checks out but the map name is garbage, so the file was damaged after it was written
+        print("Error! " + filename + " is not a save this version can read")
+        return None
+    return (mapfile, data[HEADER.size + map_length:])
+
+
+class SaveWriter():
+    """
+    Writes save files on a background thread so the frame that asks for a save never waits on the disk
+    Each file is written under a temporary name and then moved into place, so a crash part way
+    through a write leaves the last good save alone
+    """
+
+    def __init__(self, directory="data/saves"):
+        self.directory = directory
+        self.requests = queue.Queue()
+        self.worker = None
+
+        self.writes = 0
+        self.last_write_ms = 0
+
+    def save(self, name, mapfile, state):
+        """
+        Queues a save of state to <directory>/<name>.sav and returns the path it will be written to
+        The state is copied, so the buffer can be reused straight away
+        """
+        if self.worker is None:
+            self.worker = threading.Thread(target=self.run_worker, daemon=True)
+            self.worker.start()
+        path = os.path.join(self.directory, name + ".sav")
+        self.requests.put((path, mapfile, bytes(state)))
+        return path
+
+    def run_worker(self):
+        """
+        Writes the queued saves until close() is called. Runs on the worker thread
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            path, mapfile, state = request
+            start = time.perf_counter()
+            save_file = open(path + ".tmp", "wb")
+            save_file.write(encode_save(mapfile, state))
+            save_file.close()
+            os.replace(path + ".tmp", path)
+            self.writes += 1
+            self.last_write_ms = (time.perf_counter() - start) * 1000
+
+    def close(self):
+        """
+        Finishes any saves that are still queued, call when the game quits
+        """
+        if self.worker is not None:
+            self.requests.put(None)
+            self.worker.join()
+            self.worker = None
@@ -0,0 +1,159 @@
+# Mariana
+# Code - Matt Madden
+# scheduler.py -- Decides how often each entity gets updated depending on how far it is from the camera
+
+ACTIVE = 0
+REDUCED = 1
+ASLEEP = 2
+
+
+class UpdateScheduler():
+    """
+    Updates a set of entities by how close they are to what's on screen
+    Entities within active_margin pixels of a view update every tick. Entities within reduced_margin update once every
+    reduced_interval ticks with all the time they missed, and the ones further out than that sleep
+    Sleeping entities don't move, so they're filed away in a grid of CELL_SIZE cells and not looked at again until a view
+    comes within reduced_margin of their cell. A tick only costs as much as the entities that are awake
+    Time isn't dropped or doubled up when an entity changes tier. Anything still owed is paid before an entity goes to
+    sleep, so it sleeps in the state it would have had, and while it's asleep its time stands still. When the camera
+    comes back it carries on from there
+    """
+
+    CELL_SIZE = 512
+
+    def __init__(self, active_margin=256, reduced_margin=1536, reduced_interval=4, max_step=4):
+        self.active_margin = active_margin
+        self.reduced_margin = reduced_margin
+        self.reduced_interval = reduced_interval
+
+        # An entity woken with its cell can be up to a cell further out than reduced_margin, so entities only go back to
+        # sleep past that or they'd be woken and put back to sleep every tick
+        self.sleep_margin = reduced_margin + self.CELL_SIZE
+
+        # Catching up is done in steps of at most max_step frames, so a long catch up moves the same way a few normal frames would
+        self.max_step = max_step
+
+        # Entities that are active or reduced, and the game time each one is owed but hasn't been updated with yet
+        self.awake = []
+        self.pending = {}
+
+        # Which tick out of every reduced_interval each awake entity updates on while it's reduced. It's handed out
+        # in turn as entities are added or woken so the reduced entities don't all update on the same tick
+        self.phases = {}
+        self.next_phase = 0
+
+        # (cell x, cell y) -> list of sleeping entities in that cell, and the cell each sleeping entity was filed in
+        # Something could move a sleeping entity from outside, so its cell isn't worked out again from where it is
+        self.sleeping = {}
+        self.sleeping_cells = {}
+        self.count = 0
+
+        self.tick = 0
+
+        # How many entities were in each tier on the last tick, for the debug overlay
+        self.active_count = 0
+        self.reduced_count = 0
+        self.asleep_count = 0
+
+    def add(self, entity):
+        """
+        Adds an entity, it's sorted into its tier on the next update()
+        """
+        self.wake(entity)
+        self.count += 1
+
+    def remove(self, entity):
+        if entity in self.pending:
+            self.awake.remove(entity)
+            del self.pending[entity]
+            del self.phases[entity]
+        else:
+            cell = self.sleeping_cells.pop(entity)
+            self.sleeping[cell].remove(entity)
+            if len(self.sleeping[cell]) == 0:
+                del self.sleeping[cell]
+        self.count -= 1
+
+    def wake(self, entity):
+        self.awake.append(entity)
+        self.pending[entity] = 0
+        self.phases[entity] = self.next_phase
+        self.next_phase = (self.next_phase + 1) % self.reduced_interval
+
+    def get_cell(self, entity):
+        return (int((entity.x + (entity.w / 2)) // self.CELL_SIZE), int((entity.y + (entity.h / 2)) // self.CELL_SIZE))
+
+    def step(self, entity, time):
+        while time > self.max_step:
+            entity.update(self.max_step)
+            time -= self.max_step
+        if time > 0:
+            entity.update(time)
+
+    def wake_near(self, views):
+        """
+        Wakes every sleeping entity in a cell within reduced_margin of a view
+        """
+        for view_x, view_y, view_width, view_height in views:
+            first_x = int((view_x - self.reduced_margin) // self.CELL_SIZE)
+            last_x = int((view_x + view_width + self.reduced_margin) // self.CELL_SIZE)
+            first_y = int((view_y - self.reduced_margin) // self.CELL_SIZE)
+            last_y = int((view_y + view_height + self.reduced_margin) // self.CELL_SIZE)
+            for cell_x in range(first_x, last_x + 1):
+                for cell_y in range(first_y, last_y + 1):
+                    cell = self.sleeping.pop((cell_x, cell_y), None)
+                    if cell is None:
+                        continue
+                    for entity in cell:
+                        del self.sleeping_cells[entity]
+                        self.wake(entity)
+
+    def update(self, delta, views):
+        """
+        Moves every entity that's due along. views is a list of (x, y, width, height) regions being looked at,
+        usually one per camera, and an entity's distance is how far its center is outside the closest one
+        """
+        self.tick += 1
+        if len(self.sleeping) != 0:
+            self.wake_near(views)
+
+        active_count = 0
+        reduced_count = 0
+        pending = self.pending
+        phases = self.phases
+        still_awake = []
+        for entity in self.awake:
+            center_x = entity.x + (entity.w / 2)
+            center_y = entity.y + (entity.h / 2)
+            distance = None
+            for view_x, view_y, view_width, view_height in views:
+                distance_x = max(view_x - center_x, 0, center_x - (view_x + view_width))
+                distance_y = max(view_y - center_y, 0, center_y - (view_y + view_height))
+                view_distance = max(distance_x, distance_y)
+                if distance is None or view_distance < distance:
+                    distance = view_distance
+
+            if distance is not None and distance <= self.active_margin:
+                self.step(entity, pending[entity] + delta)
+                pending[entity] = 0
+                active_count += 1
+            elif distance is not None and distance <= self.sleep_margin:
+                pending[entity] += delta
+                if (self.tick + phases[entity]) % self.reduced_interval == 0:
+                    self.step(entity, pending[entity])
+                    pending[entity] = 0
+                reduced_count += 1
+            else:
+                self.step(entity, pending[entity])
+                del pending[entity]
+                del phases[entity]
+                cell = self.get_cell(entity)
+                self.sleeping.setdefault(cell, []).append(entity)
+                self.sleeping_cells[entity] = cell
+                continue
+            still_awake.append(entity)
+        self.awake = still_awake
+
+        self.active_count = active_count
+        self.reduced_count = reduced_count
+        self.asleep_count = self.count - active_count - reduced_count
@@ -0,0 +1,308 @@
+# Mariana
+# Code - Matt Madden
+# simulation.py -- Gameplay simulation that runs without pygame, so it can run headless and faster than real time
+
+import entities
+import inputqueue
+import map
+import math
+import operator
+import struct
+
+# Number of perf_counter_ns() nanoseconds in one update at 60 fps, which is a delta of 1
+NS_PER_FRAME = 1000000000 / 60
+
+# Layout of a snapshot, see Simulation.snapshot()
+# Player x, y, dx, dy, ax, ay and dash timer, the player's can_dash, is_dashing, is_sprinting and on_wall flags,
+# then the player start position, the camera position, and the two movement axes
+STATE = struct.Struct("<7d4?6d")
+get_player_state = operator.attrgetter("x", "y", "dx", "dy", "ax", "ay", "dash_timer", "can_dash", "is_dashing", "is_sprinting", "on_wall")
+get_simulation_state = operator.attrgetter("player_start_x", "player_start_y", "camera_x", "camera_y")
+
+
+class Simulation():
+    """
+    Holds the player, map and camera and steps them forward given input events
+    Nothing in here touches pygame, the Level class adds the rendering helpers on top of this
+    """
+
+    def __init__(self, mapfile, gfx_path="res/gfx/", game_map=None):
+        """
+        Loads the map from mapfile and spawns the player in it
+        gfx_path is the folder the map's tileset metadata is read from
+        If game_map is given that map is used instead of loading mapfile again, for simulations that share a map
+        """
+
+        # Initialize the player
+        self.player = entities.Player()
+        self.player_start_x = self.player.x
+        self.player_start_y = self.player.y
+
+        # Initialize the map
+        self.mapfile = mapfile
+        if game_map is not None:
+            self.map = game_map
+        else:
+            self.map = map.Map()
+            self.map.GFX_PATH = gfx_path
+            self.map.load_mapfile(mapfile)
+
+        # Initialize the camera
+        self.set_view_size(1280, 720)
+        self.camera_x = 0
+        self.camera_y = 0
+
+        # The last values of the horizontal and vertical movement axes, indexed by action id
+        self.input_axes = [0, 0]
+
+        # If this is set to a LatencyTracker, inputs that change the player are reported to it
+        self.latency = None
+
+        # Set to the map's (mapfile, spawn) entry for an exit while the player is standing on it
+        self.exit_reached = None
+
+        # Set camera position based on player spawn in map
+        self.spawn_player_at_tile(self.map.player_spawn)
+
+    def set_view_size(self, width, height):
+        """
+        Sets the size of the view the camera looks through, for when the screen is split between players
+        """
+        self.VIEW_WIDTH = width
+        self.VIEW_HEIGHT = height
+        self.CAMERA_RIGHT = self.VIEW_WIDTH * 0.75
+        self.CAMERA_LEFT = self.VIEW_WIDTH * 0.25
+        self.CAMERA_TOP = self.VIEW_HEIGHT * 0.25
+        self.CAMERA_BOT = self.VIEW_HEIGHT * 0.75
+
+    def snapshot(self, buffer=None, offset=0):
+        """
+        Packs everything that changes while the simulation runs into STATE.size bytes
+        If buffer is given the state is written into it at offset, otherwise a new bytearray is made
+        Returns the buffer. The map isn't included, it's loaded from the map file
+        """
+        if buffer is None:
+            buffer = bytearray(STATE.size)
+        STATE.pack_into(buffer, offset, *get_player_state(self.player), *get_simulation_state(self), self.input_axes[0], self.input_axes[1])
+        return buffer
+
+    def restore(self, state, offset=0):
+        """
+        Puts the simulation back into the state saved by snapshot()
+        """
+        player = self.player
+        (player.x, player.y, player.dx, player.dy, player.ax, player.ay, player.dash_timer,
+         player.can_dash, player.is_dashing, player.is_sprinting, player.on_wall,
+         self.player_start_x, self.player_start_y, self.camera_x, self.camera_y,
+         self.input_axes[0], self.input_axes[1]) = STATE.unpack_from(state, offset)
+        self.exit_reached = None
+
+    def spawn_player_at_tile(self, pos):
+        """
+        This spawns the player in the center of the tile at the given tile coordinate
+        """
+
+        # Get x and y variables from the pos
+        x = pos[0]
+        y = pos[1]
+
+        # Set the player in teh correct tile
+        self.player.x = x * self.map.TILE_WIDTH
+        self.player.y = y * self.map.TILE_HEIGHT
+
+        # Center the player position within that tile
+        x_diff = self.map.TILE_WIDTH - self.player.w
+        y_diff = self.map.TILE_HEIGHT - self.player.h
+        x_offset = int(x_diff / 2)
+        y_offset = int(y_diff / 2)
+        self.player.x += x_offset
+        self.player.y += y_offset
+
+        # Now set the camera according to player pos
+        # TODO test to make sure that the camera doesn't break at any point by us doing this
+        self.camera_x = self.player.x - (self.VIEW_WIDTH / 2)
+        self.camera_y = self.player.y - (self.VIEW_HEIGHT / 2)
+
+    def update(self, delta, input_queue):
+        """
+        Updates the level logic
+        input_queue is an InputQueue, every event in it is read and placed at its time within the frame
+        """
+
+        # Run the player up to each input's time in the frame, apply it, and carry on from there
+        frame_ns = delta * NS_PER_FRAME
+        done = 0
+        while input_queue.count != 0:
+            i = input_queue.pop()
+            fraction = input_queue.get_fraction(i, frame_ns)
+            if fraction > done:
+                self.step_player((fraction - done) * delta)
+                done = fraction
+            changed = self.apply_input(input_queue.types[i], input_queue.actions[i], input_queue.values[i])
+            if changed and self.latency is not None:
+                self.latency.mark_effect(input_queue.times[i])
+        if done < 1:
+            self.step_player((1 - done) * delta)
+
+        self.update_camera()
+        self.check_exits()
+
+    def step_player(self, delta):
+        """
+        Moves the player forward by delta and handles any collisions along the way
+        """
+
+        # Remember where the player started so collisions can sweep its movement
+        self.player_start_x = self.player.x
+        self.player_start_y = self.player.y
+        self.player.update(delta)
+        self.check_collisions(delta)
+
+    def update_camera(self):
+        """
+        Moves the camera to keep the player within the middle of the screen
+        """
+
+        # The player position on screen is truncated the same way a pygame rect would be
+        player_screen_x = int(self.player.x - self.camera_x)
+        player_screen_y = int(self.player.y - self.camera_y)
+        if player_screen_x > self.CAMERA_RIGHT:
+            self.camera_x += player_screen_x - self.CAMERA_RIGHT
+        elif player_screen_x < self.CAMERA_LEFT:
+            self.camera_x += player_screen_x - self.CAMERA_LEFT
+        if player_screen_y > self.CAMERA_BOT:
+            self.camera_y += player_screen_y - self.CAMERA_BOT
+        elif player_screen_y < self.CAMERA_TOP:
+            self.camera_y += player_screen_y - self.CAMERA_TOP
+
+        # Make sure the camera hasn't overstepped its bounds
+        # The map's max camera is for a full screen view, this is the same thing for whatever size our view is
+        max_camera_x = self.map.get_width() - self.VIEW_WIDTH
+        max_camera_y = self.map.get_height() - self.VIEW_HEIGHT
+        if self.camera_x > max_camera_x:
+            self.camera_x = max_camera_x
+        elif self.camera_x < self.map.MIN_CAMERA_X:
+            self.camera_x = self.map.MIN_CAMERA_X
+        if self.camera_y > max_camera_y:
+            self.camera_y = max_camera_y
+        elif self.camera_y < self.map.MIN_CAMERA_Y:
+            self.camera_y = self.map.MIN_CAMERA_Y
+
+    def check_exits(self):
+        """
+        Checks if the center of the player is on an exit tile
+        """
+        tile_x = int((self.player.x + (self.player.w / 2)) // self.map.TILE_WIDTH)
+        tile_y = int((self.player.y + (self.player.h / 2)) // self.map.TILE_HEIGHT)
+        self.exit_reached = self.map.exits.get((tile_x, tile_y))
+
+    def enter_from(self, other, spawn=None):
+        """
+        Sets up this level to carry on from another one, for when the player goes through an exit
+        The player starts at spawn (or the map's player spawn) and keeps whatever input was being held
+        """
+        if spawn is None:
+            spawn = self.map.player_spawn
+        self.player.reset()
+        self.spawn_player_at_tile(spawn)
+        self.update_camera()
+        self.player.is_sprinting = other.player.is_sprinting
+        self.player.can_dash = other.player.can_dash
+        self.input_axes[0] = other.input_axes[0]
+        self.input_axes[1] = other.input_axes[1]
+        self.update_player_acceleration()
+        self.exit_reached = None
+
+    def check_collisions(self, delta):
+        """
+        Checks and handles game collisions
+        The player is swept from where it was at the start of the frame to where it wants to be,
+        so even a dash that moves further than a tile in one step can't skip past a wall
+        """
+        x = self.player_start_x
+        y = self.player_start_y
+        step_x = self.player.x - x
+        step_y = self.player.y - y
+        wall_collision_occured = False
+
+        # Each hit removes movement on one axis, so after two hits there's nothing left to sweep
+        for i in range(0, 3):
+            if step_x == 0 and step_y == 0:
+                break
+            hit = self.map.sweep_box(x, y, self.player.w, self.player.h, step_x, step_y)
+            if hit is None:
+                x += step_x
+                y += step_y
+                break
+            time, normal_x, normal_y, tile_x, tile_y = hit
+            remaining = 1 - time
+            wall_collision_occured = True
+
+            # Move up to the wall and then slide along it with whatever movement is left
+            # We place the player exactly against the tile so rounding errors never push it inside
+            if normal_x != 0:
+                y += step_y * time
+                if normal_x < 0:
+                    x = (tile_x * self.map.TILE_WIDTH) - self.player.w
+                else:
+                    x = (tile_x + 1) * self.map.TILE_WIDTH
+                step_x = 0
+                step_y = step_y * remaining
+            else:
+                x += step_x * time
+                if normal_y < 0:
+                    y = (tile_y * self.map.TILE_HEIGHT) - self.player.h
+                else:
+                    y = (tile_y + 1) * self.map.TILE_HEIGHT
+                step_x = step_x * remaining
+                step_y = 0
+
+        self.player.x = x
+        self.player.y = y
+        if wall_collision_occured:
+            self.player.handle_collision()
+        else:
+            self.player.on_wall = False
+
+    def apply_input(self, event_type, action, value):
+        """
+        Applies a single input event to the player
+        Returns true if the event changed the player's state
+        """
+        if action == inputqueue.ACTION_PLAYER_HORIZ or action == inputqueue.ACTION_PLAYER_VERT:
+            old_ax = self.player.ax
+            old_ay = self.player.ay
+            self.input_axes[action] = value
+            self.update_player_acceleration()
+            return self.player.ax != old_ax or self.player.ay != old_ay
+        elif action == inputqueue.ACTION_FISH_DASH:
+            if event_type == inputqueue.EVENT_BUTTON_DOWN:
+                old_dash_timer = self.player.dash_timer
+                self.player.dash()
+                return self.player.dash_timer != old_dash_timer
+            else:
+                # If the player released the dash button, enable the dash action
+                could_dash = self.player.can_dash
+                self.player.can_dash = True
+                return not could_dash
+        elif action == inputqueue.ACTION_FISH_SPRINT:
+            was_sprinting = self.player.is_sprinting
+            self.player.is_sprinting = event_type == inputqueue.EVENT_BUTTON_DOWN
+            return self.player.is_sprinting != was_sprinting
+        return False
+
+    def update_player_acceleration(self):
+        """
+        Sets the player acceleration from the movement axes
+        """
+        axis_pos = self.input_axes
+        if axis_pos[0] == 0 or axis_pos[1] == 0:
+            self.player.ax = self.player.MAX_ACC * axis_pos[0]
+            self.player.ay = self.player.MAX_ACC * axis_pos[1]
+        else:
+            hyp = math.sqrt(axis_pos[0] ** 2 + axis_pos[1] ** 2)
+            percentage = hyp / math.sqrt(2)
+            hyp2 = self.player.MAX_ACC * percentage
+            scale = hyp2 / hyp
+            self.player.ax = axis_pos[0] * scale
+            self.player.ay = axis_pos[1] * scale
@@ -0,0 +1,63 @@
+# Mariana
+# Code - Matt Madden
+# startup.py -- Timing of the startup phases, used by the --startup-benchmark flag
+
+import os
+import time
+
+
+def get_process_age():
+    """
+    Returns how many seconds ago this process was started, so timings include interpreter startup and imports
+    Only Linux tells us this (through /proc), everywhere else this returns None
+    """
+    try:
+        stat_file = open("/proc/self/stat")
+        stat = stat_file.read()
+        stat_file.close()
+        uptime_file = open("/proc/uptime")
+        uptime = float(uptime_file.read().split()[0])
+        uptime_file.close()
+        # The process name can have spaces in it so skip past it, the start time is field 22 of the file
+        fields = stat[(stat.rindex(")") + 2):].split()
+        start_ticks = int(fields[19])
+        return uptime - (start_ticks / os.sysconf("SC_CLK_TCK"))
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class StartupTimer():
+    """
+    Records when each startup phase finished, measured from process start when possible
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.from_process_start = False
+        age = get_process_age()
+        if age is not None:
+            self.origin -= age
+            self.from_process_start = True
+        self.last = self.origin
+        self.phases = []
+        self.marked = set()
+
+    def mark(self, name):
+        """
+        Records that the named phase just finished. Each phase is only recorded the first time it's marked
+        """
+        if name in self.marked:
+            return
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last, now - self.origin))
+        self.marked.add(name)
+        self.last = now
+
+    def report(self):
+        """
+        Returns a dict with the duration of each phase and the time since start when it finished, in milliseconds
+        """
+        results = {"from_process_start": self.from_process_start, "phases": []}
+        for name, duration, elapsed in self.phases:
+            results["phases"].append({"phase": name, "ms": duration * 1000, "total_ms": elapsed * 1000})
+        return results